@@ -49,7 +49,8 @@ setup(name='pwspy_gui',
                         'pwspy>=1.0.1',  # Core pws package, available on backmanlab anaconda cloud account.
                         'mpl_qt_viz>1.0.9',  # Plotting package available on PyPi and the backmanlab anaconda cloud account. Written for this project by Nick Anthony
                         'descartes',
-                        'cachetools>=4'],
+                        'cachetools>=4',
+                        'h5py'],
       package_dir={'': 'src'},
       package_data={'pwspy_gui': ['_resources/*',
                               'PWSAnalysisApp/_resources/*']},
@@ -57,5 +58,9 @@ setup(name='pwspy_gui',
 	  entry_points={'gui_scripts': [
           'PWSAnalysis = pwspy_gui.PWSAnalysisApp.__main__:main',
           "ERCreator = pwspy_gui.ExtraReflectanceCreator.__main__:main"
+      ],
+      'console_scripts': [
+          'PWSAnalysis-batch = pwspy_gui.PWSAnalysisApp.batch:main',
+          'PWSAnalysis-worker = pwspy_gui.PWSAnalysisApp.batch:workerMain'
       ]}
 	)
@@ -26,18 +26,20 @@ from __future__ import annotations
 import logging
 import os
 import psutil
+from PyQt5 import QtCore
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QApplication, QMessageBox, QSplashScreen
 from pwspy_gui import __version__ as version
 from pwspy_gui.PWSAnalysisApp._roiManager import _DefaultROIManager, ROIManager
 from pwspy_gui.PWSAnalysisApp.utilities import BlinderDialog, RoiConverter
-from .dialogs import AnalysisSummaryDisplay
+from .dialogs import AnalysisSummaryDisplay, PipelineSettingsDialog, PreviewSettingsDialog
+from ._taskManagers.analysisPipeline import PipelineSettings
+from ._taskManagers.preview import PreviewSettings
 from ._taskManagers.analysisManager import AnalysisManager
 from .mainWindow import PWSWindow
 from . import applicationVars
 from . import resources
 from pwspy_gui.sharedWidgets.extraReflectionManager import ERManager
-from typing import List
 import typing
 import pwspy.dataTypes as pwsdt
 
@@ -58,19 +60,24 @@ class PWSApp(QApplication):
         self.ERManager = ERManager(applicationVars.extraReflectionDirectory)
         logger.debug("Finish constructing ERManager")
         self.window = PWSWindow(self.ERManager, self.roiManager)
+        self.ERManager.setJobManager(self.window.jobManager)  # Extra reflectance downloads will run in the background.
         splash.finish(self.window)
         logger.debug("Finish constructing window")
         self.anMan = AnalysisManager(self)
         self.window.runAction.connect(self.anMan.runList)
-        availableRamGigs = psutil.virtual_memory().available / 1024**3
-        if availableRamGigs > 16:  # Default to parallel analysis if we have more than 16 Gb of ram available.
-            self.parallelProcessing = True  # Determines if analysis and compilation should be run in parallel or not.
-        else:
-            self.parallelProcessing = False  # Determines if analysis and compilation should be run in parallel or not.
+        self.window.previewAction.connect(self.anMan.previewList)
+        self.window.estimateAction.triggered.connect(self.anMan.estimateList)
+        self.aboutToQuit.connect(self.anMan.shutdown)
+        # Default to parallel analysis if we have more than 2 cores. The number of processes is limited based on the available memory when an analysis is run.
+        self.parallelProcessing = (psutil.cpu_count(logical=False) or 1) > 2  # Determines if analysis and compilation should be run in parallel or not.
         self.window.parallelAction.setChecked(self.parallelProcessing)
         self.window.parallelAction.toggled.connect(lambda checked: setattr(self, 'parallelProcessing', checked))
         logger.info(f"Initializing with useParallel set to {self.parallelProcessing}.")
-        self.anMan.analysisDone.connect(lambda name, settings, warningList: AnalysisSummaryDisplay(self.window, warningList, name, settings))
+        self.pipelineSettings = self._loadPipelineSettings()  # Determines the concurrency of the reading, computing, and writing stages of the analysis.
+        self.window.pipelineAction.triggered.connect(self.openPipelineSettingsDialog)
+        self.previewSettings = self._loadPreviewSettings()  # Determines how much the data is reduced when previewing analyses.
+        self.window.previewSettingsAction.triggered.connect(self.openPreviewSettingsDialog)
+        self.anMan.analysisDone.connect(lambda name, settings, warningList, timing: AnalysisSummaryDisplay(self.window, warningList, name, settings, timing))
         self.window.fileDialog.directoryChanged.connect(self.changeDirectory)
         self.window.blindAction.triggered.connect(self.openBlindingDialog)
         self.window.roiConvertAction.triggered.connect(self.convertRois)
@@ -109,6 +116,70 @@ class PWSApp(QApplication):
         self.window.setWindowTitle(f'{QApplication.instance().applicationName()} - {directory}')
         self.workingDirectory = directory
 
+    @staticmethod
+    def _loadPipelineSettings() -> PipelineSettings:
+        settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+        default = PipelineSettings()
+        numWorkers = int(settings.value("pipelineNumWorkers", 0))
+        return PipelineSettings(numReaders=int(settings.value("pipelineNumReaders", default.numReaders)),
+                                numWorkers=numWorkers if numWorkers != 0 else None,
+                                numWriters=int(settings.value("pipelineNumWriters", default.numWriters)),
+                                queueSize=int(settings.value("pipelineQueueSize", default.queueSize)),
+                                referenceCacheGB=float(settings.value("referenceCacheGB", default.referenceCacheGB)),
+                                spillReferences=settings.value("spillReferences", default.spillReferences, type=bool),
+                                fuseAnalyses=settings.value("fuseAnalyses", default.fuseAnalyses, type=bool),
+                                incremental=settings.value("incrementalAnalysis", default.incremental, type=bool),
+                                memoryLimit=float(settings.value("memoryLimit", default.memoryLimit)),
+                                distributedDirectory=settings.value("distributedDirectory", '') or None,
+                                leaseTimeout=float(settings.value("leaseTimeout", default.leaseTimeout)),
+                                timingLog=PipelineSettingsDialog.timingLogPath if settings.value("writeTimingLog", False, type=bool) else None,
+                                tileSize=int(settings.value("tileSize", 0)) or None,
+                                tileOverlap=int(settings.value("tileOverlap", default.tileOverlap)),
+                                compression=settings.value("resultCompression", '') or None,
+                                compressionLevel=int(settings.value("resultCompressionLevel", default.compressionLevel)),
+                                chunking=settings.value("resultChunking", default.chunking),
+                                stageCacheDirectory=applicationVars.stageCacheDirectory if float(settings.value("stageCacheGB", 0)) != 0 else None,
+                                stageCacheGB=float(settings.value("stageCacheGB", 0)) or default.stageCacheGB)
+
+    def openPipelineSettingsDialog(self):
+        dlg = PipelineSettingsDialog(self.window, self.pipelineSettings)
+        if dlg.exec() == PipelineSettingsDialog.Accepted:
+            self.pipelineSettings = dlg.getSettings()
+            settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+            settings.setValue("pipelineNumReaders", self.pipelineSettings.numReaders)
+            settings.setValue("pipelineNumWorkers", self.pipelineSettings.numWorkers if self.pipelineSettings.numWorkers is not None else 0)
+            settings.setValue("pipelineNumWriters", self.pipelineSettings.numWriters)
+            settings.setValue("pipelineQueueSize", self.pipelineSettings.queueSize)
+            settings.setValue("referenceCacheGB", self.pipelineSettings.referenceCacheGB)
+            settings.setValue("spillReferences", self.pipelineSettings.spillReferences)
+            settings.setValue("fuseAnalyses", self.pipelineSettings.fuseAnalyses)
+            settings.setValue("incrementalAnalysis", self.pipelineSettings.incremental)
+            settings.setValue("memoryLimit", self.pipelineSettings.memoryLimit)
+            settings.setValue("distributedDirectory", self.pipelineSettings.distributedDirectory or '')
+            settings.setValue("leaseTimeout", self.pipelineSettings.leaseTimeout)
+            settings.setValue("writeTimingLog", self.pipelineSettings.timingLog is not None)
+            settings.setValue("tileSize", self.pipelineSettings.tileSize or 0)
+            settings.setValue("tileOverlap", self.pipelineSettings.tileOverlap)
+            settings.setValue("resultCompression", self.pipelineSettings.compression or '')
+            settings.setValue("resultCompressionLevel", self.pipelineSettings.compressionLevel)
+            settings.setValue("resultChunking", self.pipelineSettings.chunking)
+            settings.setValue("stageCacheGB", self.pipelineSettings.stageCacheGB if self.pipelineSettings.stageCacheDirectory is not None else 0)
+
+    @staticmethod
+    def _loadPreviewSettings() -> PreviewSettings:
+        settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+        default = PreviewSettings()
+        return PreviewSettings(spatialBinning=int(settings.value("previewBinning", default.spatialBinning)),
+                               spectralStride=int(settings.value("previewSpectralStride", default.spectralStride)))
+
+    def openPreviewSettingsDialog(self):
+        dlg = PreviewSettingsDialog(self.window, self.previewSettings)
+        if dlg.exec() == PreviewSettingsDialog.Accepted:
+            self.previewSettings = dlg.getSettings()
+            settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+            settings.setValue("previewBinning", self.previewSettings.spatialBinning)
+            settings.setValue("previewSpectralStride", self.previewSettings.spectralStride)
+
     def openBlindingDialog(self):
         metas = self.window.cellSelector.getSelectedCellMetas()
         if len(metas) == 0:
@@ -59,6 +59,42 @@ class AbstractRuntimeAnalysisSettings(ABC):
         """
         pass
 
+    @abstractmethod
+    def getOutputProfile(self) -> str:
+        """
+
+        Returns:
+            Determines which datasets of the results are saved. Either `maps` or `full`. See `outputProfile`.
+        """
+        pass
+
+    @abstractmethod
+    def getRoiNamePattern(self) -> typing.Optional[str]:
+        """
+
+        Returns:
+            A regex. If not `None` then only the bounding box of the ROIs with matching names is analyzed.
+        """
+        pass
+
+    @abstractmethod
+    def getCompileRoiNamePattern(self) -> typing.Optional[str]:
+        """
+
+        Returns:
+            A regex. If not `None` then the ROIs with matching names are compiled right after each cell is analyzed.
+        """
+        pass
+
+    @abstractmethod
+    def getSinglePrecision(self) -> bool:
+        """
+
+        Returns:
+            If `True` then the data is processed and the results are saved as 32-bit floats to save memory.
+        """
+        pass
+
 
 @dataclasses.dataclass
 class DynamicsRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inherit docstring
@@ -67,6 +103,10 @@ class DynamicsRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inher
     referenceMetadata: pwsdt.DynMetaData
     cellMetadata: typing.List[pwsdt.DynMetaData]
     analysisName: str
+    outputProfile: str = 'full'
+    roiNamePattern: typing.Optional[str] = None
+    compileRoiNamePattern: typing.Optional[str] = None
+    singlePrecision: bool = False
 
     def getSaveableSettings(self) -> DynamicsAnalysisSettings:  # Inherit docstring
         return self.settings
@@ -83,6 +123,18 @@ class DynamicsRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inher
     def getExtraReflectanceMetadata(self) -> pwsdt.ERMetaData:
         return self.extraReflectanceMetadata
 
+    def getOutputProfile(self) -> str:
+        return self.outputProfile
+
+    def getRoiNamePattern(self) -> typing.Optional[str]:
+        return self.roiNamePattern
+
+    def getCompileRoiNamePattern(self) -> typing.Optional[str]:
+        return self.compileRoiNamePattern
+
+    def getSinglePrecision(self) -> bool:
+        return self.singlePrecision
+
 
 @dataclasses.dataclass
 class PWSRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inherit docstring
@@ -91,6 +143,10 @@ class PWSRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inherit do
     referenceMetadata: pwsdt.PwsMetaData
     cellMetadata: typing.List[pwsdt.PwsMetaData]
     analysisName: str
+    outputProfile: str = 'full'
+    roiNamePattern: typing.Optional[str] = None
+    compileRoiNamePattern: typing.Optional[str] = None
+    singlePrecision: bool = False
 
     def getSaveableSettings(self) -> PWSAnalysisSettings:
         return self.settings
@@ -106,3 +162,15 @@ class PWSRuntimeAnalysisSettings(AbstractRuntimeAnalysisSettings):  # Inherit do
 
     def getExtraReflectanceMetadata(self) -> pwsdt.ERMetaData:
         return self.extraReflectanceMetadata
+
+    def getOutputProfile(self) -> str:
+        return self.outputProfile
+
+    def getRoiNamePattern(self) -> typing.Optional[str]:
+        return self.roiNamePattern
+
+    def getCompileRoiNamePattern(self) -> typing.Optional[str]:
+        return self.compileRoiNamePattern
+
+    def getSinglePrecision(self) -> bool:
+        return self.singlePrecision
@@ -27,7 +27,7 @@ from pwspy_gui.PWSAnalysisApp.componentInterfaces import CellSelector
 from pwspy.utility.reflection import Material
 from ._AbstractSettingsFrame import AbstractSettingsFrame
 
-from ._sharedWidgets import ExtraReflectanceSelector, VerticallyCompressedWidget, HardwareCorrections
+from ._sharedWidgets import ExtraReflectanceSelector, VerticallyCompressedWidget, HardwareCorrections, OutputProfileSelector, RoiRestrictionSelector, RoiCompilationSelector
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock.runtimeSettings import DynamicsRuntimeAnalysisSettings
 if typing.TYPE_CHECKING:
     from pwspy_gui.sharedWidgets.extraReflectionManager import ERManager
@@ -73,18 +73,34 @@ class DynamicsSettingsFrame(QScrollArea, AbstractSettingsFrame):
         self.relativeUnits.setChecked(True)
         self.scaling.layout().addWidget(self.relativeUnits)
         self._layout.addWidget(self.scaling, row, 0, 1, 4)
+        row += 1
+
+        self.outputProfile = OutputProfileSelector(self, 'DynamicsAnalysis', lambda: [acq.dynamics for acq in self.cellSelector.getSelectedCellMetas()])
+        self._layout.addWidget(self.outputProfile, row, 0, 1, 4)
+        row += 1
+
+        self.roiRestriction = RoiRestrictionSelector(self)
+        self._layout.addWidget(self.roiRestriction, row, 0, 1, 4)
+        row += 1
+
+        self.roiCompilation = RoiCompilationSelector(self)
+        self._layout.addWidget(self.roiCompilation, row, 0, 1, 4)
 
         self._updateSize()
 
     def showEvent(self, a0: QtGui.QShowEvent) -> None:
         super().showEvent(a0)
         self._updateSize() #For some reason this must be done here and in the __init__ for it to start up properly.
+        self.outputProfile.updateEstimate()  # The selected cells may have changed.
 
     def _updateSize(self):
         height = 100  # give this much excess room.
         height += self.hardwareCorrections.height()
         height += self.extraReflection.height()
         height += self.scaling.height()
+        height += self.outputProfile.height()
+        height += self.roiRestriction.height()
+        height += self.roiCompilation.height()
         self._frame.setFixedHeight(height)
 
     def loadFromSettings(self, settings: pwspy.analysis.dynamics.DynamicsAnalysisSettings):
@@ -117,4 +133,8 @@ class DynamicsSettingsFrame(QScrollArea, AbstractSettingsFrame):
                                                                        extraReflectanceMetadata=erMetadata,
                                                                        referenceMetadata=refMeta,
                                                                        cellMetadata=cellMeta,
-                                                                       analysisName=name)
+                                                                       analysisName=name,
+                                                                       outputProfile=self.outputProfile.getProfile(),
+                                                                       roiNamePattern=self.roiRestriction.getPattern(),
+                                                                       compileRoiNamePattern=self.roiCompilation.getPattern(),
+                                                                       singlePrecision=self.outputProfile.getSinglePrecision())
@@ -22,7 +22,8 @@ import typing
 
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock.widgets.SettingsFrames._AbstractSettingsFrame import AbstractSettingsFrame
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock.widgets.SettingsFrames._sharedWidgets import ExtraReflectanceSelector, HardwareCorrections, \
-    QHSpinBox, QHDoubleSpinBox, VerticallyCompressedWidget
+    QHSpinBox, QHDoubleSpinBox, VerticallyCompressedWidget, OutputProfileSelector, RoiRestrictionSelector, \
+    RoiCompilationSelector
 from pwspy_gui.PWSAnalysisApp.componentInterfaces import CellSelector
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock.runtimeSettings import PWSRuntimeAnalysisSettings
 if typing.TYPE_CHECKING:
@@ -221,11 +222,27 @@ class PWSSettingsFrame(AbstractSettingsFrame, QScrollArea):
         self._layout.addWidget(self.advanced, row, 0, 1, 4)
         row += 1
 
+        '''Output Profile'''
+        self.outputProfile = OutputProfileSelector(self, 'PWSAnalysis', lambda: [acq.pws for acq in self.cellSelector.getSelectedCellMetas()])
+        self._layout.addWidget(self.outputProfile, row, 0, 1, 4)
+        row += 1
+
+        '''ROI Restriction'''
+        self.roiRestriction = RoiRestrictionSelector(self)
+        self._layout.addWidget(self.roiRestriction, row, 0, 1, 4)
+        row += 1
+
+        '''ROI Compilation'''
+        self.roiCompilation = RoiCompilationSelector(self)
+        self._layout.addWidget(self.roiCompilation, row, 0, 1, 4)
+        row += 1
+
         self._updateSize()
 
     def showEvent(self, a0: QtGui.QShowEvent) -> None:
         super().showEvent(a0)
         self._updateSize() #For some reason this must be done here and in the __init__ for it to start up properly.
+        self.outputProfile.updateEstimate()  # The selected cells may have changed.
 
     def _updateSize(self):
         height = 100  # give this much excess room.
@@ -236,6 +253,9 @@ class PWSSettingsFrame(AbstractSettingsFrame, QScrollArea):
         height += self.signalPrep.height()
         height += self.polySub.height()
         height += self.advanced.height()
+        height += self.outputProfile.height()
+        height += self.roiRestriction.height()
+        height += self.roiCompilation.height()
         self._frame.setFixedHeight(height)
 
     def loadFromSettings(self, settings: PWSAnalysisSettings):
@@ -301,7 +321,11 @@ class PWSSettingsFrame(AbstractSettingsFrame, QScrollArea):
                                           extraReflectanceMetadata=erMetadata,
                                           referenceMetadata=refMeta,
                                           cellMetadata=cellMeta,
-                                          analysisName=name)
+                                          analysisName=name,
+                                          outputProfile=self.outputProfile.getProfile(),
+                                          roiNamePattern=self.roiRestriction.getPattern(),
+                                          compileRoiNamePattern=self.roiCompilation.getPattern(),
+                                          singlePrecision=self.outputProfile.getSinglePrecision())
 
 
 
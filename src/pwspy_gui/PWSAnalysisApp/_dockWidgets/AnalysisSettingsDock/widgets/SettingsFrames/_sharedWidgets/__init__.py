@@ -17,17 +17,20 @@
 
 from __future__ import annotations
 import os
+import re
 import typing as t_
 from PyQt5 import QtGui, QtCore
 from PyQt5.QtGui import QPalette, QValidator, QDoubleValidator
 from PyQt5.QtWidgets import QGroupBox, QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QHBoxLayout, QMessageBox, QGridLayout, QSpinBox, QDoubleSpinBox, \
-    QComboBox, QFrame, QSpacerItem, QSizePolicy, QLayout
+    QComboBox, QFrame, QSpacerItem, QSizePolicy, QLayout, QCheckBox
 
 from pwspy_gui import resources
 from pwspy_gui.PWSAnalysisApp.sharedWidgets import CollapsibleSection
 from pwspy.dataTypes import CameraCorrection, ERMetaData
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import OUTPUT_PROFILES, PROFILE_NAMES, estimateResultBytes
 from pwspy.utility.reflection import reflectanceHelper, Material
 if t_.TYPE_CHECKING:
+    from pwspy.dataTypes import AnalysisManagerMetaDataBase
     from pwspy_gui.sharedWidgets.extraReflectionManager import ERManager
 
 
@@ -209,6 +212,115 @@ class HardwareCorrections(CollapsibleSection):
             return self.state, inp, pos
 
 
+class OutputProfileSelector(QGroupBox):
+    """Selects which datasets of the analysis results are saved and shows the estimated disk space used by the results
+    of the selected cells.
+
+    Args:
+        parent: The parent widget.
+        analysisType: The class name of the analysis, e.g. `PWSAnalysis`.
+        getSelectedMetas: Returns the metadata of the acquisitions that would be analyzed.
+    """
+    SAMPLE_SIZE = 20  # Only this many cells are checked when estimating the size. Checking the size of files on a network drive can be slow.
+
+    def __init__(self, parent: QWidget, analysisType: str, getSelectedMetas: t_.Callable[[], t_.Sequence[AnalysisManagerMetaDataBase]]):
+        super().__init__("Output", parent)
+        self._analysisType = analysisType
+        self._getSelectedMetas = getSelectedMetas
+        self.setToolTip("Determines which datasets of the analysis results are saved. The normalized reflectance cube is by far the largest dataset.\n"
+                        "`Maps Only` saves only the 2D images (RMS, reflectance, etc.). `Full Cube` saves everything, the PWS reflectance cube\n"
+                        "is needed to view the OPD.")
+        layout = QGridLayout()
+        layout.setContentsMargins(5, 1, 5, 5)
+        self._combo = QHComboBox()
+        for profile in OUTPUT_PROFILES:
+            self._combo.addItem(PROFILE_NAMES[profile], profile)
+        self._combo.setCurrentIndex(OUTPUT_PROFILES.index('full'))
+        self._estimateLabel = QLabel()
+        self._estimateLabel.setWordWrap(True)
+        layout.addWidget(QLabel("Save"), 0, 0)
+        layout.addWidget(self._combo, 0, 1)
+        layout.addWidget(self._estimateLabel, 1, 0, 1, 2)
+        self._singlePrecision = QCheckBox("Single Precision", self)
+        self._singlePrecision.setToolTip("Process the data and save the results as 32-bit floats. This roughly halves the memory used by each analysis process.\n"
+                                         "The rounding error is far smaller than the noise of the data.")
+        layout.addWidget(self._singlePrecision, 2, 0, 1, 2)
+        self.setLayout(layout)
+        self._combo.currentIndexChanged.connect(self.updateEstimate)
+
+    def getProfile(self) -> str:
+        return self._combo.currentData()
+
+    def setProfile(self, profile: str):
+        self._combo.setCurrentIndex(OUTPUT_PROFILES.index(profile))
+
+    def getSinglePrecision(self) -> bool:
+        return self._singlePrecision.isChecked()
+
+    def setSinglePrecision(self, singlePrecision: bool):
+        self._singlePrecision.setChecked(singlePrecision)
+
+    def updateEstimate(self):
+        metas = [md for md in self._getSelectedMetas() if md is not None]
+        if len(metas) == 0:
+            self._estimateLabel.setText("Select cells to estimate the size of the results.")
+            return
+        sample = metas[:self.SAMPLE_SIZE]
+        sizes = [(estimateResultBytes(md, self._analysisType, self.getProfile()), estimateResultBytes(md, self._analysisType, 'full')) for md in sample]
+        sizes = [s for s in sizes if s[0] is not None]
+        if len(sizes) == 0:
+            self._estimateLabel.setText("The size of the results can't be estimated.")
+            return
+        scale = len(metas) / len(sizes)
+        size, fullSize = sum(s[0] for s in sizes) * scale, sum(s[1] for s in sizes) * scale
+        saving = 1 - size / fullSize if fullSize > 0 else 0
+        self._estimateLabel.setText(f"~{size / 1024**3:.2f} GB for {len(metas)} cells" + (f", {saving:.0%} less than the full cube." if saving > 0 else "."))
+
+
+class RoiRestrictionSelector(QGroupBox):
+    """Restricts the analysis to the bounding box of the ROIs whose names match a regex. Only those pixels are analyzed
+    and the rest of the results are left as zero."""
+    def __init__(self, parent: QWidget):
+        super().__init__("Restrict to ROIs", parent)
+        self.setCheckable(True)
+        self.setChecked(False)
+        self.setToolTip("If checked then only the pixels in the bounding box of the ROIs with names matching the pattern are analyzed.\n"
+                        "The rest of the results will be zero. Cells without any matching ROIs are skipped.")
+        layout = QHBoxLayout()
+        layout.setContentsMargins(5, 1, 5, 5)
+        self._pattern = QLineEdit(".*", self)
+        self._pattern.setToolTip("A regular expression matching the names of the ROIs, e.g. `nuc.*`")
+        layout.addWidget(QLabel("ROI Name"))
+        layout.addWidget(self._pattern)
+        self.setLayout(layout)
+
+    def getPattern(self) -> t_.Optional[str]:
+        """Returns the regex of the ROI names, or `None` if the analysis isn't restricted."""
+        if not self.isChecked():
+            return None
+        pattern = self._pattern.text()
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"The ROI name pattern `{pattern}` is not a valid regular expression: {e}")
+        return pattern
+
+    def setPattern(self, pattern: t_.Optional[str]):
+        self.setChecked(pattern is not None)
+        if pattern is not None:
+            self._pattern.setText(pattern)
+
+
+class RoiCompilationSelector(RoiRestrictionSelector):
+    """Compiles the ROIs whose names match a regex as soon as each cell has been analyzed, while the results are still
+    in memory. The values selected in the results table are compiled and can then be loaded there instantly."""
+    def __init__(self, parent: QWidget):
+        super().__init__(parent)
+        self.setTitle("Compile ROIs")
+        self.setToolTip("If checked then the ROIs with names matching the pattern are compiled right after each cell is analyzed.\n"
+                        "The values selected in the results table are compiled. Use `Load Saved` in the results table to view them.")
+
+
 def humble(clas):
     """Returns a subclass of clas that will not allow scrolling unless it has been actively selected."""
     class HumbleDoubleSpinBox(clas):
@@ -28,6 +28,7 @@ from pwspy_gui.PWSAnalysisApp._dockWidgets.CellSelectorDock.widgets import Refer
 from .widgets import CellTableWidgetItem, CellTableWidget, ReferencesTable
 from pwspy_gui.PWSAnalysisApp.componentInterfaces import CellSelector, ROIManager
 from pwspy_gui.PWSAnalysisApp.pluginInterfaces import CellSelectorPluginSupport
+from pwspy_gui.sharedWidgets.jobManager import JobManager
 from ...sharedWidgets import ScrollableMessageBox
 import typing as t_
 
@@ -36,8 +37,9 @@ class CellSelectorDock(CellSelector, QDockWidget):
     """This dockwidget is used by the user to select which cells they want to act upon (run an analysis, plot, etc.)"""
 
     # noinspection PyUnresolvedReferences
-    def __init__(self, parent: QWidget, roiManager: ROIManager):
+    def __init__(self, parent: QWidget, roiManager: ROIManager, jobManager: JobManager):
         super().__init__("Cell Selector", parent=parent)
+        self._jobManager = jobManager
         self._pluginSupport = CellSelectorPluginSupport(self, self)
         self._roiManager = roiManager
         self._roiManager.roiCreated.connect(lambda roiFile: self.refreshCellItems([roiFile.acquisition]))
@@ -184,6 +186,9 @@ class CellSelectorDock(CellSelector, QDockWidget):
     def getRoiManager(self) -> ROIManager:
         return self._roiManager
 
+    def getJobManager(self) -> JobManager:
+        return self._jobManager
+
     def loadNewCells(self, fileNames: t_.List[str], workingDir: str):
         self._clearCells()
         acqs = []
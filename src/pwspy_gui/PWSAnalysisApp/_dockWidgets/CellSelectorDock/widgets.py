@@ -26,6 +26,7 @@ from PyQt5.QtWidgets import QPushButton, QTableWidgetItem, QTableWidget, QAbstra
     QInputDialog, QHeaderView
 
 from pwspy_gui.PWSAnalysisApp.sharedWidgets import ScrollableMessageBox
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPreparation import removeAnalyses
 from pwspy.dataTypes import Acquisition, PwsMetaData, DynMetaData
 
 from pwspy_gui.PWSAnalysisApp.sharedWidgets.dictDisplayTree import DictDisplayTreeDialog
@@ -352,7 +353,7 @@ class CellTableWidget(QTableWidget):
                 f"\nPWS: {', '.join([os.path.split(i.acquisitionDirectory.filePath)[-1] for i in deletableCells if isinstance(i, PwsMetaData)])}"
                 f"\nDynamics: {', '.join([os.path.split(i.acquisitionDirectory.filePath)[-1] for i in deletableCells if isinstance(i, DynMetaData)])}")
             if ret == QMessageBox.Yes:
-                [i.removeAnalysis(anName) for i in deletableCells]
+                removeAnalyses(deletableCells, anName)
             self.refreshCellItems()
 
     def _deleteRoisByName(self):
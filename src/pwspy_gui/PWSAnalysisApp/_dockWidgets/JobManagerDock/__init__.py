@@ -0,0 +1,138 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+import typing
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QDockWidget, QWidget, QTableWidget, QTableWidgetItem, QProgressBar, QPushButton, \
+    QGridLayout, QSpinBox, QLabel, QAbstractItemView, QHeaderView
+
+from pwspy_gui.sharedWidgets.jobManager import JobManager, Job
+
+
+def _formatDuration(seconds: typing.Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours > 0:
+        return f"{hours}h {minutes:02d}m"
+    else:
+        return f"{minutes}m {seconds:02d}s"
+
+
+class JobManagerDock(QDockWidget):
+    """Displays the jobs of a `JobManager` with their progress. Allows the user to cancel jobs and to change how many
+    jobs can run at once."""
+    _columns = ('Job', 'Status', 'Progress', 'Rate', 'ETA', '')
+
+    def __init__(self, parent: QWidget, jobManager: JobManager):
+        super().__init__("Jobs", parent=parent)
+        self.setStyleSheet("QDockWidget > QWidget { border: 1px solid lightgray; }")
+        self.setObjectName('JobManagerDock')  # needed for restore state to work
+        self._jobManager = jobManager
+        self._rows: typing.Dict[Job, int] = {}
+
+        self._table = QTableWidget(0, len(self._columns), self)
+        self._table.setHorizontalHeaderLabels(self._columns)
+        self._table.setSelectionMode(QAbstractItemView.NoSelection)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._table.verticalHeader().setVisible(False)
+        self._table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+
+        self._concurrentSpinBox = QSpinBox(self)
+        self._concurrentSpinBox.setRange(1, 16)
+        self._concurrentSpinBox.setToolTip("The maximum number of jobs that will be run at the same time. Each job may use multiple cores if `Multi-Core Analysis` is enabled.")
+        settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+        self._concurrentSpinBox.setValue(int(settings.value("maxConcurrentJobs", self._jobManager.maxConcurrent)))
+        self._jobManager.setMaxConcurrent(self._concurrentSpinBox.value())
+        self._concurrentSpinBox.valueChanged.connect(self._maxConcurrentChanged)
+
+        self._clearButton = QPushButton("Clear Finished", self)
+        self._clearButton.released.connect(self._jobManager.clearFinished)
+        self._cancelAllButton = QPushButton("Cancel All", self)
+        self._cancelAllButton.released.connect(self._jobManager.cancelAll)
+
+        widg = QWidget(self)
+        layout = QGridLayout()
+        layout.addWidget(self._table, 0, 0, 1, 4)
+        layout.addWidget(QLabel("Max Concurrent Jobs:"), 1, 0, 1, 1)
+        layout.addWidget(self._concurrentSpinBox, 1, 1, 1, 1)
+        layout.addWidget(self._clearButton, 1, 2, 1, 1)
+        layout.addWidget(self._cancelAllButton, 1, 3, 1, 1)
+        widg.setLayout(layout)
+        self.setWidget(widg)
+
+        self._jobManager.jobAdded.connect(self._addJob)
+        self._jobManager.jobRemoved.connect(self._removeJob)
+        self._refreshTimer = QtCore.QTimer(self)  # Update the rate and ETA columns periodically, even if no progress is reported.
+        self._refreshTimer.setInterval(1000)
+        self._refreshTimer.timeout.connect(self._refreshAll)
+        self._refreshTimer.start()
+
+    def _maxConcurrentChanged(self, value: int):
+        self._jobManager.setMaxConcurrent(value)
+        settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
+        settings.setValue("maxConcurrentJobs", value)
+
+    def _addJob(self, job: Job):
+        row = self._table.rowCount()
+        self._table.insertRow(row)
+        self._rows[job] = row
+        self._table.setItem(row, 0, QTableWidgetItem(job.name))
+        self._table.item(row, 0).setToolTip(job.name)
+        self._table.setItem(row, 1, QTableWidgetItem())
+        bar = QProgressBar(self._table)
+        bar.setFormat(f"%v/%m {job.unitName}")
+        self._table.setCellWidget(row, 2, bar)
+        self._table.setItem(row, 3, QTableWidgetItem())
+        self._table.setItem(row, 4, QTableWidgetItem())
+        cancelButton = QPushButton("Cancel", self._table)
+        cancelButton.released.connect(lambda j=job: self._jobManager.cancel(j))
+        self._table.setCellWidget(row, 5, cancelButton)
+        job.changed.connect(lambda j=job: self._updateRow(j))
+        self._updateRow(job)
+
+    def _removeJob(self, job: Job):
+        row = self._rows.pop(job)
+        self._table.removeRow(row)
+        for j, r in self._rows.items():  # Rows after the removed one shift up.
+            if r > row:
+                self._rows[j] = r - 1
+
+    def _updateRow(self, job: Job):
+        if job not in self._rows:
+            return
+        row = self._rows[job]
+        self._table.item(row, 1).setText(job.status.value)
+        if job.error is not None:
+            self._table.item(row, 1).setToolTip(str(job.error))
+        elif job.message:
+            self._table.item(row, 1).setToolTip(job.message)
+        bar: QProgressBar = self._table.cellWidget(row, 2)
+        bar.setMaximum(max(job.total, 1))
+        bar.setValue(job.completed)
+        rate = job.throughput()
+        self._table.item(row, 3).setText('-' if rate is None else f"{rate:.1f} {job.unitName}/min")
+        self._table.item(row, 4).setText(_formatDuration(job.eta()))
+        self._table.cellWidget(row, 5).setEnabled(job.status in (Job.Status.Queued, Job.Status.Running))
+
+    def _refreshAll(self):
+        for job in self._rows:
+            if job.status == Job.Status.Running:
+                self._updateRow(job)
@@ -17,7 +17,7 @@
 
 import logging
 import os
-from typing import List
+from typing import List, Tuple
 
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QDockWidget, QWidget, QHBoxLayout, QScrollArea, QVBoxLayout, QPushButton, QMessageBox, \
@@ -212,6 +212,23 @@ class PlottingDock(QDockWidget):
                     plot.changeData(plot.PlotFields.Thumbnail)
             self._lastButton = button
 
+    def showPreview(self, analysisName: str, results: List[Tuple[pwsdt.Acquisition, ConglomerateAnalysisResults]]):
+        """Display the results of a preview analysis. These aren't saved with the acquisitions, so they are replaced
+        by the saved analyses the next time the plots are refreshed. The results are low resolution so ROIs can't be
+        drawn on them."""
+        for i in self._plots:
+            self._scrollContents.layout().removeWidget(i)
+            i.deleteLater()
+        self._plots = []
+        self.cellMetas = [acq for acq, analysis in results]
+        self._addPlots([LittlePlot(acq, analysis, f"Preview: {analysisName} {os.path.split(acq.filePath)[-1]}",
+                                   initialField=LittlePlot.PlotFields.RMS if analysis.pws is not None else LittlePlot.PlotFields.RMS_t_squared)
+                        for acq, analysis in results])
+        self._enableAnalysisPlottingButtons('true' if len(results) > 0 else 'false')
+        self._roiButton.setEnabled(False)
+        self._lastButton = None  # Let any button change the plots.
+        self.raise_()
+
     def setAnalysisName(self, name: str):
         self._anNameEdit.setText(name)
 
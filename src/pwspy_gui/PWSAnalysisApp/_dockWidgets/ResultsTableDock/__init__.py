@@ -59,10 +59,15 @@ class ResultsTableControllerDock(ResultsTableController, QDockWidget):
         self._analysisNameEdit = QLineEdit('.*', self._widget)
         self._analysisNameEdit.setToolTip("Analyses matching this RegEx pattern will be compiled.")
         self._compileButton = QPushButton("Compile")
+        self._loadSavedButton = QPushButton("Load Saved")
+        self._loadSavedButton.setToolTip("Load the ROIs that were compiled while the cells were being analyzed. This is much faster than compiling.")
 
         self._compMan = CompilationManager(self.window())
         self._compileButton.released.connect(self._compMan.run)
+        self._loadSavedButton.released.connect(self._compMan.loadSaved)
         self._compMan.compilationDone.connect(self._handleCompilationResults)
+        self._compMan.compilationStarted.connect(self.clearCompilationResults)
+        self._compMan.compilationProgressed.connect(self._handlePartialResult)
 
         scroll = QScrollArea()
         scroll.setWidget(checkBoxFrame)
@@ -78,6 +83,7 @@ class ResultsTableControllerDock(ResultsTableController, QDockWidget):
         l.addWidget(QLabel("Roi:"), 2, 0, 1, 1)
         l.addWidget(self._roiNameEdit, 2, 1, 1, 1)
         l.addWidget(self._compileButton, 3, 0, 1, 2)
+        l.addWidget(self._loadSavedButton, 4, 0, 1, 2)
         sidebar.setLayout(l)
         sidebar.setMaximumWidth(scroll.width()+10)
         self._widget.layout().addWidget(sidebar, 0, 0)
@@ -116,6 +122,11 @@ class ResultsTableControllerDock(ResultsTableController, QDockWidget):
     def getAnalysisName(self) -> str:
         return self._analysisNameEdit.text()
 
+    def _handlePartialResult(self, inVal: typing.Tuple[Acquisition, typing.List[typing.Tuple[ConglomerateCompilerResults, typing.Optional[typing.List[AnalysisWarning]]]]]):
+        """Show the results of a single acquisition as soon as it has been compiled. The table is filled again in order once the whole compilation is done."""
+        acq, roiList = inVal
+        [self.addCompilationResult(r, acq) for r, warnings in roiList]
+
     def _handleCompilationResults(self, inVal: typing.List[typing.Tuple[Acquisition, typing.List[typing.Tuple[ConglomerateCompilerResults, typing.Optional[typing.List[AnalysisWarning]]]]]]):
         #  Display warnings if necessary.
         warningStructure = []
@@ -18,4 +18,5 @@
 from .AnalysisSettingsDock import AnalysisSettingsDock
 from .CellSelectorDock import CellSelectorDock
 from .PlottingDock import PlottingDock
-from .ResultsTableDock import ResultsTableControllerDock
\ No newline at end of file
+from .ResultsTableDock import ResultsTableControllerDock
+from .JobManagerDock import JobManagerDock
\ No newline at end of file
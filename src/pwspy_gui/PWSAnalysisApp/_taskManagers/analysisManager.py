@@ -17,25 +17,39 @@
 
 from __future__ import annotations
 
+import dataclasses
 import logging
 import os
 from typing import Tuple, List, Optional
 import typing
-from PyQt5.QtCore import QThread
+import psutil
 
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock import AbstractRuntimeAnalysisSettings
 from pwspy_gui.PWSAnalysisApp.sharedWidgets import ScrollableMessageBox
-from pwspy_gui.sharedWidgets.dialogs import BusyDialog
+from pwspy_gui.sharedWidgets.jobManager import JobThread, Job
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPipeline import AnalysisPipeline, PipelineSettings, AnalysisTask
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import WorkerPool
+from pwspy_gui.PWSAnalysisApp._taskManagers.distributedQueue import DistributedPipeline
+from pwspy_gui.PWSAnalysisApp._taskManagers.referenceCache import ReferenceCache
+from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+from pwspy_gui.PWSAnalysisApp._taskManagers.memoryScheduler import MemoryScheduler
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import droppedFields
+from pwspy_gui.PWSAnalysisApp._taskManagers.costEstimator import CostEstimate, CostEstimator
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import CellTiming
+from pwspy_gui.PWSAnalysisApp._taskManagers.preview import PreviewSettings, previewDirectory, reduceAnalysis
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import RoiCompilation
+from pwspy_gui.PWSAnalysisApp._taskManagers.precision import narrowAnalysis
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPreparation import checkAutoCorrectionConsistency, findCellsWithoutRois, findExistingAnalyses, removeAnalyses
+from pwspy_gui.PWSAnalysisApp import applicationVars
+from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateAnalysisResults
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QMessageBox, QInputDialog
 import pwspy.dataTypes as pwsdt
 from pwspy.analysis import AbstractAnalysisSettings, AbstractAnalysis
-from pwspy.analysis.dynamics import DynamicsAnalysis
-from pwspy.analysis.pws import PWSAnalysis
+from pwspy.analysis.dynamics import DynamicsAnalysis, DynamicsAnalysisResults
+from pwspy.analysis.pws import PWSAnalysis, PWSAnalysisResults
 from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock.runtimeSettings import PWSRuntimeAnalysisSettings, DynamicsRuntimeAnalysisSettings
-from pwspy.analysis.warnings import AnalysisWarning
 from pwspy.dataTypes import ICRawBase, PwsMetaData, DynMetaData
-from pwspy.utility.fileIO import loadAndProcess
 if typing.TYPE_CHECKING:
     from pwspy_gui.PWSAnalysisApp.App import PWSApp
 
@@ -44,43 +58,184 @@ def safeCallback(func):
     """A decorator to make a function print its traceback without crashing."""
     def newFunc(*args):
         try:
-            func(*args)
+            return func(*args)
         except Exception as e:
             logger = logging.getLogger(__name__)
             logger.exception(e)
     return newFunc
 
 
+class _PreparedAnalysis(typing.NamedTuple):
+    """An analysis that has been initialized and is ready to be run."""
+    settings: AbstractRuntimeAnalysisSettings
+    analysis: AbstractAnalysis
+    cellMetas: List[pwsdt.AnalysisManagerMetaDataBase]  # The acquisitions that need to be analyzed. May exclude some of the acquisitions in `settings` when running incrementally.
+    cameraCorrection: Optional[pwsdt.CameraCorrection]
+    userSpecifiedBinning: Optional[int]
+    marker: CompletionMarker
+
+
 class AnalysisManager(QtCore.QObject):
-    analysisDone = QtCore.pyqtSignal(str, AbstractAnalysisSettings, list)
+    analysisDone = QtCore.pyqtSignal(str, AbstractAnalysisSettings, list, object)  # Name, settings, warnings, TimingRecorder
 
     def __init__(self, app: PWSApp):
         super().__init__()
         self.app = app
+        self._workerPool: Optional[WorkerPool] = None  # Kept alive between analyses so we don't pay the cost of spawning processes each time.
+        self._referenceCache: Optional[ReferenceCache] = None
+        self._specifiedBinnings: typing.Dict[str, int] = {}  # The binning that the user specified for a reference, keyed by the reference idTag.
+        self._timingHistory: List[CellTiming] = []  # The timings of the analyses run this session. Used to calibrate cost estimates.
+
+    def getWorkerPool(self) -> WorkerPool:
+        """Return the pool of analysis processes shared by all analyses. A new pool is started if the number of
+        workers in the pipeline settings has changed, the old one exits once the analyses using it are done."""
+        numWorkers = max(1, self.app.pipelineSettings.getNumWorkers())
+        if self._workerPool is None or self._workerPool.numWorkers != numWorkers:
+            if self._workerPool is not None:
+                self._workerPool.shutdown(wait=False)
+            self._workerPool = WorkerPool(numWorkers)
+        return self._workerPool
+
+    def getReferenceCache(self) -> Optional[ReferenceCache]:
+        """Return the cache of processed references, configured according to the pipeline settings. `None` if
+        the cache is disabled."""
+        settings = self.app.pipelineSettings
+        maxMemory = int(settings.referenceCacheGB * 1024**3)
+        spillDirectory = applicationVars.referenceCacheDirectory if settings.spillReferences else None
+        if maxMemory == 0 and spillDirectory is None:
+            self._referenceCache = None
+        elif self._referenceCache is None or (self._referenceCache.maxMemory, self._referenceCache.spillDirectory) != (maxMemory, spillDirectory):
+            if self._referenceCache is not None:
+                self._referenceCache.clear()
+            self._referenceCache = ReferenceCache(maxMemory, spillDirectory)
+        return self._referenceCache
+
+    def shutdown(self):
+        """Stop the worker processes. Should be called when the application exits."""
+        if self._workerPool is not None:
+            self._workerPool.shutdown()
+            self._workerPool = None
 
     def runList(self):
-        """Run multiple queued analyses as specified by the user."""
-        for anSettings in self.app.window.analysisSettings.getListedAnalyses():
-            self.runSingle(anSettings)
-            self.app.window.cellSelector.refreshCellItems()  # Refresh our displayed cell info
+        """Submit each of the queued analyses specified by the user to the job manager. If `fuseAnalyses` is enabled in
+        the pipeline settings then analyses that can share raw data are run together in a single job so that each
+        acquisition is only loaded once."""
+        if not self.app.pipelineSettings.fuseAnalyses:
+            for anSettings in self.app.window.analysisSettings.getListedAnalyses():
+                self.runSingle(anSettings)
+            return
+        preparedList = [self._prepare(anSettings) for anSettings in self.app.window.analysisSettings.getListedAnalyses()]
+        preparedList = [prepared for prepared in preparedList if prepared is not None]
+        for group in self._fusionGroups(preparedList, lambda p: (type(p.analysis), p.cameraCorrection, p.userSpecifiedBinning)):
+            self._submit(group)
+
+    @staticmethod
+    def _fusionGroups(items: list, key: typing.Callable[[typing.Any], tuple]) -> List[list]:
+        """Split queued analyses into the groups that `runList` runs together when `fuseAnalyses` is enabled.
+
+        Args:
+            items: The analyses.
+            key: Returns the analysis class, camera correction, and user specified binning of an item. Only analyses
+                of the same type read the same raw files. They must also share a camera correction since it is applied
+                once per acquisition.
+        """
+        groups: typing.Dict[tuple, list] = {}
+        for item in items:
+            groups.setdefault(key(item), []).append(item)
+        return list(groups.values())
+
+    @staticmethod
+    def _analysisClass(anSettings: AbstractRuntimeAnalysisSettings) -> type:
+        return PWSAnalysis if isinstance(anSettings, PWSRuntimeAnalysisSettings) else DynamicsAnalysis
+
+    def previewList(self):
+        """Run each of the queued analyses on a low resolution version of the data and show the results in the plotting
+        dock. The results are saved to a scratch directory so existing analyses are never affected. See `preview`."""
+        listed = self.app.window.analysisSettings.getListedAnalyses()
+        if len(listed) == 0:
+            QMessageBox.information(self.app.window, "Preview", "No analyses have been queued.")
+            return
+        for anSettings in listed:
+            prepared = self._prepare(anSettings, self.app.previewSettings)
+            if prepared is not None:
+                self._submit([prepared], self.app.previewSettings)
+
+    def estimateList(self):
+        """Predict the time, memory, and disk space needed to run the queued analyses and display it to the user. Only
+        the metadata of the cells is read."""
+        listed = self.app.window.analysisSettings.getListedAnalyses()
+        if len(listed) == 0:
+            QMessageBox.information(self.app.window, "Estimate", "No analyses have been queued.")
+            return
+        settings = self.app.pipelineSettings
+        estimator = CostEstimator.fromLog(settings.timingLog, self._timingHistory)
+        if settings.fuseAnalyses:  # The binning is only asked for when the reference is loaded, assume it doesn't differ.
+            groups = self._fusionGroups(listed, lambda s: (self._analysisClass(s), s.getSaveableSettings().cameraCorrection, None))
+        else:
+            groups = [[anSettings] for anSettings in listed]
+        estimates = []
+        for group in groups:
+            tasks = [(self._analysisClass(anSettings).__name__, anSettings.getCellMetadatas()) for anSettings in group]
+            estimates.append(estimator.estimate(tasks, settings, self.app.parallelProcessing))
+        total = CostEstimate.combine(estimates)
+        details = '\n\n'.join(f"{', '.join(s.getAnalysisName() for s in group)}:\n{e.describe()}" for group, e in zip(groups, estimates))
+        msg = f"Total:\n{total.describe()}"
+        if len(estimates) > 1:
+            msg += f"\n\n{details}"
+        if total.peakMemoryBytes > settings.memoryLimit * psutil.virtual_memory().total:
+            msg += "\n\nWarning: The predicted memory use is above the memory limit. Analyses will be slowed down to stay within the limit."
+        QMessageBox.information(self.app.window, "Analysis Estimate", msg)
+
+    def runSingle(self, anSettings: AbstractRuntimeAnalysisSettings):
+        """Prepare a single analysis batch and submit it to the job manager to be run in the background. `analysisDone`
+        will be emitted once the job has finished."""
+        prepared = self._prepare(anSettings)
+        if prepared is not None:
+            self._submit([prepared])
 
     @safeCallback
-    def runSingle(self, anSettings: AbstractRuntimeAnalysisSettings) -> Tuple[str, AbstractAnalysisSettings, List[Tuple[List[AnalysisWarning], pwsdt.Acquisition]]]:
-        """Run a single analysis batch"""
+    def _prepare(self, anSettings: AbstractRuntimeAnalysisSettings, preview: Optional[PreviewSettings] = None) -> Optional[_PreparedAnalysis]:
+        """Check for conflicts with existing analyses, load the reference, and initialize the analysis. The user is
+        asked for confirmation when needed.
+
+        Args:
+            anSettings: The settings of the analysis.
+            preview: If not `None` then the analysis is reduced to run on low resolution data. Existing analyses and
+                ROI restrictions are ignored since the results won't be saved to the acquisitions.
+
+        Returns:
+            The initialized analysis, or `None` if the user aborted.
+        """
         logger = logging.getLogger(__name__)
         userSpecifiedBinning: Optional[int] = None
-        cellMetas = anSettings.getCellMetadatas()
+        cellMetas = list(anSettings.getCellMetadatas())
         refMeta = anSettings.getReferenceMetadata()
         cameraCorrection = anSettings.getSaveableSettings().cameraCorrection
+        anName = anSettings.getAnalysisName()
+        roiNamePattern = anSettings.getRoiNamePattern()
+        marker = CompletionMarker.create(anSettings.getSaveableSettings(), refMeta, anSettings.getExtraReflectanceMetadata(), roiNamePattern,
+                                         anSettings.getSinglePrecision())
+        if roiNamePattern is not None and preview is None:
+            noRois = findCellsWithoutRois(cellMetas, roiNamePattern)
+            if len(noRois) > 0:
+                cellMetas = [cell for cell in cellMetas if cell not in noRois]
+                logger.warning(f"Skipping {len(noRois)} cells that have no ROIs matching `{roiNamePattern}`: {', '.join([os.path.split(i.acquisitionDirectory.filePath)[-1] for i in noRois])}")
+                if len(cellMetas) == 0:
+                    QMessageBox.information(self.app.window, "No ROIs", f"None of the selected cells have ROIs matching `{roiNamePattern}`.")
+                    return
         #Determine which cells already have an analysis by this name and raise a deletion dialog.
-        conflictCells = []
-        for cell in cellMetas:
-            if anSettings.getAnalysisName() in cell.getAnalyses():
-                conflictCells.append(cell)
+        # When running incrementally, cells with a completed analysis from the same inputs are skipped. Anything else by this name is stale and must be redone.
+        doneCells, conflictCells = findExistingAnalyses(cellMetas, anName, marker if self.app.pipelineSettings.incremental else None) if preview is None else ([], [])
+        if len(doneCells) > 0:
+            cellMetas = [cell for cell in cellMetas if cell not in doneCells]
+            logger.info(f"Skipping {len(doneCells)} cells that already have an up to date analysis named {anName}.")
+            if len(cellMetas) == 0:
+                logger.info(f"All cells already have an up to date analysis named {anName}.")
+                return
         if len(conflictCells) > 0:
-            ret = ScrollableMessageBox.question(self.app.window, "File Conflict", f"The following cells already have an analysis named {anSettings.getAnalysisName()}. Do you want to delete existing analyses and continue?: \n {', '.join([os.path.split(i.acquisitionDirectory.filePath)[-1] for i in conflictCells])}")
+            ret = ScrollableMessageBox.question(self.app.window, "File Conflict", f"The following cells already have an analysis named {anName}{' that is incomplete or used different settings' if self.app.pipelineSettings.incremental else ''}. Do you want to delete existing analyses and continue?: \n {', '.join([os.path.split(i.acquisitionDirectory.filePath)[-1] for i in conflictCells])}")
             if ret == QMessageBox.Yes:
-                [cell.removeAnalysis(anSettings.getAnalysisName()) for cell in conflictCells]
+                removeAnalyses(conflictCells, anName)
             else:
                 return
         if cameraCorrection is None:  # This means that the user has selected automatic cameraCorrection
@@ -96,18 +251,9 @@ class AnalysisManager(QtCore.QObject):
                 refMeta: DynMetaData
             else:
                 raise TypeError(f"Analysis settings of type: {type(anSettings)} are not supported.")
-            ref = refMeta.toDataClass()
-            if cameraCorrection is not None:
-                try:
-                    ref.correctCameraEffects(cameraCorrection)  # Apply the user-specified correction. This will fail if the image doesn't have binning metadata.
-                except ValueError:
-                    userSpecifiedBinning, pressedOk = QInputDialog.getInt(self.app.window, "Specify binning", "Please specify the camera binning that was used for these acquisitions.", 1, 1, 4)
-                    if not pressedOk:  # User pressed cancel
-                        return
-                    ref.correctCameraEffects(cameraCorrection, binning=userSpecifiedBinning)
-            else:
-                logger.info("Using automatically detected camera corrections")
-                ref.correctCameraEffects()
+            ref, userSpecifiedBinning, pressedOk = self._loadReference(refMeta, cameraCorrection)
+            if not pressedOk:  # User cancelled when asked for the binning.
+                return
             if anSettings.getExtraReflectanceMetadata() is not None:  # if the ER is None, this means we are skipping the Extra reflection correction.
                 if refMeta.systemName != anSettings.getExtraReflectanceMetadata().systemName:
                     ans = QMessageBox.question(self.app.window, "Uh Oh", f"The reference was acquired on system: {refMeta.systemName} while the extra reflectance correction was acquired on system: {anSettings.extraReflectanceMetadata.systemName}. Are you sure you want to continue?")
@@ -115,108 +261,142 @@ class AnalysisManager(QtCore.QObject):
                         return
             logger.info("Initializing analysis")
             analysis = AnalysisClass(anSettings.getSaveableSettings(), anSettings.getExtraReflectanceMetadata(), ref)
-            useParallelProcessing = self.app.parallelProcessing
-            if (len(cellMetas) <= 3): #No reason to start 3 parallel processes for less than 3 cells.
-                useParallelProcessing = False
-            if useParallelProcessing:
-                #Rather than copy arrays for each process, have read-only arrays that are shared between processes with shared memory. saves a few gigs of ram and speeds things up.
-                logger.info("AnalysisManager: Using parallel processing. Creating shared memory.")
-                try:
-                    analysis.copySharedDataToSharedMemory()
-                except NotImplementedError:
-                    pass
-            else:
-                logger.info("Not using parallel processing.")
-            #Run parallel/multithreaded processing
-            t = self.AnalysisThread(cellMetas, analysis, anSettings.getAnalysisName(), cameraCorrection, userSpecifiedBinning, useParallelProcessing)
-            b = BusyDialog(self.app.window, "Processing. Please Wait...")
-            t.finished.connect(b.accept)
-
-            def handleError(e: Exception, trace: str):
-                logger.warning(trace)
-                QMessageBox.information(self.app.window, "Oh No", str(e))
-            t.errorOccurred.connect(handleError)
-            t.start()
-            b.exec()
-            warnings = t.warnings
-            warnings = [(warn, md) for warn, md in warnings if md is not None]
-            ret = (anSettings.getAnalysisName(), anSettings.getSaveableSettings(), warnings)
-            self.analysisDone.emit(*ret)
-            return ret
+            if anSettings.getSinglePrecision():
+                analysis = narrowAnalysis(analysis)
+            if preview is not None:
+                analysis = reduceAnalysis(analysis, ref.data.shape, preview)
+            return _PreparedAnalysis(anSettings, analysis, cellMetas, cameraCorrection, userSpecifiedBinning, marker)
         else:
             raise ValueError("Hmm. There appears to be a problem with different images using different `camera corrections`. Were all images taken on the same camera?")
 
+    @safeCallback
+    def _submit(self, prepared: List[_PreparedAnalysis], preview: Optional[PreviewSettings] = None):
+        """Run analyses in a single background job. All of the analyses must use the same camera correction. If
+        `preview` is not `None` the results are shown in the plotting dock rather than being saved to the acquisitions."""
+        logger = logging.getLogger(__name__)
+        pipelineSettings = self.app.pipelineSettings
+        if preview is not None:  # The data is small enough that it is always analyzed locally and in memory.
+            pipelineSettings = dataclasses.replace(pipelineSettings, preview=preview, distributedDirectory=None, tileSize=None, timingLog=None)
+        compilerSettings = self.app.window.resultsTable.getSettings()  # ROIs compiled during the analysis include the values selected in the results table.
+        tasks = [AnalysisTask(p.analysis, p.settings.getAnalysisName(), p.cellMetas, p.marker,
+                              droppedFields(p.settings.getOutputProfile(), type(p.analysis).__name__),
+                              p.settings.getRoiNamePattern(),
+                              RoiCompilation(p.settings.getCompileRoiNamePattern(), compilerSettings) if p.settings.getCompileRoiNamePattern() is not None else None,
+                              p.settings.getSinglePrecision())
+                 for p in prepared]
+        uniqueMetas = list({md.filePath: md for task in tasks for md in task.cellMetas}.values())
+        useParallelProcessing = self.app.parallelProcessing
+        if useParallelProcessing and len(uniqueMetas) > 0:  # Only use multiple processes if the data is small enough for more than one of them to fit in memory.
+            scheduler = MemoryScheduler(pipelineSettings.memoryLimit, intermediateFactor=4 if pipelineSettings.tileSize is None else 1)
+            cubeBytes = scheduler.estimateCubeBytes(uniqueMetas[0])
+            if cubeBytes is not None:
+                scheduler.setCubeBytes(cubeBytes if preview is None else cubeBytes // preview.spatialBinning**2)
+            useParallelProcessing = scheduler.chooseNumWorkers(max(1, pipelineSettings.getNumWorkers()), len(uniqueMetas), pipelineSettings.queueSize) > 1
+        if useParallelProcessing:
+            # The worker pool puts the large arrays of the analysis (reference, extra reflectance) in shared memory rather than copying them to each process.
+            logger.info("AnalysisManager: Using parallel processing.")
+            pool = self.getWorkerPool()
+        else:
+            logger.info("Not using parallel processing.")
+            pool = None
+        #Run parallel/multithreaded processing
+        t = self.AnalysisThread(tasks, prepared[0].cameraCorrection, prepared[0].userSpecifiedBinning, useParallelProcessing, pipelineSettings, pool)
+
+        def handleFinished(job: Job):
+            self.app.window.cellSelector.refreshCellItems()  # Refresh our displayed cell info
+            if preview is None:  # Previews would throw off the cost estimates.
+                self._timingHistory.extend(t.pipeline.getTimings().timings)
+            if job.error is not None:
+                QMessageBox.information(self.app.window, "Oh No", str(job.error))
+                return
+            if job.status == Job.Status.Cancelled:
+                return
+            if preview is not None:
+                self._showPreview(prepared, preview)
+                return
+            for p, taskWarnings in zip(prepared, t.warnings):
+                warnings = [(warn, md) for warn, md in taskWarnings if md is not None]
+                self.analysisDone.emit(p.settings.getAnalysisName(), p.settings.getSaveableSettings(), warnings, t.pipeline.getTimings())
+        self.app.window.jobManager.submit(t, f"{'Preview' if preview is not None else 'Analysis'}: {', '.join(task.analysisName for task in tasks)}", onFinished=handleFinished)
+
+    def _showPreview(self, prepared: List[_PreparedAnalysis], preview: PreviewSettings):
+        """Load the results of a preview from the scratch directory and display them in the plotting dock."""
+        plots = []
+        for p in prepared:
+            isPws = isinstance(p.analysis, PWSAnalysis)
+            for md in p.cellMetas:
+                results = (PWSAnalysisResults if isPws else DynamicsAnalysisResults).load(previewDirectory(md, preview), p.settings.getAnalysisName())
+                plots.append((md.acquisitionDirectory, ConglomerateAnalysisResults(results, None) if isPws else ConglomerateAnalysisResults(None, results)))
+        self.app.window.plots.showPreview(', '.join(p.settings.getAnalysisName() for p in prepared), plots)
+
+    def _loadReference(self, refMeta: pwsdt.AnalysisManagerMetaDataBase, cameraCorrection: Optional[pwsdt.CameraCorrection]) -> Tuple[Optional[ICRawBase], Optional[int], bool]:
+        """Load the reference and apply the camera correction, using the reference cache when possible. If the binning
+        can't be determined from the metadata the user is asked for it.
+
+        Returns:
+            The camera corrected reference, the binning specified by the user (`None` if not needed), and `False` if the
+            user cancelled.
+        """
+        logger = logging.getLogger(__name__)
+        cache = self.getReferenceCache()
+        if cache is not None:
+            for binning in (None, self._specifiedBinnings.get(refMeta.idTag)):
+                ref = cache.get(ReferenceCache.makeKey(refMeta, cameraCorrection, binning))
+                if ref is not None:
+                    logger.info(f"Using cached reference {refMeta.idTag}")
+                    return ref, binning, True
+        userSpecifiedBinning = None
+        ref = refMeta.toDataClass()
+        if cameraCorrection is not None:
+            try:
+                ref.correctCameraEffects(cameraCorrection)  # Apply the user-specified correction. This will fail if the image doesn't have binning metadata.
+            except ValueError:
+                userSpecifiedBinning, pressedOk = QInputDialog.getInt(self.app.window, "Specify binning", "Please specify the camera binning that was used for these acquisitions.", 1, 1, 4)
+                if not pressedOk:  # User pressed cancel
+                    return None, None, False
+                ref.correctCameraEffects(cameraCorrection, binning=userSpecifiedBinning)
+                self._specifiedBinnings[refMeta.idTag] = userSpecifiedBinning
+        else:
+            logger.info("Using automatically detected camera corrections")
+            ref.correctCameraEffects()
+        if cache is not None:
+            cache.put(ReferenceCache.makeKey(refMeta, cameraCorrection, userSpecifiedBinning), ref)
+        return ref, userSpecifiedBinning, True
+
     def _checkAutoCorrectionConsistency(self, cellMetas: List[pwsdt.AnalysisManagerMetaDataBase]) -> bool:
         """Confirm that all metadatas in cellMetas have identical camera corrections. otherwise we can't proceed"""
-        camCorrections = [i.cameraCorrection for i in cellMetas]
-        names = [os.path.split(i.filePath)[-1] for i in cellMetas]
-        missing = []
-        for name, cam in zip(names, camCorrections):
-            if cam is None:
-                missing.append(name)
-        if len(missing) > 0:
-            missingMessage = str(missing) if len(missing) <= 3 else 'Many cells are'
-            QMessageBox.information(self.app.window, 'Hmm', f'{missingMessage} missing automatic camera correction')
-            return False
-        if len(set([hash(i) for i in camCorrections])) > 1:
-            QMessageBox.information(self.app.window, 'Hmm', "Multiple camera corrections are present in the set of selected cells.")
+        problem = checkAutoCorrectionConsistency(cellMetas)
+        if problem is not None:
+            QMessageBox.information(self.app.window, 'Hmm', problem)
             return False
         return True
 
 
-    class AnalysisThread(QThread):
-        errorOccurred = QtCore.pyqtSignal(Exception, str)
-
-        def __init__(self, cellMetas, analysis, anName, cameraCorrection, userSpecifiedBinning, parallel):
-            super().__init__()
-            self.cellMetas = cellMetas
-            self.analysis = analysis
-            self.anName = anName
+    class AnalysisThread(JobThread):
+        def __init__(self, tasks: List[AnalysisTask], cameraCorrection, userSpecifiedBinning, parallel, pipelineSettings: PipelineSettings = None,
+                     pool: WorkerPool = None):
+            super().__init__(sum(len(task.cellMetas) for task in tasks))
+            self.tasks = tasks
             self.cameraCorrection = cameraCorrection
             self.userSpecifiedBinning = userSpecifiedBinning
-            self.warnings = None
+            self.warnings = []  # For each task, a list of Tuples, each tuple containing a list of warnings and the PwsMetaData to go with it.
             self.parallel = parallel
+            pipelineSettings = pipelineSettings if pipelineSettings is not None else PipelineSettings()
+            if not parallel:
+                pipelineSettings = dataclasses.replace(pipelineSettings, numWorkers=0)  # Compute in this thread rather than spawning processes.
+            if pipelineSettings.distributedDirectory is not None:  # Share the work with other computers.
+                self.pipeline = DistributedPipeline(tasks, cameraCorrection, userSpecifiedBinning, pipelineSettings, pool)
+            else:
+                self.pipeline = AnalysisPipeline(tasks, cameraCorrection, userSpecifiedBinning, pipelineSettings, pool)
 
         def run(self):
             try:
-                self.warnings = loadAndProcess(self.cellMetas, processorFunc=self._process, initArgs=[self.analysis, self.anName, self.cameraCorrection, self.userSpecifiedBinning],
-                                     parallel=self.parallel, initializer=self._initializer) # Returns a list of Tuples, each tuple containing a list of warnings and the PwsMetaData to go with it.
+                self.warnings = self.pipeline.run(progressCallback=self.reportProgress, isCancelled=self.isCancelled)
             except Exception as e:
                 import traceback
                 trace = traceback.format_exc()
                 self.errorOccurred.emit(e, trace)
-
-
-        @staticmethod
-        def _initializer(analysis: AbstractAnalysis, analysisName: str, cameraCorrection: pwsdt.CameraCorrection, userSpecifiedBinning: Optional[int] = None):
-            """This method is run once for each process that is spawned. it initialized _resources that are shared between each iteration of _process."""
-            global pwspyAnalysisAppParallelGlobals
-            logger = logging.getLogger(__name__)
-            logger.info('initializing!')
-            pwspyAnalysisAppParallelGlobals = {'analysis': analysis, 'analysisName': analysisName,
-                                               'cameraCorrection': cameraCorrection, 'binning': userSpecifiedBinning}
-
-        @staticmethod
-        def _process(im: pwsdt.ICRawBase):
-            """This method is run in parallel. once for each acquisition data that we want to analyze.
-            Returns a list of AnalysisWarnings objects with the associated metadat object"""
-            global pwspyAnalysisAppParallelGlobals
-            analysis = pwspyAnalysisAppParallelGlobals['analysis']
-            analysisName = pwspyAnalysisAppParallelGlobals['analysisName']
-            cameraCorrection = pwspyAnalysisAppParallelGlobals['cameraCorrection']
-            userSpecifiedBinning = pwspyAnalysisAppParallelGlobals['binning']
-            if cameraCorrection is not None:
-                if userSpecifiedBinning is None:
-                    im.correctCameraEffects(cameraCorrection)
-                else:
-                    im.correctCameraEffects(cameraCorrection, binning=userSpecifiedBinning)
-            else:
-                im.correctCameraEffects()
-            results, warnings = analysis.run(im)
-            if len(warnings) > 0:
-                md = im.metadata
-            else:
-                md = None
-            im.metadata.saveAnalysis(results, analysisName)
-            return warnings, md
-
+            finally:
+                self.reportMessage("Stage utilization: " + ', '.join(f"{u.name} ({u.concurrency}): {u.utilization:.0%}" for u in self.pipeline.getUtilization()))
+                writeStats = self.pipeline.getWriteStats()
+                self.reportMessage(f"Saved {writeStats.bytesWritten / 1024**2:.1f} MB at {writeStats.megabytesPerSecond:.1f} MB/s per writer")
@@ -0,0 +1,583 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A staged pipeline that overlaps reading, analyzing and saving the acquisitions of one or more analyses.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import dataclasses
+import logging
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import typing
+from typing import List, Optional, Tuple, Callable
+import psutil
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import SharedCube, WorkerPool, analyzeCube
+from pwspy_gui.PWSAnalysisApp._taskManagers.tiling import MappedCube, padResults, removeDiskArrays
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region, cropCube, findRegion
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import CellCompilation, CompiledRois, RoiCompilation, prepareCompilations, removeCompiled, saveCompiled
+from pwspy_gui.PWSAnalysisApp._taskManagers.stageCache import StageCache, correctCube
+from pwspy_gui.PWSAnalysisApp._taskManagers.preview import PreviewSettings, previewDirectory, reduceCube, savePreview
+from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+from pwspy_gui.PWSAnalysisApp._taskManagers.memoryScheduler import MemoryScheduler, rawDataBytes
+from pwspy_gui.PWSAnalysisApp._taskManagers.resultWriter import ResultLayout, WriteStats, saveWithLayout
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import CellTiming, TimingRecorder, directorySize
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysis, AbstractAnalysisResults
+    from pwspy.analysis.warnings import AnalysisWarning
+
+
+@dataclasses.dataclass
+class PipelineSettings:
+    """Determines the concurrency of each stage of the `AnalysisPipeline` and how much data is cached between analyses.
+
+    Attributes:
+        numReaders: The number of threads loading raw data from file.
+        numWorkers: The number of processes running the analysis. If `None` then one less than the number of physical
+            cores is used. If `0` then the analysis is run in the calling thread rather than in separate processes.
+        numWriters: The number of threads saving analysis results to file.
+        queueSize: The maximum number of items waiting between two stages. Limits how much RAM is used by data that is
+            waiting to be processed.
+        referenceCacheGB: The number of gigabytes of RAM used to keep processed reference cubes between analyses.
+        spillReferences: If `True` then references that don't fit in the reference cache are saved to a local disk.
+        fuseAnalyses: If `True` then queued analyses that can share raw data are run together so that each acquisition
+            is only loaded once.
+        incremental: If `True` then acquisitions that already have a completed analysis with the same name, settings,
+            reference and extra reflectance are skipped rather than being analyzed again.
+        memoryLimit: The fraction of the system memory that analyses may use. Fewer processes are used if the data
+            is large and new acquisitions aren't started while memory usage is above this limit.
+        distributedDirectory: A directory on a shared file system. If set, acquisitions are queued in this directory
+            so that `PWSAnalysis-worker` processes on other computers can help analyze them. See `distributedQueue`.
+        leaseTimeout: The number of seconds after which an acquisition claimed by a distributed worker that has stopped
+            responding is put back in the queue.
+        timingLog: If not `None` then the time spent on each stage for each acquisition is appended to this file as
+            lines of json.
+        tileSize: If not `None` then each data cube is copied from its file to a memory mapped file, without loading it
+            into memory, and analyzed in square tiles of this many pixels. The results are also assembled on disk. Use
+            this when the data is too large to analyze in memory. The stage cache isn't used for tiled analysis.
+        tileOverlap: The number of pixels by which neighboring tiles overlap. Only needed if an analysis uses a spatial filter.
+        compression: The compression of saved results: `None`, `lzf`, or `gzip`. See `resultWriter.ResultLayout`.
+        compressionLevel: The level of `gzip` compression, from 0 to 9.
+        chunking: The chunk layout of saved results: `auto`, `plane`, or `none`.
+        stageCacheDirectory: If not `None` then camera corrected data cubes are saved to this directory on a local disk
+            and loaded from there when the same acquisition is analyzed again. See `stageCache`.
+        stageCacheGB: The maximum size of the stage cache in gigabytes.
+        preview: If not `None` then the raw data is reduced to a low resolution after loading and the results are saved
+            to a scratch directory rather than to the acquisitions. The analyses must already have been reduced to
+            match with `preview.reduceAnalysis`. ROI restrictions and compilations are ignored. See `preview`.
+    """
+    numReaders: int = 2
+    numWorkers: Optional[int] = None
+    numWriters: int = 1
+    queueSize: int = 3
+    referenceCacheGB: float = 2.0
+    spillReferences: bool = True
+    fuseAnalyses: bool = False
+    incremental: bool = False
+    memoryLimit: float = 0.85
+    distributedDirectory: Optional[str] = None
+    leaseTimeout: float = 300
+    timingLog: Optional[str] = None
+    tileSize: Optional[int] = None
+    tileOverlap: int = 0
+    compression: Optional[str] = None
+    compressionLevel: int = 4
+    chunking: str = 'auto'
+    stageCacheDirectory: Optional[str] = None
+    stageCacheGB: float = 50.0
+    preview: Optional[PreviewSettings] = None
+
+    def getResultLayout(self) -> ResultLayout:
+        return ResultLayout(self.compression, self.compressionLevel, self.chunking)
+
+    def getNumWorkers(self) -> int:
+        if self.numWorkers is None:
+            return max(1, psutil.cpu_count(logical=False) - 1)  # Use one less than number of available cores.
+        return self.numWorkers
+
+
+class StageUtilization(typing.NamedTuple):
+    """Reports how busy a stage of the pipeline was.
+
+    Attributes:
+        name: The name of the stage.
+        concurrency: The number of threads/processes in the stage.
+        items: The number of items processed by the stage.
+        busyTime: The total number of seconds that the stage's threads/processes spent working.
+        utilization: The fraction of the available thread/process time that was spent working (0 to 1).
+    """
+    name: str
+    concurrency: int
+    items: int
+    busyTime: float
+    utilization: float
+
+
+class AnalysisTask(typing.NamedTuple):
+    """An analysis and the acquisitions to run it on.
+
+    Attributes:
+        analysis: The analysis to run on each acquisition.
+        analysisName: The name to save the analysis results as.
+        cellMetas: The metadata of the acquisitions to analyze.
+        marker: Saved alongside each analysis result once it has been saved. Allows an interrupted analysis to be resumed.
+        dropFields: The names of results fields that shouldn't be saved. See `outputProfile.droppedFields`.
+        roiNamePattern: If not `None` then only the bounding box of the ROIs with names matching this regex is
+            analyzed. See `roiRegion`.
+        compilation: If not `None` then ROIs are compiled from the results while they are still in memory and saved
+            alongside the results. See `roiCompilation`.
+        singlePrecision: If `True` then the results are converted to single precision. The camera corrected raw data is
+            also converted if all of the analyses that include it use single precision. The analysis must already have
+            been converted with `precision.narrowAnalysis`. See `precision`.
+    """
+    analysis: AbstractAnalysis
+    analysisName: str
+    cellMetas: typing.Sequence[pwsdt.AnalysisManagerMetaDataBase]
+    marker: Optional[CompletionMarker] = None
+    dropFields: Tuple[str, ...] = ()
+    roiNamePattern: Optional[str] = None
+    compilation: Optional[RoiCompilation] = None
+    singlePrecision: bool = False
+
+
+def groupByAcquisition(tasks: typing.Sequence[AnalysisTask]) -> List[Tuple[pwsdt.AnalysisManagerMetaDataBase, List[int]]]:
+    """Group the work of `tasks` by acquisition so that each acquisition only needs to be loaded once.
+
+    Returns:
+        A list with an item for each acquisition. Each item is the metadata of the acquisition and the indices of the
+        tasks that include it.
+    """
+    units: typing.Dict[str, Tuple[pwsdt.AnalysisManagerMetaDataBase, List[int]]] = {}
+    for taskIndex, task in enumerate(tasks):
+        for md in task.cellMetas:
+            units.setdefault(md.filePath, (md, []))[1].append(taskIndex)
+    return list(units.values())
+
+
+def saveResults(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str, results: AbstractAnalysisResults,
+                marker: Optional[CompletionMarker], overwrite: bool = False, layout: Optional[ResultLayout] = None,
+                compiled: Optional[CompiledRois] = None):
+    """Save analysis results, and any ROIs compiled from them, followed by their completion marker.
+
+    Args:
+        md: The acquisition that was analyzed.
+        analysisName: The name to save the results as.
+        results: The analysis results.
+        marker: Saved once the results have been saved. Ignored if `None`.
+        overwrite: If `True` then an existing analysis with the same name is deleted first.
+        layout: The chunking and compression of the saved datasets. If `None` the results are saved by `pwspy` as usual.
+        compiled: The ROIs compiled from the results. See `roiCompilation`.
+    """
+    CompletionMarker.remove(md, analysisName)  # In case an old marker was left behind.
+    removeCompiled(md, analysisName)  # Would no longer match the results.
+    if overwrite and analysisName in md.getAnalyses():
+        md.removeAnalysis(analysisName)
+    saveWithLayout(md, analysisName, results, layout)
+    if compiled is not None:
+        saveCompiled(md, analysisName, compiled)
+    if marker is not None:
+        marker.toFile(md, analysisName)
+
+
+class _Stage:
+    """Accumulates the time spent working by the threads of a single stage."""
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.busyTime = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.busyTime += seconds
+            self.items += 1
+
+    def utilization(self, wallTime: float) -> StageUtilization:
+        util = self.busyTime / (wallTime * self.concurrency) if wallTime > 0 and self.concurrency > 0 else 0
+        return StageUtilization(self.name, self.concurrency, self.items, self.busyTime, min(util, 1.0))
+
+
+def _discard(im):
+    """Free data that was loaded but won't be analyzed."""
+    if isinstance(im, SharedCube):
+        im.release()
+    elif isinstance(im, MappedCube):
+        im.remove()
+
+
+class _Stopped(Exception):
+    """Raised internally when the pipeline is shutting down."""
+    pass
+
+
+class AnalysisPipeline:
+    """Runs one or more analyses on a sequence of acquisitions using separate stages for reading, computing and writing.
+    Acquisitions that are included in more than one of the tasks are only loaded from file once.
+
+    Args:
+        tasks: The analyses to run and the acquisitions to run each of them on.
+        cameraCorrection: The camera correction to apply. If `None` then the automatic correction saved with the data is used.
+        userSpecifiedBinning: The binning to use if it wasn't saved in the metadata.
+        settings: Determines the concurrency of each stage.
+        pool: A pool of worker processes to run the compute stage with. If `None` then a pool will be started for each
+            call to `run` (unless `settings.numWorkers` is 0). Sharing a pool between many pipelines avoids the cost of
+            spawning new processes for each one.
+    """
+    def __init__(self, tasks: typing.Sequence[AnalysisTask], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                 userSpecifiedBinning: Optional[int] = None, settings: PipelineSettings = None, pool: WorkerPool = None):
+        self.tasks = list(tasks)
+        self.pool = pool
+        self.cameraCorrection = cameraCorrection
+        self.userSpecifiedBinning = userSpecifiedBinning
+        self.settings = settings if settings is not None else PipelineSettings()
+        self._stages: typing.Dict[str, _Stage] = {}
+        self._wallTime = 0
+        self._timing = TimingRecorder()
+        self._cellTimings: typing.Dict[int, CellTiming] = {}  # Timings of the acquisitions that haven't been saved yet.
+        self._regions: typing.Dict[int, Optional[Region]] = {}  # The region that each acquisition was cropped to. `None` for the full image.
+        self._compilations: typing.Dict[int, Optional[List[Optional[CellCompilation]]]] = {}  # The ROIs to compile for each acquisition that hasn't been computed yet.
+        self._timingLock = threading.Lock()
+        self._peakBacklog = 0
+        if self.settings.tileSize is None:
+            self.scheduler = MemoryScheduler(self.settings.memoryLimit)
+        else:  # Only a tile's worth of intermediate arrays is allocated, the peak is when a reader loads the whole cube.
+            self.scheduler = MemoryScheduler(self.settings.memoryLimit, intermediateFactor=1)
+        self._units = groupByAcquisition(self.tasks)
+
+    @property
+    def total(self) -> int:
+        """The number of analysis results that will be saved."""
+        return sum(len(task.cellMetas) for task in self.tasks)
+
+    @property
+    def numAcquisitions(self) -> int:
+        """The number of acquisitions that will be loaded."""
+        return len(self._units)
+
+    def run(self, progressCallback: Callable[[int], None] = None, isCancelled: Callable[[], bool] = None) -> List[List[Tuple[List[AnalysisWarning], Optional[pwsdt.AnalysisManagerMetaDataBase]]]]:
+        """Run each of the analyses on its acquisitions and save the results.
+
+        Args:
+            progressCallback: Called with the number of analysis results completed each time a result is saved.
+            isCancelled: Polled between acquisitions. If it returns `True` then no new acquisitions will be started.
+
+        Returns:
+            A list with an item for each task. Each item is a list of Tuples, each tuple containing a list of warnings
+            and the metadata to go with it. The metadata is `None` if there were no warnings. Acquisitions that were
+            not completed are not included.
+        """
+        logger = logging.getLogger(__name__)
+        numWorkers = self.settings.getNumWorkers()
+        if numWorkers > 0:
+            if self.pool is not None:
+                numWorkers = self.pool.numWorkers
+            if len(self._units) > 0:
+                cubeBytes = self.scheduler.estimateCubeBytes(self._units[0][0])
+                if cubeBytes is not None:
+                    self.scheduler.setCubeBytes(cubeBytes)
+            numWorkers = self.scheduler.chooseNumWorkers(numWorkers, len(self._units), self.settings.queueSize)
+        self._stages = {'read': _Stage('read', self.settings.numReaders),
+                        'compute': _Stage('compute', max(numWorkers, 1)),
+                        'write': _Stage('write', self.settings.numWriters)}
+        self._timing = TimingRecorder(self.settings.timingLog)
+        self._cellTimings = {}
+        self._regions = {}
+        self._compilations = {}
+        self._peakBacklog = 0
+        layout = self.settings.getResultLayout()
+        stop = threading.Event()  # Set if an error occurs. All stages will stop.
+        stopReading = threading.Event()  # Set once the compute stage is done, including when it is cancelled.
+        errors = []
+        results = [[] for task in self.tasks]
+        completed = [0]
+        resultsLock = threading.Lock()
+        inQueue = queue.Queue()
+        for i, (md, taskIndices) in enumerate(self._units):
+            inQueue.put((i, md))
+        loadedQueue = queue.Queue(maxsize=self.settings.queueSize)
+        if numWorkers == 0:
+            slots = None
+            saveQueue = queue.Queue(maxsize=self.settings.queueSize)
+        else:  # Results arrive through callbacks that must not block, so the number of acquisitions between the loaded queue and the writers is limited instead.
+            slots = threading.BoundedSemaphore(numWorkers + self.settings.queueSize)
+            saveQueue = queue.Queue()
+
+        def guarded(func):
+            """Stop the whole pipeline if any stage raises an exception."""
+            def newFunc(*args):
+                try:
+                    func(*args)
+                except _Stopped:
+                    pass
+                except Exception as e:
+                    logger.exception(e)
+                    errors.append(e)
+                    stop.set()
+                    stopReading.set()
+            return newFunc
+
+        def read():
+            while not stopReading.is_set():
+                try:
+                    index, md = inQueue.get_nowait()
+                except queue.Empty:
+                    return
+                sTime = time.time()
+                taskIndices = self._units[index][1]
+                if self.settings.preview is None:
+                    region = findRegion(md, [self.tasks[t].roiNamePattern for t in taskIndices])
+                    compilations = prepareCompilations(md, [self.tasks[t].analysisName for t in taskIndices], [self.tasks[t].compilation for t in taskIndices])
+                else:
+                    region = None  # The preview is fast enough without it, and the region would need to be reduced too.
+                    compilations = None
+                correctTime = 0.0
+                if tileDirectory is not None:  # Copied straight from the file so the full cube is never in memory. It is corrected one tile at a time.
+                    im = MappedCube.fromMetadata(md, tileDirectory, self.settings.tileSize, self.settings.tileOverlap, region)
+                    cubeBytes = im.nbytes
+                else:
+                    if stageCache is None:
+                        im = md.toDataClass()
+                    else:
+                        cacheKey = StageCache.makeKey(md, self.cameraCorrection, self.userSpecifiedBinning)
+                        im = stageCache.get(cacheKey)
+                        if im is None:
+                            im = md.toDataClass()
+                            cTime = time.time()
+                            correctCube(im, self.cameraCorrection, self.userSpecifiedBinning)  # Correct here rather than in the compute stage so the corrected data can be cached.
+                            correctTime = time.time() - cTime
+                            stageCache.put(cacheKey, im)
+                    if region is not None:
+                        im = cropCube(im, region)
+                    if self.settings.preview is not None:
+                        im = reduceCube(im, self.settings.preview)
+                    cubeBytes = im.data.nbytes
+                self._regions[index] = region
+                self._compilations[index] = compilations
+                readTime = time.time() - sTime - correctTime
+                self._stages['read'].record(readTime)
+                with self._timingLock:
+                    self._cellTimings[index] = CellTiming(md.filePath, [self.tasks[t].analysisName for t in taskIndices],
+                                                          [type(self.tasks[t].analysis).__name__ for t in taskIndices],
+                                                          read=readTime, correct=correctTime, bytesRead=rawDataBytes(md))
+                self.scheduler.observeCube(cubeBytes)
+                if pool is not None and tileDirectory is None:
+                    im = pool.shareCube(im)  # Copy the data to shared memory here so the compute stage doesn't have to pickle it.
+                try:
+                    self._put(loadedQueue, (index, im), stopReading)  # Once the queue is full we will block here so that we don't overfill the RAM.
+                except _Stopped:
+                    _discard(im)  # Return the shared memory block to the pool.
+                    raise
+
+        def write():
+            while True:
+                item = self._get(saveQueue, stop)
+                if item is None:  # The compute stage is done.
+                    return
+                if slots is not None:
+                    slots.release()
+                self._peakBacklog = max(self._peakBacklog, saveQueue.qsize() + 1)
+                index, unitResults, compiled = item
+                md, taskIndices = self._units[index]
+                outDirectory = md.filePath if self.settings.preview is None else previewDirectory(md, self.settings.preview)
+                sizeBefore = directorySize(outDirectory)
+                writeTime = 0
+                region = self._regions.pop(index)
+                for taskIndex, (anResults, warnings), roiResults in zip(taskIndices, unitResults, compiled):
+                    task = self.tasks[taskIndex]
+                    sTime = time.time()
+                    if region is not None:
+                        anResults = padResults(anResults, region.fullShape, region.slices)
+                    if self.settings.preview is None:
+                        saveResults(md, task.analysisName, anResults, task.marker, layout=layout, compiled=roiResults)
+                    else:
+                        savePreview(md, task.analysisName, anResults, self.settings.preview)
+                    removeDiskArrays(anResults)
+                    writeTime += time.time() - sTime
+                    self._stages['write'].record(time.time() - sTime)
+                    with resultsLock:
+                        results[taskIndex].append((warnings, md if len(warnings) > 0 else None))
+                        completed[0] += 1
+                        numCompleted = completed[0]
+                    if progressCallback is not None:
+                        progressCallback(numCompleted)
+                with self._timingLock:
+                    timing = self._cellTimings.pop(index)
+                timing.write = writeTime
+                timing.bytesWritten = directorySize(outDirectory) - sizeBefore
+                self._timing.add(timing)
+
+        tileDirectory = tempfile.mkdtemp(prefix='pwspyTiles_') if self.settings.tileSize is not None else None
+        stageCache = StageCache(self.settings.stageCacheDirectory, int(self.settings.stageCacheGB * 1024**3)) if self.settings.stageCacheDirectory is not None else None
+        if numWorkers == 0:
+            pool = None
+        else:
+            pool = self.pool if self.pool is not None else WorkerPool(numWorkers)
+        sTime = time.time()
+        readers = [threading.Thread(target=guarded(read), daemon=True) for i in range(self.settings.numReaders)]
+        writers = [threading.Thread(target=guarded(write), daemon=True) for i in range(self.settings.numWriters)]
+        [t.start() for t in readers + writers]
+        try:
+            guarded(self._compute)(pool, numWorkers, loadedQueue, saveQueue, slots, stop, isCancelled)
+        finally:
+            stopReading.set()
+            [t.join() for t in readers]
+            try:
+                for t in writers:
+                    self._put(saveQueue, None, stop)  # Tell each writer that there is nothing left.
+            except _Stopped:
+                pass  # The writers will stop on their own.
+            [t.join() for t in writers]
+            while not loadedQueue.empty():  # Data that was loaded but never analyzed.
+                _discard(loadedQueue.get_nowait()[1])
+            if pool is not None:
+                pool.trimSharedBlocks()
+                if self.pool is None:
+                    pool.shutdown()
+            if tileDirectory is not None:
+                shutil.rmtree(tileDirectory, ignore_errors=True)
+            self._wallTime = time.time() - sTime
+            logger.info(f"Pipeline finished in {self._wallTime:.1f} seconds. " + ', '.join(f"{u.name}: {u.utilization:.0%}" for u in self.getUtilization()))
+            writeStats = self.getWriteStats()
+            logger.info(f"Saved {writeStats.results} results ({writeStats.bytesWritten / 1024**2:.1f} MB) at {writeStats.megabytesPerSecond:.1f} MB/s per writer. "
+                        f"Up to {writeStats.peakBacklog} acquisitions waited to be saved.")
+        if len(errors) > 0:
+            raise errors[0]
+        return results
+
+    def _compute(self, pool: Optional[WorkerPool], numWorkers: int, loadedQueue: queue.Queue, saveQueue: queue.Queue,
+                 slots: Optional[threading.BoundedSemaphore], stop: threading.Event, isCancelled: Optional[Callable[[], bool]]):
+        """Take loaded data from `loadedQueue`, run the analyses, and put the results in `saveQueue`. If `numWorkers`
+        is 0 then the analysis is run in this thread, otherwise `pool` is used. In that case a slot of
+        `slots` is acquired for each acquisition submitted to the pool and the writers release it."""
+        if numWorkers == 0:
+            for i in range(len(self._units)):
+                if isCancelled is not None and isCancelled():
+                    break
+                index, im = self._get(loadedQueue, stop)
+                timings = {}
+                compiled = []
+                taskIndices = self._units[index][1]
+                unitResults = analyzeCube(im, [self.tasks[t].analysis for t in taskIndices], self.cameraCorrection, self.userSpecifiedBinning, timings,
+                                          [self.tasks[t].dropFields for t in taskIndices], self._regions[index], self._compilations.pop(index), compiled,
+                                          [self.tasks[t].singlePrecision for t in taskIndices])
+                self._recordComputed(index, timings)
+                self._put(saveQueue, (index, unitResults, compiled), stop)
+            return
+
+        asyncErrors = []
+        outstanding = [0]  # The number of tasks submitted to the pool that haven't returned yet.
+        outstandingCondition = threading.Condition()
+
+        def taskDone():
+            with outstandingCondition:
+                outstanding[0] -= 1
+                outstandingCondition.notify_all()
+
+        def onComputed(ret):  # Called from the pool's result thread, which may be shared with other pipelines. Don't block here.
+            index, unitResults, timings, compiled = ret
+            self._recordComputed(index, timings)
+            saveQueue.put((index, unitResults, compiled))
+            taskDone()
+
+        def onError(e: BaseException):
+            asyncErrors.append(e)
+            stop.set()
+            slots.release()
+            taskDone()
+
+        context = pool.createContext([task.analysis for task in self.tasks], self.cameraCorrection, self.userSpecifiedBinning,
+                                     [task.dropFields for task in self.tasks], [task.singlePrecision for task in self.tasks])
+        try:
+            for i in range(len(self._units)):
+                if isCancelled is not None and isCancelled():
+                    break
+                index, im = self._get(loadedQueue, stop)
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        _discard(im)
+                        raise _Stopped()
+                with outstandingCondition:  # Don't start more than `numWorkers` acquisitions at once and pause if memory is running low.
+                    while outstanding[0] >= numWorkers or not self.scheduler.canDispatch(outstanding[0]):
+                        if stop.is_set():
+                            slots.release()
+                            _discard(im)
+                            raise _Stopped()
+                        outstandingCondition.wait(timeout=0.5)
+                    outstanding[0] += 1
+                try:
+                    pool.submit(context, index, im, self._units[index][1], onComputed, onError, self._regions[index], self._compilations.pop(index))
+                except Exception:
+                    slots.release()
+                    taskDone()
+                    raise
+                del im  # Release our reference so the memory can be freed once the data has been sent to the worker.
+        except _Stopped:
+            pass
+        finally:
+            with outstandingCondition:  # The pool may be shared so we can't terminate it. Wait for the tasks that are in progress.
+                outstandingCondition.wait_for(lambda: outstanding[0] == 0)
+            context.release()
+        if len(asyncErrors) > 0:
+            raise asyncErrors[0]
+
+    def _recordComputed(self, index: int, timings: dict):
+        """Record the timings returned by `analyzeCube` for the acquisition at `index`."""
+        self._stages['compute'].record(timings['correct'] + timings['analyze'])
+        with self._timingLock:
+            timing = self._cellTimings[index]
+        timing.correct += timings['correct']  # The data may have been corrected by the readers, see `stageCache`.
+        timing.analyze, timing.worker, timing.peakRss = timings['analyze'], timings['worker'], timings['peakRss']
+
+    def getTimings(self) -> TimingRecorder:
+        """Returns the timing of each stage for each acquisition saved by the most recent call to `run`."""
+        return self._timing
+
+    def getUtilization(self) -> List[StageUtilization]:
+        """Returns the utilization of each stage for the most recent call to `run`."""
+        return [stage.utilization(self._wallTime) for stage in self._stages.values()]
+
+    def getWriteStats(self) -> WriteStats:
+        """Returns the throughput of the writers for the most recent call to `run`."""
+        return WriteStats.fromTimings(self._timing.timings, self._peakBacklog)
+
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event):
+        """Put `item` in `q`, blocking until there is room. Raises `_Stopped` if `stop` is set while waiting."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    @staticmethod
+    def _get(q: queue.Queue, stop: threading.Event):
+        """Get an item from `q`, blocking until one is available. Raises `_Stopped` if `stop` is set while waiting."""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise _Stopped()
@@ -0,0 +1,89 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Checks that are run before starting an analysis, shared by the GUI and the batch command line tool.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import os
+import typing
+from typing import List, Optional, Tuple
+from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import hasMatchingRois
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import removeCompiled
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+def checkAutoCorrectionConsistency(cellMetas: typing.Sequence[pwsdt.AnalysisManagerMetaDataBase]) -> Optional[str]:
+    """Confirm that all metadatas in cellMetas have identical automatic camera corrections. Otherwise we can't proceed.
+
+    Returns:
+        A message describing the problem, or `None` if the camera corrections are ok.
+    """
+    camCorrections = [i.cameraCorrection for i in cellMetas]
+    names = [os.path.split(i.filePath)[-1] for i in cellMetas]
+    missing = []
+    for name, cam in zip(names, camCorrections):
+        if cam is None:
+            missing.append(name)
+    if len(missing) > 0:
+        missingMessage = str(missing) if len(missing) <= 3 else 'Many cells are'
+        return f'{missingMessage} missing automatic camera correction'
+    if len(set([hash(i) for i in camCorrections])) > 1:
+        return "Multiple camera corrections are present in the set of selected cells."
+    return None
+
+
+def findExistingAnalyses(cellMetas: typing.Sequence[pwsdt.AnalysisManagerMetaDataBase], analysisName: str,
+                         marker: Optional[CompletionMarker] = None) -> Tuple[List[pwsdt.AnalysisManagerMetaDataBase], List[pwsdt.AnalysisManagerMetaDataBase]]:
+    """Find the acquisitions that already have an analysis named `analysisName`.
+
+    Args:
+        cellMetas: The acquisitions to check.
+        analysisName: The name of the analysis.
+        marker: The completion marker that the analysis would be saved with. If `None` then all existing analyses are
+            considered to be conflicts.
+
+    Returns:
+        A list of the acquisitions that have a completed analysis matching `marker` and a list of the acquisitions that
+        have an analysis by this name which is incomplete or was computed from different inputs.
+    """
+    done, conflicts = [], []
+    for cell in cellMetas:
+        if analysisName in cell.getAnalyses():
+            if marker is not None and CompletionMarker.fromFile(cell, analysisName) == marker:
+                done.append(cell)
+            else:
+                conflicts.append(cell)
+    return done, conflicts
+
+
+def findCellsWithoutRois(cellMetas: typing.Sequence[pwsdt.AnalysisManagerMetaDataBase], roiNamePattern: str) -> List[pwsdt.AnalysisManagerMetaDataBase]:
+    """Find the acquisitions that don't have any ROIs with names matching the regex `roiNamePattern`. These can't be
+    analyzed when the analysis is restricted to ROIs."""
+    return [cell for cell in cellMetas if not hasMatchingRois(cell, roiNamePattern)]
+
+
+def removeAnalyses(cellMetas: typing.Sequence[pwsdt.AnalysisManagerMetaDataBase], analysisName: str):
+    """Delete the analysis named `analysisName`, its completion marker and any ROIs compiled from it from each acquisition."""
+    for cell in cellMetas:
+        cell.removeAnalysis(analysisName)
+        CompletionMarker.remove(cell, analysisName)
+        removeCompiled(cell, analysisName)
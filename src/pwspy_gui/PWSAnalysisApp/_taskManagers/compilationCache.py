@@ -0,0 +1,170 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A cache of compiled ROIs in the working directory, so that only the ROIs whose files have changed are recompiled.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import time
+import typing
+import uuid
+from typing import Dict, List, Optional, Tuple
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis.warnings import AnalysisWarning
+    from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateCompilerResults, ConglomerateCompilerSettings
+
+Key = Tuple[Optional[str], Optional[str], str, str, int, str]  # The PWS analysis file, the Dynamics analysis file, the ROI file, the ROI name and number, and the settings.
+Stamp = Tuple[Tuple[int, int], ...]  # The modification time and size of each file of the key.
+Entries = Dict[Key, Tuple[Stamp, Tuple['ConglomerateCompilerResults', List['AnalysisWarning']]]]
+
+
+def analysisPath(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str) -> str:
+    """The path of the file that `pwspy` saves the analysis results named `analysisName` of `md` to."""
+    return os.path.join(md.filePath, 'analyses', md.getAnalysisResultsClass().name2FileName(analysisName))
+
+
+def settingsKey(settings: ConglomerateCompilerSettings) -> str:
+    return hashlib.sha1(repr(settings).encode()).hexdigest()
+
+
+def makeKey(pwsPath: Optional[str], dynPath: Optional[str], roiFile: pwsdt.RoiFile, settingsKey: str) -> Key:
+    return pwsPath, dynPath, roiFile.filePath, roiFile.name, roiFile.number, settingsKey
+
+
+def makeStamp(key: Key) -> Optional[Stamp]:
+    """The modification time and size of each of the files of `key`. `None` if any of them can't be found, in which
+    case the compiled results shouldn't be cached."""
+    stamp = []
+    for path in key[:3]:
+        if path is None:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def _prune(acquisitions: Dict[str, Entries]) -> Dict[str, Entries]:
+    """Remove the entries whose files have changed or no longer exist."""
+    pruned = {}
+    for acqPath, entries in acquisitions.items():
+        entries = {key: entry for key, entry in entries.items() if entry[0] == makeStamp(key)}
+        if len(entries) > 0:
+            pruned[acqPath] = entries
+    return pruned
+
+
+@contextlib.contextmanager
+def _lockFile(path: str, timeout: float = 10, staleSeconds: float = 60):
+    """Create `path` as a lock file and remove it afterwards, waiting up to `timeout` seconds if it already exists. A
+    lock file older than `staleSeconds` was left behind by a crash and is removed. Raises `TimeoutError`."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > staleSeconds:
+                    os.remove(path)
+                    continue
+            except OSError:  # Removed in the meantime.
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out waiting for the lock file {path}")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class CompilationCache:
+    """The compiled ROIs of the acquisitions in a directory, grouped by acquisition. The file is loaded when the cache
+    is created and only written by `save`.
+
+    Args:
+        directory: The working directory.
+    """
+    FILE_NAME = '.compilationCache.pkl'
+    _FORMAT_VERSION = 1
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self._acquisitions: Dict[str, Entries] = self._load()
+        self._updated: Dict[str, Entries] = {}  # The entries that have been updated since the last `save`.
+
+    def _load(self) -> Dict[str, Entries]:
+        try:
+            with open(self.path, 'rb') as f:
+                contents = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:  # Corrupted or saved by an incompatible version.
+            logging.getLogger(__name__).warning(f"Failed to load the compilation cache {self.path}: {e}")
+            return {}
+        if not isinstance(contents, dict) or contents.get('version') != self._FORMAT_VERSION:
+            return {}
+        return contents['acquisitions']
+
+    def get(self, acq: pwsdt.Acquisition) -> Entries:
+        """The cached entries of an acquisition. Entries whose stamp no longer matches the files are stale."""
+        return self._acquisitions.get(acq.filePath, {})
+
+    def update(self, acq: pwsdt.Acquisition, entries: Entries):
+        """Replace the cached entries of an acquisition."""
+        self._acquisitions[acq.filePath] = entries
+        self._updated[acq.filePath] = entries
+
+    def save(self):
+        """Write the cache to the working directory if it has been updated. The updated entries are merged into the
+        entries in the file, which another compilation may have saved in the meantime, and entries whose files have
+        changed or been deleted are removed. A lock file prevents concurrent saves from losing each other's entries."""
+        if len(self._updated) == 0:
+            return
+        partial = f"{self.path}.{uuid.uuid4().hex}.partial"
+        try:
+            with _lockFile(f"{self.path}.lock"):
+                acquisitions = self._load()
+                for acqPath, entries in self._updated.items():
+                    acquisitions[acqPath] = {**acquisitions.get(acqPath, {}), **entries}
+                acquisitions = _prune(acquisitions)
+                with open(partial, 'wb') as f:
+                    pickle.dump({'version': self._FORMAT_VERSION, 'acquisitions': acquisitions}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(partial, self.path)  # Readers never see a partially written file.
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Failed to save the compilation cache {self.path}: {e}")
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return
+        self._acquisitions = acquisitions
+        self._updated = {}
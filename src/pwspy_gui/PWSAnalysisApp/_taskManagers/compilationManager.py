@@ -18,16 +18,19 @@
 from __future__ import annotations
 
 import logging
+import multiprocessing as mp
 import traceback
 
 import logging
-from PyQt5.QtCore import QThread
-from PyQt5.QtWidgets import QMessageBox, QMainWindow
+from PyQt5.QtWidgets import QMessageBox, QMainWindow, QApplication
 from PyQt5 import QtCore
-from pwspy_gui.sharedWidgets.dialogs import BusyDialog
+from pwspy_gui.sharedWidgets.jobManager import JobThread, Job
 from pwspy_gui.PWSAnalysisApp._taskManagers.analysisManager import safeCallback
 import re
-from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateCompiler, ConglomerateAnalysisResults
+from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateCompiler, ConglomerateAnalysisResults, LazyAnalysisResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import loadCompiled
+from pwspy_gui.PWSAnalysisApp._taskManagers import compilationCache
+from pwspy_gui.PWSAnalysisApp._taskManagers.compilationCache import CompilationCache
 import typing
 if typing.TYPE_CHECKING:
     from typing import Tuple, List, Optional
@@ -36,15 +39,25 @@ if typing.TYPE_CHECKING:
     from pwspy.analysis.warnings import AnalysisWarning
 
 
+def _processIndexed(args: tuple) -> Tuple[int, Tuple[Tuple[Acquisition, List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]]], compilationCache.Entries]]:
+    """Run in the worker processes of a parallel compilation. Returns the index of the acquisition along with the result
+    since the results arrive in the order that they finish."""
+    index, procArgs = args
+    return index, CompilationManager.CompilationThread._process(*procArgs)
+
+
 class CompilationManager(QtCore.QObject):
     compilationDone = QtCore.pyqtSignal(list)
+    compilationStarted = QtCore.pyqtSignal()
+    compilationProgressed = QtCore.pyqtSignal(object)  # The results of a single acquisition, emitted as soon as they are ready. `compilationDone` is still emitted with all of the results in order.
 
     def __init__(self, window: QMainWindow):
         super().__init__()
         self.window = window
 
     @safeCallback
-    def run(self) -> List[Tuple[Acquisition, List[Tuple[ConglomerateCompilerResults, Optional[List[AnalysisWarning]]]]]]:
+    def run(self):
+        """Submit a compilation of the selected cells to the job manager. `compilationDone` will be emitted once the job has finished."""
         roiName: str = self.window.resultsTable.getRoiName()
         analysisName: str = self.window.resultsTable.getAnalysisName()
         settings: ConglomerateCompilerSettings = self.window.resultsTable.getSettings()
@@ -53,58 +66,198 @@ class CompilationManager(QtCore.QObject):
             QMessageBox.information(self.window, "What?", "Please select at least one cell.")
             return None
         compiler = ConglomerateCompiler(settings)
-        b = BusyDialog(self.window, "Processing. Please Wait...")
-        t = self.CompilationThread(cellMetas, compiler, roiName, analysisName)
-        t.finished.connect(b.accept)
-        t.errorOccurred.connect(lambda e: QMessageBox.information(self.window, 'Uh Oh', str(e)))
-        t.start()
-        b.exec()
-        results = t.result
-        if results is not None: #If None then an error must have occurred
-            self.compilationDone.emit(results)
-            return results
-        else:
+        app = QApplication.instance()
+        numWorkers = min(app.pipelineSettings.getNumWorkers(), len(cellMetas)) if app.parallelProcessing else 0
+        cache = CompilationCache(app.workingDirectory) if app.workingDirectory is not None else None
+        t = self.CompilationThread(cellMetas, compiler, roiName, analysisName, numWorkers, cache)
+        t.acquisitionCompiled.connect(self.compilationProgressed.emit)
+        t.started.connect(self.compilationStarted.emit)
+
+        def handleFinished(job: Job):
+            if job.error is not None:
+                QMessageBox.information(self.window, 'Uh Oh', str(job.error))
+            elif job.status == Job.Status.Finished:
+                self.compilationDone.emit(t.result)
+        self.window.jobManager.submit(t, f"Compilation: {analysisName} / {roiName}", onFinished=handleFinished)
+
+    @safeCallback
+    def loadSaved(self):
+        """Load the ROIs of the selected cells that were compiled while they were being analyzed, rather than compiling
+        them again. `compilationDone` will be emitted once the job has finished. ROIs that have changed, or were
+        compiled with different settings, since the cells were analyzed aren't loaded. If there are any the cells can be
+        compiled instead. See `roiCompilation`."""
+        roiName: str = self.window.resultsTable.getRoiName()
+        analysisName: str = self.window.resultsTable.getAnalysisName()
+        settings: ConglomerateCompilerSettings = self.window.resultsTable.getSettings()
+        cellMetas: List[Acquisition] = self.window.cellSelector.getSelectedCellMetas()
+        if len(cellMetas) == 0:
+            QMessageBox.information(self.window, "What?", "Please select at least one cell.")
             return None
+        t = self.LoadSavedThread(cellMetas, roiName, analysisName, settings)
+
+        def handleFinished(job: Job):
+            if job.error is not None:
+                QMessageBox.information(self.window, 'Uh Oh', str(job.error))
+            elif job.status == Job.Status.Finished:
+                if t.stale > 0:
+                    ans = QMessageBox.question(self.window, "Out of Date", f"{t.stale} of the saved ROI compilations are out of date because the ROIs or the "
+                                                                            f"compilation settings have changed since the cells were analyzed. Compile the selected cells instead?")
+                    if ans == QMessageBox.Yes:
+                        self.run()
+                        return
+                if sum(len(roiList) for acq, roiList in t.result) == 0:
+                    QMessageBox.information(self.window, "Nothing Found", "None of the selected cells have saved compilations matching the analysis and ROI names. "
+                                                                          "ROIs are only saved if `Compile ROIs` was checked when the cells were analyzed.")
+                self.compilationDone.emit(t.result)
+        self.window.jobManager.submit(t, f"Load Compilation: {analysisName} / {roiName}", onFinished=handleFinished)
 
-    class CompilationThread(QThread):
-        errorOccurred = QtCore.pyqtSignal(Exception)
+    class CompilationThread(JobThread):
+        """Compiles the ROIs of each acquisition.
 
-        def __init__(self, cellMetas: List[Acquisition], compiler: ConglomerateCompiler, roiNamePattern: str, analysisNamePattern: str):
-            super().__init__()
+        Args:
+            cellMetas: The acquisitions to compile.
+            compiler: The compiler.
+            roiNamePattern: ROIs with names matching this regex are compiled.
+            analysisNamePattern: Analyses with names matching this regex are compiled.
+            numWorkers: The number of processes to compile the acquisitions with. If 0 or 1 they are compiled one at a
+                time in this thread.
+            cache: If not `None` then only the ROIs that have changed since they were cached are compiled. The cache is
+                updated and saved once the compilation is done, or cancelled.
+        """
+        acquisitionCompiled = QtCore.pyqtSignal(object)  # The result of `_process` for each acquisition, in the order that they finish.
+
+        def __init__(self, cellMetas: List[Acquisition], compiler: ConglomerateCompiler, roiNamePattern: str, analysisNamePattern: str, numWorkers: int = 0,
+                     cache: Optional[CompilationCache] = None):
+            super().__init__(len(cellMetas))
             self.cellMetas = cellMetas
             self.roiNamePattern = roiNamePattern
             self.analysisNamePattern = analysisNamePattern
             self.compiler = compiler
+            self.numWorkers = numWorkers
+            self.cache = cache
             self.result = None
 
         def run(self):
             try:
-                self.result = []
-                for acq in self.cellMetas:
-                    self.result.append(self._process(acq, self.compiler, self.roiNamePattern, self.analysisNamePattern)) # A list of Tuples. each tuple containing a list of warnings and the Acquisition to go with it.
+                results = {}
+                if self.numWorkers > 1:
+                    self._runParallel(results)
+                else:
+                    for i, acq in enumerate(self.cellMetas):
+                        if self.isCancelled():
+                            break
+                        results[i], entries = self._process(acq, self.compiler, self.roiNamePattern, self.analysisNamePattern, self._cached(acq))
+                        self._updateCache(acq, entries)
+                        self.acquisitionCompiled.emit(results[i])
+                        self.reportProgress(i + 1)
+                self.result = [results[i] for i in sorted(results)]  # A list of Tuples. each tuple containing an Acquisition and the compiled results of each of its ROIs. In the same order as `cellMetas`.
             except Exception as e:
                 logger = logging.getLogger(__name__)
                 logger.warning("Compilation error:")
                 logger.exception(e)
-                self.errorOccurred.emit(e)
+                self.errorOccurred.emit(e, traceback.format_exc())
+            finally:
+                if self.cache is not None:
+                    self.cache.save()
+
+        def _cached(self, acq: Acquisition) -> Optional[compilationCache.Entries]:
+            return self.cache.get(acq) if self.cache is not None else None
+
+        def _updateCache(self, acq: Acquisition, entries: compilationCache.Entries):
+            if self.cache is not None:
+                self.cache.update(acq, entries)
+
+        def _runParallel(self, results: dict):
+            """Compile the acquisitions in a pool of processes, adding the results to `results` by index as they finish."""
+            args = [(i, (acq, self.compiler, self.roiNamePattern, self.analysisNamePattern, self._cached(acq))) for i, acq in enumerate(self.cellMetas)]
+            pool = mp.Pool(processes=self.numWorkers)
+            try:
+                for i, (result, entries) in pool.imap_unordered(_processIndexed, args):
+                    results[i] = result
+                    self._updateCache(self.cellMetas[i], entries)
+                    self.acquisitionCompiled.emit(result)
+                    self.reportProgress(len(results))
+                    if self.isCancelled():
+                        break
+            finally:
+                pool.terminate()  # Stops any acquisitions that are still being compiled if we were cancelled.
+                pool.join()
 
         @staticmethod
-        def _process(acq: Acquisition, compiler: ConglomerateCompiler, roiNamePattern: str, analysisNamePattern: str) -> Tuple[Acquisition, List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]]]:
+        def _process(acq: Acquisition, compiler: ConglomerateCompiler, roiNamePattern: str, analysisNamePattern: str,
+                     cached: Optional[compilationCache.Entries] = None) -> Tuple[Tuple[Acquisition, List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]]], compilationCache.Entries]:
+            """Compile the ROIs of a single acquisition.
+
+            Args:
+                acq: The acquisition.
+                compiler: The compiler.
+                roiNamePattern: ROIs with names matching this regex are compiled.
+                analysisNamePattern: Analyses with names matching this regex are compiled.
+                cached: The cache entries of the acquisition. ROIs with up to date entries aren't compiled again, and
+                    analyses that only have up to date entries aren't loaded.
+
+            Returns:
+                The acquisition along with the compiled results of each of its ROIs, and the updated cache entries of
+                the acquisition.
+            """
             rois = [acq.loadRoi(name, num, fformat) for name, num, fformat in acq.getRois() if re.match(roiNamePattern, name)]
-            pwsAnalysisResults = [acq.pws.loadAnalysis(name) for name in acq.pws.getAnalyses() if re.match(analysisNamePattern, name)] if acq.pws is not None else []
-            dynamicAnalysisResults = [acq.dynamics.loadAnalysis(name) for name in acq.dynamics.getAnalyses() if re.match(analysisNamePattern, name)] if acq.dynamics is not None else []
-            conglomeratedAnalysisResults = []
-            for pws in pwsAnalysisResults:  # Find the analyses with matching names and pair them.
-                for dyn in dynamicAnalysisResults:
-                    if pws.analysisName == dyn.analysisName:
-                        conglomeratedAnalysisResults.append(ConglomerateAnalysisResults(pws, dyn))
-                        pwsAnalysisResults.remove(pws) #Once an analysis has been paired remove it from the list of analyses
-                        dynamicAnalysisResults.remove(dyn)
-            conglomeratedAnalysisResults += [ConglomerateAnalysisResults(pws, None) for pws in pwsAnalysisResults] #Any remaining analyses couldn't be paired. Just add them on their own.
-            conglomeratedAnalysisResults += [ConglomerateAnalysisResults(None, dyn) for dyn in dynamicAnalysisResults]
+            pwsNames = [name for name in acq.pws.getAnalyses() if re.match(analysisNamePattern, name)] if acq.pws is not None else []
+            dynNames = [name for name in acq.dynamics.getAnalyses() if re.match(analysisNamePattern, name)] if acq.dynamics is not None else []
+            paired = [name for name in pwsNames if name in dynNames]  # Analyses with matching names are paired.
+            analysisPairs = ([(name, name) for name in paired]
+                             + [(name, None) for name in pwsNames if name not in paired]  # Any remaining analyses couldn't be paired. Just add them on their own.
+                             + [(None, name) for name in dynNames if name not in paired])
+            settingsKey = compilationCache.settingsKey(compiler.settings)
+            entries = dict(cached) if cached is not None else {}
+            roiMasks = None
             ret = []
-            for analysisResult in conglomeratedAnalysisResults:
-                for roi in rois:
-                    cResults, warnings = compiler.run(analysisResult, roi)
-                    ret.append((cResults, warnings))
-            return acq, ret
+            for pwsName, dynName in analysisPairs:
+                pwsPath = compilationCache.analysisPath(acq.pws, pwsName) if pwsName is not None else None
+                dynPath = compilationCache.analysisPath(acq.dynamics, dynName) if dynName is not None else None
+                keys = [compilationCache.makeKey(pwsPath, dynPath, roi, settingsKey) for roi in rois]
+                stamps = [compilationCache.makeStamp(key) for key in keys]
+                compiled = [entries[key][1] if key in entries and stamp is not None and entries[key][0] == stamp else None for key, stamp in zip(keys, stamps)]
+                stale = [i for i, c in enumerate(compiled) if c is None]
+                if len(stale) > 0:
+                    if roiMasks is None:
+                        roiMasks = [roi.getRoi() for roi in rois]  # Load each ROI once rather than once per analysis.
+                    analysisResult = ConglomerateAnalysisResults(LazyAnalysisResults(acq.pws, pwsName) if pwsName is not None else None,
+                                                                 LazyAnalysisResults(acq.dynamics, dynName) if dynName is not None else None)
+                    try:
+                        batch = compiler.runBatch(analysisResult, [rois[i] for i in stale], [roiMasks[i] for i in stale])
+                    finally:
+                        for results in analysisResult:
+                            if results is not None:
+                                results.close()
+                    for i, c in zip(stale, batch):
+                        compiled[i] = c
+                        if stamps[i] is not None:
+                            entries[keys[i]] = (stamps[i], c)
+                ret += compiled
+            return (acq, ret), entries
+
+    class LoadSavedThread(JobThread):
+        def __init__(self, cellMetas: List[Acquisition], roiNamePattern: str, analysisNamePattern: str, settings: ConglomerateCompilerSettings):
+            super().__init__(len(cellMetas))
+            self.cellMetas = cellMetas
+            self.roiNamePattern = roiNamePattern
+            self.analysisNamePattern = analysisNamePattern
+            self.settings = settings
+            self.result = None
+            self.stale = 0  # The number of ROIs whose saved compilation was out of date, these aren't included in `result`.
+
+        def run(self):
+            try:
+                self.result = []
+                for i, acq in enumerate(self.cellMetas):
+                    if self.isCancelled():
+                        return
+                    compiled, stale = loadCompiled(acq, self.analysisNamePattern, self.roiNamePattern, self.settings)
+                    self.result.append((acq, compiled))
+                    self.stale += stale
+                    self.reportProgress(i + 1)
+            except Exception as e:
+                logger = logging.getLogger(__name__)
+                logger.warning("Error loading saved compilation:")
+                logger.exception(e)
+                self.errorOccurred.emit(e, traceback.format_exc())
@@ -0,0 +1,89 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Small json files saved next to each analysis result recording that it was fully saved and what it was computed from.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import dataclasses
+import hashlib
+import json
+import os
+import typing
+from typing import Optional
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysisSettings
+
+
+@dataclasses.dataclass(frozen=True)
+class CompletionMarker:
+    """Identifies the inputs that an analysis result was computed from.
+
+    Attributes:
+        settingsHash: A hash of the analysis settings.
+        referenceIdTag: The idTag of the reference acquisition.
+        extraReflectionIdTag: The idTag of the extra reflectance cube. `None` if the extra reflectance correction was skipped.
+        roiNamePattern: The pattern of the names of the ROIs that the analysis was restricted to. `None` if the whole
+            image was analyzed.
+        singlePrecision: `True` if the analysis was run in single precision.
+    """
+    settingsHash: str
+    referenceIdTag: str
+    extraReflectionIdTag: Optional[str]
+    roiNamePattern: Optional[str] = None
+    singlePrecision: bool = False
+
+    @staticmethod
+    def hashSettings(settings: AbstractAnalysisSettings) -> str:
+        """Generate a hash that will change if any of the analysis settings change."""
+        s = json.dumps(dataclasses.asdict(settings), sort_keys=True, default=str)
+        return hashlib.sha256(s.encode()).hexdigest()
+
+    @classmethod
+    def create(cls, settings: AbstractAnalysisSettings, refMeta: pwsdt.AnalysisManagerMetaDataBase,
+               erMeta: Optional[pwsdt.ERMetaData], roiNamePattern: Optional[str] = None, singlePrecision: bool = False) -> CompletionMarker:
+        return cls(cls.hashSettings(settings), refMeta.idTag, erMeta.idTag if erMeta is not None else None, roiNamePattern, singlePrecision)
+
+    @staticmethod
+    def getPath(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str) -> str:
+        return os.path.join(md.filePath, f"analysisComplete_{analysisName}.json")
+
+    def toFile(self, md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str):
+        """Save this marker for the analysis named `analysisName` of acquisition `md`. This should only be called once
+        the analysis results have been fully saved."""
+        with open(self.getPath(md, analysisName), 'w') as f:
+            json.dump(dataclasses.asdict(self), f)
+
+    @classmethod
+    def fromFile(cls, md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str) -> Optional[CompletionMarker]:
+        """Load the marker for the analysis named `analysisName` of acquisition `md`. Returns `None` if there is no
+        valid marker, meaning that the analysis was never completed or was saved by an older version."""
+        try:
+            with open(cls.getPath(md, analysisName), 'r') as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    @classmethod
+    def remove(cls, md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str):
+        """Delete the marker, if it exists."""
+        path = cls.getPath(md, analysisName)
+        if os.path.exists(path):
+            os.remove(path)
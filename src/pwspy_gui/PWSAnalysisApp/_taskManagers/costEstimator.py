@@ -0,0 +1,199 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Predicts the time, memory and disk space that a set of analyses will need from the size of the raw data files and
+the timings of previous analyses.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import dataclasses
+import json
+import logging
+import statistics
+import typing
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import psutil
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPipeline import PipelineSettings
+from pwspy_gui.PWSAnalysisApp._taskManagers.memoryScheduler import MemoryScheduler, rawDataBytes
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import CellTiming
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+class CostEstimate(typing.NamedTuple):
+    """The predicted cost of running analyses.
+
+    Attributes:
+        numCells: The number of acquisitions that will be loaded.
+        numResults: The number of analysis results that will be saved.
+        inputBytes: The total size of the raw data.
+        wallSeconds: The predicted time from start to finish.
+        peakMemoryBytes: The predicted peak memory use of the whole system, including memory that is already in use.
+        outputBytes: The predicted disk space used by the results.
+        numWorkers: The number of processes that will be used to compute the analyses.
+        bottleneck: The stage predicted to limit the speed of the analysis: `read`, `compute`, or `write`.
+        calibrationSamples: The number of previously recorded acquisitions that the prediction is based on.
+    """
+    numCells: int
+    numResults: int
+    inputBytes: int
+    wallSeconds: float
+    peakMemoryBytes: int
+    outputBytes: int
+    numWorkers: int
+    bottleneck: str
+    calibrationSamples: int
+
+    @staticmethod
+    def combine(estimates: Sequence[CostEstimate]) -> CostEstimate:
+        """Combine the estimates of analyses that are run one after another."""
+        return CostEstimate(sum(e.numCells for e in estimates), sum(e.numResults for e in estimates),
+                            sum(e.inputBytes for e in estimates), sum(e.wallSeconds for e in estimates),
+                            max((e.peakMemoryBytes for e in estimates), default=0), sum(e.outputBytes for e in estimates),
+                            max((e.numWorkers for e in estimates), default=0),
+                            max(estimates, key=lambda e: e.wallSeconds).bottleneck if len(estimates) > 0 else '',
+                            max((e.calibrationSamples for e in estimates), default=0))
+
+    def describe(self) -> str:
+        """A human readable summary."""
+        minutes, seconds = divmod(int(round(self.wallSeconds)), 60)
+        hours, minutes = divmod(minutes, 60)
+        calibration = f"calibrated from {self.calibrationSamples} previous cells" if self.calibrationSamples > 0 else "not calibrated, using default rates"
+        return (f"{self.numCells} cells ({self.inputBytes / 1024**3:.1f} GB), {self.numResults} results\n"
+                f"Time: {hours}h {minutes:02d}m {seconds:02d}s using {self.numWorkers} processes, limited by {self.bottleneck}\n"
+                f"Peak memory: {self.peakMemoryBytes / 1024**3:.1f} GB of {psutil.virtual_memory().total / 1024**3:.1f} GB\n"
+                f"Disk space for results: {self.outputBytes / 1024**3:.2f} GB\n"
+                f"({calibration})")
+
+
+@dataclasses.dataclass
+class _Rates:
+    """The rates used to make predictions. All data sizes are relative to the size of the raw data files."""
+    readBytesPerSecond: float = 100 * 1024**2  # Per reader thread.
+    writeBytesPerSecond: float = 100 * 1024**2  # Per writer thread.
+    computeBytesPerSecond: Dict[str, float] = dataclasses.field(default_factory=dict)  # Per process, keyed by analysis type.
+    outputRatio: Dict[str, float] = dataclasses.field(default_factory=dict)  # Bytes saved per raw byte, keyed by analysis type.
+    memoryFactor: float = MemoryScheduler.RAW_TO_FLOAT * 4  # Peak process memory per raw byte.
+    samples: int = 0
+
+
+class CostEstimator:
+    """Predicts the cost of analyses from the metadata of the acquisitions.
+
+    Args:
+        timings: Timings recorded by previous analyses. Used to calibrate the predictions.
+    """
+    DEFAULT_COMPUTE_BYTES_PER_SECOND = 20 * 1024**2
+    DEFAULT_OUTPUT_RATIO = 0.3
+    MAX_SAMPLES = 1000  # Only the most recent timings are used so that the predictions follow changes to the hardware.
+
+    def __init__(self, timings: Iterable[CellTiming] = ()):
+        self._rates = _Rates()
+        self.calibrate(timings)
+
+    @classmethod
+    def fromLog(cls, path: Optional[str], timings: Iterable[CellTiming] = ()) -> CostEstimator:
+        """Calibrate using a timing log written by the analysis pipeline in addition to `timings`.
+
+        Args:
+            path: The path to a json-lines timing log. Ignored if `None` or if the file doesn't exist.
+            timings: Additional timings, e.g. from analyses run in this session that weren't logged.
+        """
+        loaded = []
+        if path is not None:
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            loaded.append(CellTiming(**json.loads(line)))
+                        except (ValueError, TypeError):  # A partially written line or an older format.
+                            continue
+            except OSError:
+                pass
+        return cls(loaded + list(timings))
+
+    def calibrate(self, timings: Iterable[CellTiming]):
+        """Update the rates based on recorded timings."""
+        timings = [t for t in timings if t.bytesRead > 0][-self.MAX_SAMPLES:]
+        rates = _Rates(samples=len(timings))
+        if len(timings) > 0:
+            readTime = sum(t.read for t in timings)
+            if readTime > 0:
+                rates.readBytesPerSecond = sum(t.bytesRead for t in timings) / readTime
+            writeTime = sum(t.write for t in timings)
+            if writeTime > 0:
+                rates.writeBytesPerSecond = max(sum(t.bytesWritten for t in timings) / writeTime, 1)
+            rates.memoryFactor = statistics.median(t.peakRss / t.bytesRead for t in timings)
+            byType: Dict[str, List[CellTiming]] = {}
+            for t in timings:
+                if len(set(t.analysisTypes)) == 1:  # We can't separate the time spent on each type of analysis for cells with more than one.
+                    byType.setdefault(t.analysisTypes[0], []).append(t)
+            for anType, typeTimings in byType.items():
+                analyzedBytes = sum(t.bytesRead * len(t.analysisTypes) for t in typeTimings)
+                computeTime = sum(t.correct + t.analyze for t in typeTimings)
+                if computeTime > 0:
+                    rates.computeBytesPerSecond[anType] = analyzedBytes / computeTime
+                rates.outputRatio[anType] = sum(t.bytesWritten for t in typeTimings) / analyzedBytes
+        self._rates = rates
+        logging.getLogger(__name__).debug(f"Cost estimator calibrated: {rates}")
+
+    def estimate(self, tasks: Sequence[Tuple[str, Sequence[pwsdt.AnalysisManagerMetaDataBase]]], settings: PipelineSettings,
+                 parallel: bool) -> CostEstimate:
+        """Predict the cost of running analyses together in a single pipeline.
+
+        Args:
+            tasks: The type name of each analysis (e.g. `PWSAnalysis`) and the acquisitions it will be run on.
+            settings: The settings of the pipeline.
+            parallel: `True` if the analyses will be computed in multiple processes.
+        """
+        rates = self._rates
+        cells: Dict[str, List[str]] = {}  # Acquisitions are only loaded once, even if they are in more than one of the tasks.
+        metas = {}
+        for anType, cellMetas in tasks:
+            for md in cellMetas:
+                cells.setdefault(md.filePath, []).append(anType)
+                metas[md.filePath] = md
+        sizes = {path: rawDataBytes(md) for path, md in metas.items()}
+        inputBytes = sum(sizes.values())
+        readTime = inputBytes / rates.readBytesPerSecond
+        computeTime, outputBytes = 0.0, 0.0
+        for path, anTypes in cells.items():
+            for anType in anTypes:
+                computeTime += sizes[path] / rates.computeBytesPerSecond.get(anType, self.DEFAULT_COMPUTE_BYTES_PER_SECOND)
+                outputBytes += sizes[path] * rates.outputRatio.get(anType, self.DEFAULT_OUTPUT_RATIO)
+        writeTime = outputBytes / rates.writeBytesPerSecond
+
+        largestCube = max(sizes.values(), default=0)
+        scheduler = MemoryScheduler(settings.memoryLimit, intermediateFactor=rates.memoryFactor / MemoryScheduler.RAW_TO_FLOAT)
+        scheduler.setCubeBytes(largestCube * MemoryScheduler.RAW_TO_FLOAT)
+        if parallel and settings.getNumWorkers() > 0 and len(cells) > 0:
+            numWorkers = scheduler.chooseNumWorkers(settings.getNumWorkers(), len(cells), settings.queueSize)
+        else:
+            numWorkers = 1
+        stageTimes = {'read': readTime / settings.numReaders, 'compute': computeTime / numWorkers, 'write': writeTime / settings.numWriters}
+        bottleneck = max(stageTimes, key=stageTimes.get)
+        # The stages overlap, so the slowest stage determines the time. Add the time for one cell to pass through the whole pipeline.
+        fillTime = (readTime + computeTime + writeTime) / len(cells) if len(cells) > 0 else 0
+        wallSeconds = stageTimes[bottleneck] + fillTime
+
+        vm = psutil.virtual_memory()
+        queuedBytes = 2 * settings.queueSize * scheduler.cubeBytes if len(cells) > 0 else 0  # Loaded cubes waiting between stages.
+        peakMemory = vm.total - vm.available + numWorkers * scheduler.perWorkerBytes() + queuedBytes
+        return CostEstimate(len(cells), sum(len(t) for t in cells.values()), inputBytes, wallSeconds, int(peakMemory),
+                            int(outputBytes), numWorkers, bottleneck, rates.samples)
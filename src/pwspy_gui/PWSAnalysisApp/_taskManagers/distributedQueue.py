@@ -0,0 +1,595 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Distributes the acquisitions of an analysis across many computers using a job directory in a shared directory.
+Workers claim acquisitions by atomically renaming their files and renew the claim while they work on them.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import collections
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import typing
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+import pwspy.dataTypes as pwsdt
+from pwspy_gui.PWSAnalysisApp._taskManagers import jobSerialization
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPipeline import AnalysisTask, PipelineSettings, StageUtilization, groupByAcquisition, saveResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.resultWriter import ResultLayout, WriteStats
+from pwspy_gui.PWSAnalysisApp._taskManagers.memoryScheduler import rawDataBytes
+from pwspy_gui.PWSAnalysisApp._taskManagers.tiling import MappedCube, padResults, removeDiskArrays
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region, cropCube, findRegion
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import CellCompilation, prepareCompilations
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import STAGES, CellTiming, TimingRecorder, directorySize
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import AnalysisContext, WorkerPool, analyzeCube
+if typing.TYPE_CHECKING:
+    from pwspy.analysis.warnings import AnalysisWarning
+
+
+class Lease(typing.NamedTuple):
+    """An acquisition that has been claimed by a worker.
+
+    Attributes:
+        index: The index of the acquisition in the job.
+        item: The contents of the work item. See `FileQueue.create`.
+        path: The path of the claim file.
+    """
+    index: int
+    item: dict
+    path: str
+
+
+class FileQueue:
+    """The job directory of a single distributed job.
+
+    Args:
+        directory: The job directory.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.jobId = os.path.basename(os.path.normpath(directory))
+        self._pending = os.path.join(directory, 'pending')
+        self._claimed = os.path.join(directory, 'claimed')
+        self._done = os.path.join(directory, 'done')
+        self._failed = os.path.join(directory, 'failed')
+        self._arrays = os.path.join(directory, 'arrays')
+        self._context = os.path.join(directory, 'context.json')
+
+    def create(self, context: dict, items: typing.Sequence[dict]):
+        """Create the job directory. The context is saved before the work items so that workers never see an item
+        without its context.
+
+        Args:
+            context: Everything needed to run the analysis. Loaded by workers with `loadContext`. Saved with
+                `jobSerialization`, so it may only contain the types supported there.
+            items: A json serializable dictionary for each acquisition. Must include the `index` of the item.
+        """
+        for d in (self._pending, self._claimed, self._done, self._failed, self._arrays):
+            os.makedirs(d)
+        self._atomicWrite(self._context, jobSerialization.dumps(context, self._arrays).encode())
+        for item in items:
+            self._atomicWrite(os.path.join(self._pending, f"{item['index']:06d}.json"), json.dumps(item).encode())
+
+    def isReady(self) -> bool:
+        """Returns `True` if the job has been fully created and has not been cancelled."""
+        return os.path.exists(self._context) and not self.isCancelled()
+
+    def loadContext(self) -> dict:
+        with open(self._context, 'r') as f:
+            return jobSerialization.loads(f.read(), self._arrays)
+
+    def claim(self, workerId: str) -> Optional[Lease]:
+        """Try to claim a pending acquisition.
+
+        Returns:
+            The lease on the acquisition or `None` if there are no pending acquisitions.
+        """
+        try:
+            names = sorted(os.listdir(self._pending))
+        except FileNotFoundError:  # The job has been removed.
+            return None
+        for name in names:
+            if not name.endswith('.json'):
+                continue  # A partially written item.
+            index = int(name.split('.')[0])
+            path = os.path.join(self._claimed, f"{index:06d}.{workerId}")
+            try:
+                os.rename(os.path.join(self._pending, name), path)
+            except OSError:  # Another worker got it first.
+                continue
+            os.utime(path)  # Start the lease.
+            with open(path, 'r') as f:
+                return Lease(index, json.load(f), path)
+        return None
+
+    @staticmethod
+    def renew(lease: Lease) -> bool:
+        """Extend a lease.
+
+        Returns:
+            `False` if the lease has expired and the acquisition was put back in the queue.
+        """
+        try:
+            os.utime(lease.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, lease: Lease, record: dict):
+        """Record that the acquisition of `lease` has been analyzed and saved."""
+        self._atomicWrite(os.path.join(self._done, f"{lease.index:06d}.json"), jobSerialization.dumps(record).encode())
+        self._release(lease)
+
+    def fail(self, lease: Lease, message: str):
+        """Record that the acquisition of `lease` could not be analyzed."""
+        self._atomicWrite(os.path.join(self._failed, f"{lease.index:06d}.json"), json.dumps({'index': lease.index, 'message': message}).encode())
+        self._release(lease)
+
+    def reclaimExpired(self, leaseTimeout: float) -> int:
+        """Put acquisitions whose lease hasn't been renewed for `leaseTimeout` seconds back in the queue.
+
+        Returns:
+            The number of acquisitions that were put back.
+        """
+        now = self._serverTime()
+        count = 0
+        for name in os.listdir(self._claimed):
+            path = os.path.join(self._claimed, name)
+            try:
+                if os.stat(path).st_mtime + leaseTimeout > now:
+                    continue
+                index = int(name.split('.')[0])
+                os.rename(path, os.path.join(self._pending, f"{index:06d}.json"))
+            except OSError:  # The worker finished or someone else reclaimed it.
+                continue
+            logging.getLogger(__name__).warning(f"The lease on item {index} of job {self.jobId} held by {name.split('.', 1)[1]} expired. Returning it to the queue.")
+            count += 1
+        return count
+
+    def counts(self) -> Tuple[int, int, int, int]:
+        """Returns the number of pending, claimed, done, and failed acquisitions."""
+        return tuple(len(os.listdir(d)) for d in (self._pending, self._claimed, self._done, self._failed))
+
+    def doneRecords(self, exclude: typing.Container[str] = ()) -> Dict[str, dict]:
+        """Load the records of completed acquisitions.
+
+        Args:
+            exclude: The names of records that have already been loaded.
+
+        Returns:
+            A dictionary of the newly loaded records keyed by file name.
+        """
+        records = {}
+        for name in os.listdir(self._done):
+            if name in exclude or not name.endswith('.json'):
+                continue
+            with open(os.path.join(self._done, name), 'r') as f:
+                records[name] = jobSerialization.loads(f.read())
+        return records
+
+    def failures(self) -> List[dict]:
+        failures = []
+        for name in sorted(os.listdir(self._failed)):
+            if name.endswith('.json'):
+                with open(os.path.join(self._failed, name), 'r') as f:
+                    failures.append(json.load(f))
+        return failures
+
+    def isCancelled(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, 'cancelled'))
+
+    def cancel(self):
+        """Stop workers from claiming any more acquisitions of this job. Acquisitions already claimed are finished."""
+        with open(os.path.join(self.directory, 'cancelled'), 'w'):
+            pass
+        for name in os.listdir(self._pending):
+            try:
+                os.remove(os.path.join(self._pending, name))
+            except OSError:  # Claimed in the meantime.
+                pass
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _release(self, lease: Lease):
+        try:
+            os.remove(lease.path)
+        except FileNotFoundError:  # Our lease expired but we finished anyway.
+            pass
+
+    def _serverTime(self) -> float:
+        """Returns the current time according to the file server."""
+        path = os.path.join(self.directory, 'clock')
+        with open(path, 'w'):
+            pass
+        return os.stat(path).st_mtime
+
+    @staticmethod
+    def _atomicWrite(path: str, data: bytes):
+        """Write to a temporary file and then rename it so that readers never see a partially written file."""
+        tempPath = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tempPath, 'wb') as f:
+            f.write(data)
+        os.replace(tempPath, path)
+
+
+class DistributedWorker:
+    """Claims acquisitions from the jobs in a shared directory, analyzes them, and saves the results.
+
+    Args:
+        rootDirectory: The shared directory that jobs are submitted to.
+        numThreads: The number of acquisitions to work on at once.
+        pool: If provided, the analyses are run in this pool of processes. Otherwise they are run in the worker threads.
+        leaseTimeout: The lease timeout of the jobs. Leases are renewed 4 times per timeout.
+        jobFilter: If not `None` then only the job with this id is worked on.
+        pathMap: Maps the start of the acquisition paths of the submitting computer to the start of the paths on this
+            computer, e.g. `{'D:\\\\data': '/mnt/data'}`. Needed if the share is mounted at different locations.
+        pollInterval: The number of seconds to wait before looking for new work when there is none.
+    """
+    _MAX_CACHED_JOBS = 4
+
+    def __init__(self, rootDirectory: str, numThreads: int = 1, pool: WorkerPool = None, leaseTimeout: float = 300,
+                 jobFilter: str = None, pathMap: Dict[str, str] = None, pollInterval: float = 2):
+        self.rootDirectory = rootDirectory
+        self.numThreads = numThreads
+        self.pool = pool
+        self.leaseTimeout = leaseTimeout
+        self.jobFilter = jobFilter
+        self.pathMap = pathMap if pathMap is not None else {}
+        self.pollInterval = pollInterval
+        self.workerId = f"{socket.gethostname()}-{os.getpid()}"
+        self._leases: Dict[str, Lease] = {}
+        self._jobs: typing.OrderedDict[str, Tuple[dict, Optional[AnalysisContext]]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, stop: threading.Event, exitWhenIdle: bool = False):
+        """Work on jobs until `stop` is set.
+
+        Args:
+            stop: Set this to stop working. Acquisitions that are in progress are finished first.
+            exitWhenIdle: If `True` then return once there is no work left rather than waiting for new jobs.
+        """
+        logging.getLogger(__name__).info(f"Distributed worker {self.workerId} watching {self.rootDirectory} with {self.numThreads} threads.")
+        finished = threading.Event()
+        threads = [threading.Thread(target=self._work, args=(f"{self.workerId}-{i}", stop, exitWhenIdle), daemon=True)
+                   for i in range(self.numThreads)]
+        heartbeat = threading.Thread(target=self._heartbeat, args=(finished,), daemon=True)
+        [t.start() for t in threads + [heartbeat]]
+        [t.join() for t in threads]
+        finished.set()
+        heartbeat.join()
+        if self.pool is not None:
+            self.pool.trimSharedBlocks()
+        with self._lock:
+            for job, context in self._jobs.values():
+                if context is not None:
+                    context.release()
+            self._jobs.clear()
+
+    def _work(self, threadId: str, stop: threading.Event, exitWhenIdle: bool):
+        logger = logging.getLogger(__name__)
+        while not stop.is_set():
+            try:
+                lease, queue = self._claim(threadId)
+            except Exception as e:  # Don't let a problem with the shared directory stop this thread for good.
+                logger.exception(e)
+                lease, queue = None, None
+            if lease is None:
+                if exitWhenIdle:
+                    return
+                stop.wait(self.pollInterval)
+                continue
+            with self._lock:
+                self._leases[lease.path] = lease
+            try:
+                self._process(queue, lease)
+            except Exception as e:
+                logger.exception(e)
+                try:
+                    queue.fail(lease, f"{self.workerId}: {traceback.format_exc()}")
+                except OSError:  # The job has been removed.
+                    pass
+            finally:
+                with self._lock:
+                    del self._leases[lease.path]
+
+    def _claim(self, threadId: str) -> Tuple[Optional[Lease], Optional[FileQueue]]:
+        """Claim an acquisition from the oldest job that has any pending."""
+        try:
+            jobIds = [self.jobFilter] if self.jobFilter is not None else os.listdir(self.rootDirectory)
+        except OSError:
+            return None, None
+        jobDirs = []
+        for jobId in jobIds:
+            jobDir = os.path.join(self.rootDirectory, jobId)
+            try:
+                if os.path.isdir(jobDir):
+                    jobDirs.append((os.path.getmtime(jobDir), jobDir))
+            except OSError:  # The job was removed by its submitter in the meantime.
+                continue
+        for mtime, jobDir in sorted(jobDirs):
+            queue = FileQueue(jobDir)
+            try:
+                if not queue.isReady():
+                    continue
+                lease = queue.claim(threadId)
+            except OSError:  # The job was removed by its submitter in the meantime.
+                continue
+            if lease is not None:
+                return lease, queue
+        return None, None
+
+    def _getJob(self, queue: FileQueue) -> Tuple[dict, Optional[AnalysisContext]]:
+        """Load the context of a job, keeping the most recently used ones cached."""
+        with self._lock:
+            if queue.jobId in self._jobs:
+                self._jobs.move_to_end(queue.jobId)
+                return self._jobs[queue.jobId]
+        job = queue.loadContext()
+        context = self.pool.createContext(job['analyses'], job['cameraCorrection'], job['binning'], job.get('dropFields'), job.get('singlePrecision')) if self.pool is not None else None
+        with self._lock:
+            if queue.jobId in self._jobs:  # Another thread loaded it in the meantime.
+                if context is not None:
+                    context.release()
+                return self._jobs[queue.jobId]
+            self._jobs[queue.jobId] = (job, context)
+            while len(self._jobs) > self._MAX_CACHED_JOBS:
+                _, (oldJob, oldContext) = self._jobs.popitem(last=False)
+                if oldContext is not None:
+                    oldContext.release()
+        return job, context
+
+    def _process(self, queue: FileQueue, lease: Lease):
+        """Analyze the acquisition of `lease` and save the results."""
+        job, context = self._getJob(queue)
+        tileDirectory = tempfile.mkdtemp(prefix='pwspyTiles_') if job.get('tileSize') is not None else None
+        try:
+            self._analyze(queue, lease, job, context, tileDirectory)
+        finally:
+            if tileDirectory is not None:
+                shutil.rmtree(tileDirectory, ignore_errors=True)
+
+    def _analyze(self, queue: FileQueue, lease: Lease, job: dict, context: Optional[AnalysisContext], tileDirectory: Optional[str]):
+        """Does the work of `_process`. If `tileDirectory` isn't `None` the data is analyzed in tiles, using it for temporary files."""
+        logger = logging.getLogger(__name__)
+        item = lease.item
+        md = getattr(pwsdt.Acquisition(self._mapPath(item['filePath'])), item['type'])
+        timing = CellTiming(md.filePath, [job['analysisNames'][i] for i in item['taskIndices']],
+                            [type(job['analyses'][i]).__name__ for i in item['taskIndices']], bytesRead=rawDataBytes(md))
+        sTime = time.time()
+        roiNamePatterns = job.get('roiNamePatterns')
+        region = findRegion(md, [roiNamePatterns[i] for i in item['taskIndices']]) if roiNamePatterns is not None else None
+        jobCompilations = job.get('compilations')
+        compilations = prepareCompilations(md, [job['analysisNames'][i] for i in item['taskIndices']],
+                                           [jobCompilations[i] for i in item['taskIndices']]) if jobCompilations is not None else None
+        if tileDirectory is not None:
+            im = MappedCube.fromMetadata(md, tileDirectory, job['tileSize'], job['tileOverlap'], region)  # Copied straight from the file so the full cube is never in memory.
+        else:
+            im = md.toDataClass()
+            if region is not None:
+                im = cropCube(im, region)
+        timing.read = time.time() - sTime
+        singlePrecision = job.get('singlePrecision')
+        if context is None:
+            timings = {}
+            compiled = []
+            dropFields = job.get('dropFields')
+            unitResults = analyzeCube(im, [job['analyses'][i] for i in item['taskIndices']], job['cameraCorrection'], job['binning'], timings,
+                                      [dropFields[i] for i in item['taskIndices']] if dropFields is not None else None, region,
+                                      compilations, compiled, [singlePrecision[i] for i in item['taskIndices']] if singlePrecision is not None else None)
+        else:
+            unitResults, timings, compiled = self._runInPool(context, lease.index, im, item['taskIndices'], region, compilations)
+        del im
+        timing.correct, timing.analyze, timing.worker, timing.peakRss = timings['correct'], timings['analyze'], timings['worker'], timings['peakRss']
+        if not queue.renew(lease):
+            logger.warning(f"Lease on {md.filePath} was lost. The results will not be saved.")
+            return
+        sizeBefore = directorySize(md.filePath)
+        sTime = time.time()
+        layout = ResultLayout(*job.get('resultLayout', ()))
+        for taskIndex, (anResults, warnings), roiResults in zip(item['taskIndices'], unitResults, compiled):
+            if region is not None:
+                anResults = padResults(anResults, region.fullShape, region.slices)
+            saveResults(md, job['analysisNames'][taskIndex], anResults, job['markers'][taskIndex], overwrite=True, layout=layout, compiled=roiResults)  # A worker whose lease expired may have saved partial results.
+            removeDiskArrays(anResults)
+        timing.write = time.time() - sTime
+        timing.bytesWritten = directorySize(md.filePath) - sizeBefore
+        queue.complete(lease, {'index': lease.index,
+                               'worker': self.workerId,
+                               'threads': self.numThreads,
+                               'warnings': [warnings for anResults, warnings in unitResults],
+                               'timing': dataclasses.asdict(timing)})
+
+    def _runInPool(self, context: AnalysisContext, index: int, im: pwsdt.ICRawBase, taskIndices: typing.Sequence[int], region: Optional[Region] = None,
+                   compilations: typing.Sequence[Optional[CellCompilation]] = None):
+        """Run the analyses in `self.pool` and wait for them to finish. Returns the results, timings and compiled ROIs."""
+        done = threading.Event()
+        ret = []
+
+        def onError(e: BaseException):
+            ret.append(e)
+            done.set()
+
+        self.pool.submit(context, index, self.pool.shareCube(im), taskIndices, lambda r: (ret.append(r), done.set()), onError, region, compilations)
+        done.wait()
+        if isinstance(ret[0], BaseException):
+            raise ret[0]
+        index, results, timings, compiled = ret[0]
+        return results, timings, compiled
+
+    def _heartbeat(self, finished: threading.Event):
+        """Renew the leases we hold until all of the worker threads have finished."""
+        while not finished.wait(self.leaseTimeout / 4):
+            with self._lock:
+                leases = list(self._leases.values())
+            for lease in leases:
+                FileQueue.renew(lease)
+
+    def _mapPath(self, path: str) -> str:
+        for old, new in self.pathMap.items():
+            if path.startswith(old):
+                return os.path.normpath(new + path[len(old):].replace('\\', '/'))
+        return path
+
+
+class DistributedPipeline:
+    """Runs analyses by submitting them to a shared directory where they are picked up by `DistributedWorker`s.
+    Has the same interface as `AnalysisPipeline`. This computer takes part in the work using the processes
+    configured by `settings`.
+
+    Args:
+        tasks: The analyses to run and the acquisitions to run each of them on.
+        cameraCorrection: The camera correction to apply. If `None` then the automatic correction saved with the data is used.
+        userSpecifiedBinning: The binning to use if it wasn't saved in the metadata.
+        settings: `settings.distributedDirectory` is the shared directory to submit to.
+        pool: A pool of worker processes for this computer's share of the work.
+        pollInterval: The number of seconds between checks of the job's progress.
+    """
+    def __init__(self, tasks: typing.Sequence[AnalysisTask], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                 userSpecifiedBinning: Optional[int] = None, settings: PipelineSettings = None, pool: WorkerPool = None,
+                 pollInterval: float = 1):
+        self.tasks = list(tasks)
+        self.cameraCorrection = cameraCorrection
+        self.userSpecifiedBinning = userSpecifiedBinning
+        self.settings = settings if settings is not None else PipelineSettings()
+        if self.settings.distributedDirectory is None:
+            raise ValueError("A distributed directory must be specified in the pipeline settings.")
+        if self.settings.preview is not None:
+            raise ValueError("Previews are saved to a local scratch directory and can't be run by distributed workers.")
+        self.pool = pool
+        self.pollInterval = pollInterval
+        self._units = groupByAcquisition(self.tasks)
+        self._utilization: List[StageUtilization] = []
+        self._timing = TimingRecorder()
+
+    @property
+    def total(self) -> int:
+        """The number of analysis results that will be saved."""
+        return sum(len(task.cellMetas) for task in self.tasks)
+
+    @property
+    def numAcquisitions(self) -> int:
+        """The number of acquisitions that will be loaded."""
+        return len(self._units)
+
+    def run(self, progressCallback: Callable[[int], None] = None, isCancelled: Callable[[], bool] = None) -> List[List[Tuple[List[AnalysisWarning], Optional[pwsdt.AnalysisManagerMetaDataBase]]]]:
+        """Submit the analyses, wait for them to finish, and return the warnings. See `AnalysisPipeline.run`."""
+        logger = logging.getLogger(__name__)
+        jobId = f"{time.strftime('%Y%m%d-%H%M%S')}_{socket.gethostname()}_{uuid.uuid4().hex[:8]}"
+        queue = FileQueue(os.path.join(self.settings.distributedDirectory, jobId))
+        queue.create({'analyses': [task.analysis for task in self.tasks],
+                      'cameraCorrection': self.cameraCorrection,
+                      'binning': self.userSpecifiedBinning,
+                      'analysisNames': [task.analysisName for task in self.tasks],
+                      'markers': [task.marker for task in self.tasks],
+                      'dropFields': [task.dropFields for task in self.tasks],
+                      'singlePrecision': [task.singlePrecision for task in self.tasks],
+                      'roiNamePatterns': [task.roiNamePattern for task in self.tasks],
+                      'compilations': [task.compilation for task in self.tasks],
+                      'tileSize': self.settings.tileSize,
+                      'tileOverlap': self.settings.tileOverlap,
+                      'resultLayout': tuple(self.settings.getResultLayout())},
+                     [{'index': i,
+                       'filePath': os.path.abspath(md.acquisitionDirectory.filePath),
+                       'type': 'dynamics' if isinstance(md, pwsdt.DynMetaData) else 'pws',
+                       'taskIndices': taskIndices} for i, (md, taskIndices) in enumerate(self._units)])
+        logger.info(f"Submitted distributed job {jobId} with {len(self._units)} acquisitions.")
+        numWorkers = self.settings.getNumWorkers()
+        stopLocal = threading.Event()
+        localWorker = DistributedWorker(self.settings.distributedDirectory, numThreads=max(numWorkers, 1),
+                                        pool=self.pool if numWorkers > 0 else None, leaseTimeout=self.settings.leaseTimeout,
+                                        jobFilter=jobId, pollInterval=self.pollInterval)
+        localThread = threading.Thread(target=localWorker.run, args=(stopLocal,), daemon=True)
+        localThread.start()
+        records = {}
+        self._timing = TimingRecorder(self.settings.timingLog)
+        sTime = time.time()
+        try:
+            cancelled = False
+            lastCompleted = 0
+            while True:
+                if not cancelled and isCancelled is not None and isCancelled():
+                    logger.info(f"Cancelling distributed job {jobId}")
+                    queue.cancel()
+                    cancelled = True
+                queue.reclaimExpired(self.settings.leaseTimeout)
+                self._addRecords(records, queue.doneRecords(exclude=records))
+                completed = sum(len(self._units[r['index']][1]) for r in records.values())
+                if progressCallback is not None and completed != lastCompleted:
+                    progressCallback(completed)
+                    lastCompleted = completed
+                pending, claimed, done, failed = queue.counts()
+                if pending == 0 and claimed == 0:
+                    self._addRecords(records, queue.doneRecords(exclude=records))  # Anything that finished since we last checked.
+                    break
+                time.sleep(self.pollInterval)
+            failures = queue.failures()
+        finally:
+            stopLocal.set()
+            localThread.join()
+            queue.remove()
+        self._utilization = self._summarize(records.values(), time.time() - sTime)
+        results = [[] for task in self.tasks]
+        for record in sorted(records.values(), key=lambda r: r['index']):
+            md, taskIndices = self._units[record['index']]
+            for taskIndex, warnings in zip(taskIndices, record['warnings']):
+                results[taskIndex].append((warnings, md if len(warnings) > 0 else None))
+        if len(failures) > 0:
+            raise RuntimeError(f"{len(failures)} acquisitions could not be analyzed. The first error was:\n{failures[0]['message']}")
+        return results
+
+    def _addRecords(self, records: Dict[str, dict], newRecords: Dict[str, dict]):
+        records.update(newRecords)
+        for record in newRecords.values():
+            self._timing.add(CellTiming(**record['timing']))
+
+    @staticmethod
+    def _summarize(records: typing.Iterable[dict], wallTime: float) -> List[StageUtilization]:
+        """Summarize the work done by each worker. The busy time of each worker includes reading, computing, and writing."""
+        workers: Dict[str, List[dict]] = {}
+        for record in records:
+            workers.setdefault(record['worker'], []).append(record)
+        utilization = []
+        for worker, workerRecords in sorted(workers.items()):
+            threads = workerRecords[0]['threads']
+            busyTime = sum(sum(r['timing'][stage] for stage in STAGES) for r in workerRecords)
+            util = busyTime / (wallTime * threads) if wallTime > 0 else 0
+            utilization.append(StageUtilization(worker, threads, len(workerRecords), busyTime, min(util, 1.0)))
+        return utilization
+
+    def getTimings(self) -> TimingRecorder:
+        """Returns the timing of each stage for each acquisition completed by the most recent call to `run`."""
+        return self._timing
+
+    def getWriteStats(self) -> WriteStats:
+        """Returns the throughput of the writers of all workers for the most recent call to `run`. Each worker saves
+        its own results so there is no backlog."""
+        return WriteStats.fromTimings(self._timing.timings)
+
+    def getUtilization(self) -> List[StageUtilization]:
+        """Returns the amount of work done by each worker in the most recent call to `run`."""
+        return self._utilization
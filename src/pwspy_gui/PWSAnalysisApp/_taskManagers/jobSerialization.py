@@ -0,0 +1,171 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Saves the analyses of distributed jobs as json with the arrays in `.npy` files. Unlike `pickle`, loading a job can't
+run arbitrary code, only objects of the classes in `_allowedClasses` are created.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import enum
+import functools
+import json
+import os
+import typing
+from typing import Dict, Optional
+import numpy as np
+
+
+class SerializationError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _allowedClasses() -> Dict[str, type]:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis.dynamics import DynamicsAnalysis, DynamicsAnalysisSettings
+    from pwspy.analysis.pws import PWSAnalysis, PWSAnalysisSettings
+    from pwspy.analysis.warnings import AnalysisWarning
+    from pwspy.analysis.compilation import DynamicsCompilerSettings, GenericCompilerSettings, PWSCompilerSettings
+    from pwspy.utility.reflection import Material
+    from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+    from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import RoiCompilation
+    from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateCompilerSettings
+    classes = (PWSAnalysis, PWSAnalysisSettings, DynamicsAnalysis, DynamicsAnalysisSettings, AnalysisWarning, Material,
+               pwsdt.PwsCube, pwsdt.DynCube, pwsdt.ExtraReflectionCube, pwsdt.ICRawBase.ProcessingStatus,
+               pwsdt.PwsMetaData, pwsdt.PwsMetaData.FileFormats, pwsdt.DynMetaData, pwsdt.DynMetaData.FileFormats,
+               pwsdt.ERMetaData, pwsdt.CameraCorrection, pwsdt.Acquisition,
+               CompletionMarker, RoiCompilation, ConglomerateCompilerSettings, PWSCompilerSettings,
+               DynamicsCompilerSettings, GenericCompilerSettings)
+    return {_className(cls): cls for cls in classes}
+
+
+def _className(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+class _Encoder:
+    def __init__(self, arrayDirectory: Optional[str]):
+        self._arrayDirectory = arrayDirectory
+        self._arrays: Dict[int, str] = {}  # Arrays shared by several objects (e.g. a reference used by several analyses) are only saved once.
+
+    def encode(self, obj):
+        if obj is None or isinstance(obj, (bool, int, float, str)) and not isinstance(obj, enum.Enum):
+            return obj
+        if isinstance(obj, np.ndarray):
+            return {'array': self._saveArray(obj)}
+        if isinstance(obj, np.generic):
+            return {'scalar': obj.dtype.str, 'value': obj.item()}
+        if isinstance(obj, dict):
+            if not all(isinstance(k, str) for k in obj):
+                raise SerializationError("Only dictionaries with string keys can be saved.")
+            return {'dict': {k: self.encode(v) for k, v in obj.items()}}
+        name = _className(type(obj))
+        if isinstance(obj, (list, tuple)) and name not in _allowedClasses():
+            return {'list' if isinstance(obj, list) else 'tuple': [self.encode(v) for v in obj]}
+        if name not in _allowedClasses():
+            raise SerializationError(f"Objects of type {name} can't be saved.")
+        if isinstance(obj, enum.Enum):
+            return {'enum': name, 'name': obj.name}
+        if isinstance(obj, tuple):  # A NamedTuple
+            return {'namedtuple': name, 'values': [self.encode(v) for v in obj]}
+        from pwspy.dataTypes import Acquisition
+        if isinstance(obj, Acquisition):  # Everything else it holds is loaded from `filePath` when needed.
+            return {'object': name, 'vars': {'filePath': obj.filePath}}
+        return {'object': name, 'vars': {k: self.encode(v) for k, v in vars(obj).items()}}
+
+    def _saveArray(self, arr: np.ndarray) -> str:
+        if self._arrayDirectory is None:
+            raise SerializationError("Arrays can't be saved without an array directory.")
+        if id(arr) not in self._arrays:
+            fileName = f"{len(self._arrays):04d}.npy"
+            np.save(os.path.join(self._arrayDirectory, fileName), arr, allow_pickle=False)
+            self._arrays[id(arr)] = fileName
+        return self._arrays[id(arr)]
+
+
+class _Decoder:
+    def __init__(self, arrayDirectory: Optional[str]):
+        self._arrayDirectory = arrayDirectory
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def decode(self, obj):
+        if not isinstance(obj, dict):
+            return obj
+        if 'array' in obj:
+            return self._loadArray(obj['array'])
+        if 'scalar' in obj:
+            return np.dtype(obj['scalar']).type(obj['value'])
+        if 'dict' in obj:
+            return {k: self.decode(v) for k, v in obj['dict'].items()}
+        if 'list' in obj:
+            return [self.decode(v) for v in obj['list']]
+        if 'tuple' in obj:
+            return tuple(self.decode(v) for v in obj['tuple'])
+        if 'enum' in obj:
+            return self._getClass(obj['enum'])[obj['name']]
+        if 'namedtuple' in obj:
+            return self._getClass(obj['namedtuple'])(*[self.decode(v) for v in obj['values']])
+        if 'object' in obj:
+            cls = self._getClass(obj['object'])
+            inst = cls.__new__(cls)  # The attributes are restored directly, no code of the class is run.
+            inst.__dict__.update({k: self.decode(v) for k, v in obj['vars'].items()})
+            return inst
+        raise SerializationError(f"Unrecognized item: {obj}")
+
+    @staticmethod
+    def _getClass(name: str) -> type:
+        try:
+            return _allowedClasses()[name]
+        except KeyError:
+            raise SerializationError(f"Objects of type {name} can't be loaded.")
+
+    def _loadArray(self, fileName: str) -> np.ndarray:
+        if os.path.basename(fileName) != fileName:
+            raise SerializationError(f"Invalid array file name: {fileName}")
+        if fileName not in self._arrays:
+            if self._arrayDirectory is None:
+                raise SerializationError("Arrays can't be loaded without an array directory.")
+            self._arrays[fileName] = np.load(os.path.join(self._arrayDirectory, fileName), allow_pickle=False)
+        return self._arrays[fileName]
+
+
+def dumps(obj: typing.Any, arrayDirectory: Optional[str] = None) -> str:
+    """Convert `obj` to a json string.
+
+    Args:
+        obj: Built-in types, numpy arrays, and objects of the allowed classes, in any combination.
+        arrayDirectory: The directory to save any numpy arrays to. Must already exist.
+
+    Returns:
+        The json string.
+    """
+    return json.dumps(_Encoder(arrayDirectory).encode(obj))
+
+
+def loads(s: str, arrayDirectory: Optional[str] = None) -> typing.Any:
+    """Load an object that was saved with `dumps`.
+
+    Args:
+        s: The json string.
+        arrayDirectory: The directory that the numpy arrays were saved to.
+
+    Returns:
+        The object.
+    """
+    return _Decoder(arrayDirectory).decode(json.loads(s))
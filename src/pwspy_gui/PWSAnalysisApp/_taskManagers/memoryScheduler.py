@@ -0,0 +1,128 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Decides how many acquisitions can be analyzed at the same time based on the size of the data and the memory available.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import typing
+from typing import Optional
+import psutil
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+def rawDataBytes(md: pwsdt.AnalysisManagerMetaDataBase) -> int:
+    """Returns the total size of the raw data files of an acquisition. Metadata files and the analyses subdirectory are
+    not included."""
+    try:
+        files = [os.path.join(md.filePath, f) for f in os.listdir(md.filePath)]
+    except OSError:
+        return 0
+    return sum(os.path.getsize(f) for f in files if os.path.isfile(f) and os.path.splitext(f)[1].lower() not in ('.json', '.txt'))
+
+
+class MemoryScheduler:
+    """Estimates the memory needed to analyze an acquisition and limits the number of acquisitions being analyzed at
+    once so that the system memory usage stays below `memoryLimit`.
+
+    Args:
+        memoryLimit: The fraction of the total system memory that we try to stay under.
+        intermediateFactor: The peak memory used by an analysis relative to the size of the data cube being analyzed.
+            Accounts for the copies and intermediate arrays that are created during the analysis.
+    """
+    DEFAULT_CUBE_BYTES = 1024**3  # Used if the size of the data can't be estimated. A typical cube is 1024x1024 pixels x 200 wavelengths of float32.
+    RAW_TO_FLOAT = 2  # Raw data is saved as 16 bit integers and converted to 32 bit floats when loaded.
+
+    def __init__(self, memoryLimit: float = 0.85, intermediateFactor: float = 4):
+        self.memoryLimit = memoryLimit
+        self.intermediateFactor = intermediateFactor
+        self._cubeBytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._throttled = False
+
+    @classmethod
+    def estimateCubeBytes(cls, md: pwsdt.AnalysisManagerMetaDataBase) -> Optional[int]:
+        """Estimate the number of bytes that the data cube of an acquisition will use once loaded, based on the size
+        of the raw data files. The file size already accounts for the image shape, binning, and number of wavelengths.
+
+        Returns:
+            The estimated number of bytes or `None` if no raw data files were found.
+        """
+        rawBytes = rawDataBytes(md)
+        return rawBytes * cls.RAW_TO_FLOAT if rawBytes > 0 else None
+
+    def setCubeBytes(self, nbytes: int):
+        """Set the estimated size of a data cube."""
+        with self._lock:
+            self._cubeBytes = nbytes
+
+    def observeCube(self, nbytes: int):
+        """Refine the estimate with the actual size of a loaded data cube. The largest observed size is used."""
+        with self._lock:
+            if self._cubeBytes is None or nbytes > self._cubeBytes:
+                self._cubeBytes = nbytes
+
+    @property
+    def cubeBytes(self) -> int:
+        return self._cubeBytes if self._cubeBytes is not None else self.DEFAULT_CUBE_BYTES
+
+    def perWorkerBytes(self) -> int:
+        """The estimated peak memory used by a single process running an analysis."""
+        return int(self.cubeBytes * self.intermediateFactor)
+
+    def chooseNumWorkers(self, maxWorkers: int, numAcquisitions: int, queueSize: int = 0) -> int:
+        """Choose how many acquisitions to analyze at once based on the memory currently available.
+
+        Args:
+            maxWorkers: The maximum number of processes that can be used.
+            numAcquisitions: The number of acquisitions to be analyzed. There is no point in using more processes than this.
+            queueSize: The number of loaded data cubes that may be waiting between each pair of pipeline stages.
+
+        Returns:
+            The number of processes to use, at least 1.
+        """
+        vm = psutil.virtual_memory()
+        budget = vm.available - (1 - self.memoryLimit) * vm.total - 2 * queueSize * self.cubeBytes
+        numWorkers = int(budget // self.perWorkerBytes())
+        numWorkers = max(1, min(numWorkers, maxWorkers, numAcquisitions))
+        logging.getLogger(__name__).info(f"Estimated {self.perWorkerBytes() / 1024**3:.1f} GB per process with {vm.available / 1024**3:.1f} GB available. Using {numWorkers} processes.")
+        return numWorkers
+
+    def canDispatch(self, inFlight: int) -> bool:
+        """Determine if another acquisition can be started without exceeding the memory limit.
+
+        Args:
+            inFlight: The number of acquisitions currently being analyzed. If this is 0 then we always allow an
+                acquisition to start so that progress can be made.
+        """
+        vm = psutil.virtual_memory()
+        projected = vm.total - vm.available + self.perWorkerBytes()
+        ok = inFlight == 0 or projected <= self.memoryLimit * vm.total
+        if ok == self._throttled:  # Log when the state changes.
+            self._throttled = not ok
+            logger = logging.getLogger(__name__)
+            if ok:
+                logger.info("Memory usage has dropped. Resuming analysis.")
+            else:
+                logger.warning(f"Memory usage is {1 - vm.available / vm.total:.0%}. Pausing new analyses until memory is freed.")
+        return ok
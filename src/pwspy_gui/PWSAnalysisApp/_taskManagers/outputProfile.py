@@ -0,0 +1,85 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Output profiles determine which datasets of the analysis results are saved.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import typing
+from typing import Optional, Sequence, Tuple
+from pwspy_gui.PWSAnalysisApp._taskManagers.memoryScheduler import rawDataBytes
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysisResults
+
+OUTPUT_PROFILES = ('maps', 'full')
+PROFILE_NAMES = {'maps': "Maps Only", 'full': "Full Cube"}
+# `mapsOpd` saved the maps and whatever the OPD is calculated from. `pwspy` calculates the OPD of PWS from the
+# reflectance cube when it is loaded, so this saved the same as `full` for PWS and the same as `maps` for dynamics. It
+# is still accepted so that existing batch files keep working.
+DEPRECATED_PROFILES = ('mapsOpd',)
+
+_CUBE_FIELDS = {'PWSAnalysis': ('reflectance',), 'DynamicsAnalysis': ('reflectance',)}  # Keyed by the class name of the analysis.
+_OPD_SOURCES = {'PWSAnalysis'}  # Analyses whose reflectance cube is needed to calculate the OPD.
+_MAP_FIELDS = {'PWSAnalysis': ('meanReflectance', 'rms', 'polynomialRms', 'autoCorrelationSlope', 'rSquared', 'ld'),
+               'DynamicsAnalysis': ('meanReflectance', 'rms_t_squared', 'diffusion')}
+
+
+def droppedFields(profile: str, analysisType: str) -> Tuple[str, ...]:
+    """The names of the results fields that shouldn't be saved.
+
+    Args:
+        profile: One of `OUTPUT_PROFILES` or `DEPRECATED_PROFILES`.
+        analysisType: The class name of the analysis, e.g. `PWSAnalysis`.
+    """
+    if profile not in OUTPUT_PROFILES + DEPRECATED_PROFILES:
+        raise ValueError(f"Unknown output profile: {profile}. Must be one of {OUTPUT_PROFILES}.")
+    if profile == 'full' or (profile == 'mapsOpd' and analysisType in _OPD_SOURCES):
+        return ()
+    return _CUBE_FIELDS.get(analysisType, ())
+
+
+def dropFields(results: AbstractAnalysisResults, fields: Sequence[str]):
+    """Remove fields from analysis results that haven't been saved yet so that they won't be saved."""
+    if len(fields) == 0:
+        return
+    d = getattr(results, 'dict', None)
+    if not isinstance(d, dict):
+        raise TypeError(f"Output profiles are not supported for results of type {type(results)}")
+    for field in fields:
+        if field in d:
+            d[field] = None  # Fields that are `None` aren't saved.
+
+
+def estimateResultBytes(md: pwsdt.AnalysisManagerMetaDataBase, analysisType: str, profile: str) -> Optional[int]:
+    """Estimate the disk space used by the results of an analysis of `md`. Returns `None` if the number of frames of
+    the acquisition is unknown.
+
+    The reflectance cube is saved in 16-bit fixed point, about the same size as the raw data. The maps are 32-bit
+    floating point images.
+    """
+    frames = getattr(md, 'wavelengths', None)
+    if frames is None:
+        frames = getattr(md, 'times', None)
+    if frames is None or len(frames) == 0:
+        return None
+    cubeBytes = rawDataBytes(md)
+    mapBytes = cubeBytes / len(frames) * 2 * len(_MAP_FIELDS.get(analysisType, ()))
+    numCubes = len(_CUBE_FIELDS.get(analysisType, ())) - len(droppedFields(profile, analysisType))
+    return int(mapBytes + numCubes * cubeBytes)
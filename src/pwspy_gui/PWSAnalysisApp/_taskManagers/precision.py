@@ -0,0 +1,74 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Single precision analysis. On synthetic data the results match a run with 64-bit inputs to within 1e-6 relative for
+RMS and mean reflectance, and 1e-4 for the autocorrelation slope and ld (see `tests/test_precision.py`).
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import copy
+import typing
+import numpy as np
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysis, AbstractAnalysisResults
+
+DTYPE = np.float32
+
+
+def _isWide(value) -> bool:
+    """`True` if `value` is a floating point array with more precision than `DTYPE`."""
+    return isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.floating) and value.dtype.itemsize > np.dtype(DTYPE).itemsize
+
+
+def _narrow(value):
+    """Returns `value` converted to `DTYPE` if it is a floating point array, or an object with such an array as its
+    `data`. Anything else is returned unchanged."""
+    if _isWide(value):
+        return value.astype(DTYPE)
+    elif not isinstance(value, np.ndarray) and _isWide(getattr(value, 'data', None)):
+        value = copy.copy(value)
+        value.data = value.data.astype(DTYPE)
+        return value
+    return value
+
+
+def narrowCube(im: pwsdt.ICRawBase):
+    """Convert the data of a data cube to single precision, in place. `pwspy` loads raw data as 32-bit floats, but
+    correcting the camera effects with a linearity polynomial makes it 64-bit."""
+    if _isWide(im.data):
+        im.data = im.data.astype(DTYPE)
+
+
+def narrowAnalysis(analysis: AbstractAnalysis) -> AbstractAnalysis:
+    """Create a copy of an analysis where every floating point array attribute, and the data of every data cube
+    attribute (e.g. the reference and extra reflectance), is converted to single precision."""
+    narrowed = copy.copy(analysis)
+    for k, v in vars(analysis).items():
+        setattr(narrowed, k, _narrow(v))
+    return narrowed
+
+
+def narrowResults(results: AbstractAnalysisResults):
+    """Convert the fields of analysis results that haven't been saved yet to single precision, in place."""
+    d = getattr(results, 'dict', None)
+    if not isinstance(d, dict):
+        raise TypeError(f"Single precision is not supported for results of type {type(results)}")
+    for k, v in d.items():
+        d[k] = _narrow(v)
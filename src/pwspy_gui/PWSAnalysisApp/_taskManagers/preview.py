@@ -0,0 +1,139 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Low resolution preview analyses for quickly trying out analysis settings.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import copy
+import dataclasses
+import hashlib
+import logging
+import os
+import tempfile
+import typing
+from typing import Optional, Tuple
+import numpy as np
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysis, AbstractAnalysisResults
+
+
+class PreviewSettings(typing.NamedTuple):
+    """Determines how much the data is reduced for a preview.
+
+    Attributes:
+        spatialBinning: The width and height in pixels of the blocks that are averaged together.
+        spectralStride: Only every `spectralStride`th wavelength is kept. Dynamics data is not subsampled in time since
+            that would change the autocorrelation.
+        directory: The scratch directory to save the results in. If `None` a directory in the system temporary
+            directory is used.
+    """
+    spatialBinning: int = 4
+    spectralStride: int = 1
+    directory: Optional[str] = None
+
+    def getDirectory(self) -> str:
+        return self.directory if self.directory is not None else os.path.join(tempfile.gettempdir(), 'pwspyPreview')
+
+
+def _binArray(data: np.ndarray, binning: int, stride: int) -> np.ndarray:
+    """Average `data` in blocks of `binning` x `binning` pixels and keep every `stride`th element of the third axis.
+    Pixels at the edge that don't fill a whole block are dropped."""
+    height, width = data.shape[0] // binning, data.shape[1] // binning
+    data = data[:height * binning, :width * binning]
+    if data.ndim > 2 and stride > 1:
+        data = data[:, :, ::stride]
+    binned = data.reshape((height, binning, width, binning) + data.shape[2:]).mean(axis=(1, 3), dtype=np.float32)
+    return binned.astype(data.dtype, copy=False) if np.issubdtype(data.dtype, np.floating) else binned
+
+
+def _reduce(obj, binning: int, stride: int):
+    """Reduce the `data` of a data cube in place. The wavelengths of a PWS cube are subsampled to match."""
+    stride = stride if hasattr(obj, 'wavelengths') else 1
+    obj.data = _binArray(obj.data, binning, stride)
+    if stride > 1 and getattr(obj, '_index', None) is not None:  # `pwspy` data cubes keep the coordinates of the third axis in `_index`.
+        obj._index = tuple(obj._index[::stride])
+
+
+def reduceCube(im: pwsdt.ICRawBase, preview: PreviewSettings) -> pwsdt.ICRawBase:
+    """Reduce the resolution of raw data that has just been loaded."""
+    _reduce(im, preview.spatialBinning, preview.spectralStride)
+    return im
+
+
+def _fitFilters(settings, wavelengths: Tuple[float, ...]):
+    """Returns a copy of PWS analysis settings with any low pass filter that is at or above the Nyquist frequency of
+    the subsampled spectra disabled. `scipy` refuses to design such filters. `settings` is returned unchanged if both
+    filters still fit."""
+    if len(wavelengths) < 2 or not dataclasses.is_dataclass(settings):
+        return settings
+    changes = {}
+    cutoff = getattr(settings, 'filterCutoff', None)
+    interval = (max(wavelengths) - min(wavelengths)) / (len(wavelengths) - 1)
+    if cutoff is not None and cutoff >= 0.5 / interval:
+        changes['filterCutoff'] = None
+    cutoff = getattr(settings, 'waveNumberCutoff', None)
+    start, stop = getattr(settings, 'wavelengthStart', None), getattr(settings, 'wavelengthStop', None)
+    selected = [wv for wv in wavelengths if (start is None or wv >= start) and (stop is None or wv <= stop)]
+    if cutoff is not None and len(selected) > 1:
+        wavenumbers = 2 * np.pi / (np.array(selected, dtype=np.float64) * 1e-3)  # The analysis resamples the spectra to evenly spaced wavenumbers in radians/um.
+        interval = (wavenumbers.max() - wavenumbers.min()) / (len(wavenumbers) - 1)
+        if cutoff >= np.pi / interval:
+            changes['waveNumberCutoff'] = None
+    if len(changes) == 0:
+        return settings
+    logging.getLogger(__name__).warning(f"The wavelength stride of the preview is too large for the filter settings. Disabled {', '.join(changes)} for the preview.")
+    return dataclasses.replace(settings, **changes)
+
+
+def reduceAnalysis(analysis: AbstractAnalysis, shape: Tuple[int, ...], preview: PreviewSettings) -> AbstractAnalysis:
+    """Create a copy of an analysis where every image-sized array attribute (e.g. the reference and extra reflectance)
+    is reduced in the same way as the raw data will be. Low pass filters that the subsampled spectra can no longer
+    support are disabled in the copy's settings.
+
+    Args:
+        analysis: The analysis.
+        shape: The shape of the full resolution images.
+        preview: How much to reduce the data.
+    """
+    reduced = copy.copy(analysis)
+    for k, v in vars(analysis).items():
+        if isinstance(v, np.ndarray) and v.ndim >= 2 and v.shape[:2] == tuple(shape[:2]):
+            setattr(reduced, k, _binArray(v, preview.spatialBinning, 1))
+        elif not isinstance(v, np.ndarray) and isinstance(getattr(v, 'data', None), np.ndarray) and v.data.shape[:2] == tuple(shape[:2]):
+            v = copy.copy(v)
+            _reduce(v, preview.spatialBinning, preview.spectralStride)
+            setattr(reduced, k, v)
+            if preview.spectralStride > 1 and getattr(v, 'wavelengths', None) is not None and hasattr(reduced, 'settings'):
+                reduced.settings = _fitFilters(reduced.settings, tuple(v.wavelengths))
+    return reduced
+
+
+def previewDirectory(md: pwsdt.AnalysisManagerMetaDataBase, preview: PreviewSettings) -> str:
+    """The scratch directory that the preview results for `md` are saved in."""
+    key = hashlib.sha1(os.path.abspath(md.filePath).encode()).hexdigest()[:16]
+    return os.path.join(preview.getDirectory(), key)
+
+
+def savePreview(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str, results: AbstractAnalysisResults, preview: PreviewSettings):
+    """Save preview results to the scratch directory, replacing any previous preview with the same name."""
+    directory = previewDirectory(md, preview)
+    os.makedirs(directory, exist_ok=True)
+    results.toHDF(directory, analysisName, overwrite=True)
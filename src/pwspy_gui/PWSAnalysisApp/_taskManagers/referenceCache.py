@@ -0,0 +1,125 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A cache of reference data cubes that have already been loaded and camera corrected.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import copy
+import logging
+import os
+import pickle
+import typing
+import uuid
+from glob import glob
+from typing import Callable, Optional, Tuple
+from cachetools import LRUCache
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+CacheKey = Tuple[str, Optional['pwsdt.CameraCorrection'], Optional[int]]
+
+
+class _EvictingLRUCache(LRUCache):
+    """An `LRUCache` that calls `onEvicted` with the key and value of each item that is removed to make room."""
+    def __init__(self, maxsize: float, getsizeof: Callable, onEvicted: Callable):
+        super().__init__(maxsize, getsizeof=getsizeof)
+        self._onEvicted = onEvicted
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._onEvicted(key, value)
+        return key, value
+
+
+class ReferenceCache:
+    """Stores camera corrected reference cubes so that they don't need to be loaded from file and corrected again
+    for each analysis that uses them. The least recently used references are dropped once the memory budget is
+    exceeded. If a spill directory is given then dropped references are pickled to that directory instead and loaded
+    from there the next time they are needed.
+
+    Args:
+        maxMemory: The maximum number of bytes of data to keep in memory.
+        spillDirectory: The directory to save references to when they don't fit in memory. If `None` then references
+            are simply discarded. Any files left in the directory from a previous session are deleted.
+        maxDisk: The maximum number of bytes to save to `spillDirectory`.
+    """
+    def __init__(self, maxMemory: int, spillDirectory: Optional[str] = None, maxDisk: int = 20 * 1024**3):
+        self.maxMemory = maxMemory
+        self.spillDirectory = spillDirectory
+        self.maxDisk = maxDisk
+        self._memory = _EvictingLRUCache(maxMemory, getsizeof=lambda ref: ref.data.nbytes, onEvicted=self._spill)
+        self._disk = _EvictingLRUCache(maxDisk, getsizeof=os.path.getsize, onEvicted=lambda key, path: os.remove(path))
+        if spillDirectory is not None:
+            os.makedirs(spillDirectory, exist_ok=True)
+            for f in glob(os.path.join(spillDirectory, '*.pkl')):
+                os.remove(f)
+
+    @staticmethod
+    def makeKey(refMeta: pwsdt.AnalysisManagerMetaDataBase, cameraCorrection: Optional[pwsdt.CameraCorrection], binning: Optional[int]) -> CacheKey:
+        """Generate the key that identifies a reference with a specific camera correction applied.
+
+        Args:
+            refMeta: The metadata of the reference acquisition.
+            cameraCorrection: The camera correction that was applied. `None` indicates that the automatic correction saved with the data was used.
+            binning: The binning specified by the user, if any.
+        """
+        return refMeta.idTag, cameraCorrection, binning
+
+    def get(self, key: CacheKey) -> Optional[pwsdt.ICRawBase]:
+        """Return a copy of the reference stored under `key` or `None` if it isn't in the cache. A copy is returned so
+        that the cached data is not affected by any in-place processing done by the analysis."""
+        ref = self._memory.get(key)
+        if ref is None and key in self._disk:
+            path = self._disk.pop(key)
+            logging.getLogger(__name__).info(f"Loading cached reference {key[0]} from {path}")
+            with open(path, 'rb') as f:
+                ref = pickle.load(f)
+            os.remove(path)
+            self._store(key, ref)
+        return copy.deepcopy(ref) if ref is not None else None
+
+    def put(self, key: CacheKey, ref: pwsdt.ICRawBase):
+        """Store a copy of `ref`, which should already have been camera corrected, under `key`."""
+        self._store(key, copy.deepcopy(ref))
+
+    def clear(self):
+        self._memory.clear()
+        for path in self._disk.values():
+            os.remove(path)
+        self._disk.clear()
+
+    def _store(self, key: CacheKey, ref: pwsdt.ICRawBase):
+        if ref.data.nbytes > self.maxMemory:  # Too big to ever fit in memory.
+            self._spill(key, ref)
+        else:
+            self._memory[key] = ref
+
+    def _spill(self, key: CacheKey, ref: pwsdt.ICRawBase):
+        if self.spillDirectory is None:
+            return
+        path = os.path.join(self.spillDirectory, f"{uuid.uuid4().hex}.pkl")
+        try:
+            with open(path, 'wb') as f:
+                pickle.dump(ref, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._disk[key] = path
+        except (OSError, ValueError) as e:  # ValueError is raised by the cache if the file is larger than the disk budget.
+            logging.getLogger(__name__).warning(f"Failed to spill reference {key[0]} to disk: {e}")
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,159 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Controls the chunking and compression of the HDF5 files of analysis results.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+import typing
+import uuid
+from typing import Optional, Tuple
+import h5py
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import CellTiming
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysisResults
+
+COMPRESSIONS = (None, 'lzf', 'gzip')
+CHUNKINGS = ('auto', 'plane', 'none')
+
+
+class ResultLayout(typing.NamedTuple):
+    """The layout of the datasets in saved analysis results.
+
+    Attributes:
+        compression: `None`, `lzf` (fast, moderate compression), or `gzip` (slower, better compression).
+        compressionLevel: The level of `gzip` compression, from 0 to 9.
+        chunking: `auto` lets HDF5 choose the chunk shape. `plane` stores each image of a 3D dataset as a chunk, which
+            is fastest for reading a single wavelength. `none` stores datasets contiguously, this is only possible
+            without compression.
+    """
+    compression: Optional[str] = None
+    compressionLevel: int = 4
+    chunking: str = 'auto'
+
+    def isDefault(self) -> bool:
+        """`True` if the results can be saved directly by `pwspy` without changing their layout."""
+        return self.compression is None and self.chunking != 'plane'
+
+    def datasetOptions(self, shape: Tuple[int, ...]) -> dict:
+        """The keyword arguments for `h5py.Group.create_dataset` for a dataset of `shape`."""
+        opts = {}
+        if self.chunking == 'plane':
+            opts['chunks'] = tuple(shape[:2]) + (1,) * (len(shape) - 2)
+        elif self.chunking == 'auto' or self.compression is not None:
+            opts['chunks'] = True
+        if self.compression is not None:
+            opts['compression'] = self.compression
+            opts['shuffle'] = True  # Grouping the bytes of each value together makes floating point data much more compressible.
+            if self.compression == 'gzip':
+                opts['compression_opts'] = self.compressionLevel
+        return opts
+
+
+class WriteStats(typing.NamedTuple):
+    """A summary of the results saved by a pipeline.
+
+    Attributes:
+        results: The number of analysis results saved.
+        bytesWritten: The total size of the saved results.
+        seconds: The total time spent saving by all of the writer threads.
+        megabytesPerSecond: The throughput of a single writer thread.
+        peakBacklog: The largest number of acquisitions whose results were waiting for a writer. If this is large then
+            the writers are limiting the speed of the analysis.
+    """
+    results: int
+    bytesWritten: int
+    seconds: float
+    megabytesPerSecond: float
+    peakBacklog: int
+
+    @staticmethod
+    def fromTimings(timings: typing.Iterable[CellTiming], peakBacklog: int = 0) -> WriteStats:
+        timings = list(timings)
+        nbytes = sum(t.bytesWritten for t in timings)
+        seconds = sum(t.write for t in timings)
+        return WriteStats(sum(len(t.analysisNames) for t in timings), nbytes, seconds,
+                          nbytes / seconds / 1024**2 if seconds > 0 else 0, peakBacklog)
+
+
+def _copyWithLayout(src: h5py.Group, dst: h5py.Group, layout: ResultLayout):
+    for k, v in src.attrs.items():
+        dst.attrs[k] = v
+    for name, item in src.items():
+        if isinstance(item, h5py.Group):
+            _copyWithLayout(item, dst.create_group(name), layout)
+        elif item.shape is None or item.ndim == 0 or item.dtype.kind in 'OSU' or item.size == 0:  # Scalars and strings can't be chunked.
+            src.copy(item, dst, name=name)
+        else:
+            ds = dst.create_dataset(name, data=item[()], **layout.datasetOptions(item.shape))
+            for k, v in item.attrs.items():
+                ds.attrs[k] = v
+
+
+class _LayoutResults:
+    """Stands in for analysis results when they are passed to `saveAnalysis`. `pwspy` writes the file to a local
+    temporary directory which is then copied to the directory that `pwspy` asked for, using `layout`."""
+    def __init__(self, results: AbstractAnalysisResults, layout: ResultLayout):
+        self._results = results
+        self._layout = layout
+
+    def __getattr__(self, item):
+        return getattr(self._results, item)
+
+    def toHDF(self, directory: str, name: str, overwrite: bool = False):
+        staging = tempfile.mkdtemp(prefix='pwspyResults_')
+        try:
+            self._results.toHDF(staging, name)
+            os.makedirs(directory, exist_ok=True)
+            for fileName in os.listdir(staging):
+                dest = os.path.join(directory, fileName)
+                if os.path.exists(dest) and not overwrite:
+                    raise OSError(f"{dest} already exists.")
+                # `pwspy` treats every file in `directory` as an analysis, so the partial file is written next to it
+                # instead. It's on the same filesystem so the final rename is still atomic.
+                partial = os.path.join(os.path.dirname(os.path.abspath(directory)), f".{fileName}.{uuid.uuid4().hex}.partial")
+                try:
+                    with h5py.File(os.path.join(staging, fileName), 'r') as src, h5py.File(partial, 'w') as dst:
+                        _copyWithLayout(src, dst, self._layout)
+                    os.replace(partial, dest)  # Nothing is left behind with the final name if we fail part way.
+                finally:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def saveWithLayout(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str, results: AbstractAnalysisResults,
+                   layout: Optional[ResultLayout] = None):
+    """Save analysis results to the acquisition of `md`.
+
+    Args:
+        md: The acquisition that was analyzed.
+        analysisName: The name to save the results as.
+        results: The analysis results.
+        layout: The chunking and compression of the saved datasets. If `None` the results are saved by `pwspy` as usual.
+    """
+    if layout is None or layout.isDefault():
+        md.saveAnalysis(results, analysisName)
+    else:
+        md.saveAnalysis(_LayoutResults(results, layout), analysisName)
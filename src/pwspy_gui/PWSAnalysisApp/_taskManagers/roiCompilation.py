@@ -0,0 +1,252 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compiles ROIs in the compute stage while the analysis results are still in memory and saves them next to the results.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import copy
+import logging
+import os
+import pickle
+import re
+import typing
+import uuid
+from glob import escape, glob
+from typing import Dict, List, Optional, Sequence, Tuple
+from pwspy.analysis.dynamics import DynamicsAnalysisResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.compilationCache import settingsKey
+from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateAnalysisResults, ConglomerateCompiler
+from pwspy_gui.PWSAnalysisApp.utilities.roiMasks import cropRoi
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysisResults
+    from pwspy.analysis.warnings import AnalysisWarning
+    from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import ConglomerateCompilerResults, ConglomerateCompilerSettings
+    from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region
+
+_FILE_PREFIX = 'compiledRois_'
+_FORMAT_VERSION = 2
+
+
+class RoiCompilation(typing.NamedTuple):
+    """Requests that ROIs be compiled as soon as an analysis has been run.
+
+    Attributes:
+        roiNamePattern: The ROIs with names matching this regex are compiled.
+        settings: Determines which values are compiled.
+    """
+    roiNamePattern: str
+    settings: ConglomerateCompilerSettings
+
+
+class CellCompilation(typing.NamedTuple):
+    """The ROIs of a single acquisition to compile for a single analysis. This is sent to the compute stage along with
+    the data.
+
+    Attributes:
+        analysisName: The name that the analysis results will be saved as.
+        settings: Determines which values are compiled.
+        roiFiles: The ROIs to compile.
+    """
+    analysisName: str
+    settings: ConglomerateCompilerSettings
+    roiFiles: List[pwsdt.RoiFile]
+
+
+RoiStamp = Tuple[int, int]  # The modification time and size of an ROI file.
+
+
+class CompiledRois(typing.NamedTuple):
+    """The ROIs compiled from a single analysis, along with what they were compiled from so that they can be recognized
+    as out of date once they are loaded again.
+
+    Attributes:
+        settingsKey: The `compilationCache.settingsKey` of the settings that the ROIs were compiled with.
+        roiStamps: The `RoiStamp` of the file of each ROI that was compiled, keyed by ROI name and number. `None` if
+            the file couldn't be found.
+        results: The compiled results and warnings of each ROI.
+    """
+    settingsKey: str
+    roiStamps: Dict[Tuple[str, int], Optional[RoiStamp]]
+    results: List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]]
+
+
+def _roiStamp(roiFile: pwsdt.RoiFile) -> Optional[RoiStamp]:
+    try:
+        stat = os.stat(roiFile.filePath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def prepareCompilations(md: pwsdt.AnalysisManagerMetaDataBase, analysisNames: Sequence[str],
+                        compilations: Sequence[Optional[RoiCompilation]]) -> Optional[List[Optional[CellCompilation]]]:
+    """Find the ROIs of the acquisition of `md` to compile for each analysis.
+
+    Args:
+        md: The acquisition.
+        analysisNames: The name of each analysis.
+        compilations: The requested compilation of each analysis. `None` if the analysis shouldn't be compiled.
+
+    Returns:
+        A `CellCompilation` for each analysis, `None` for those that shouldn't be compiled. `None` if none of them
+        should be compiled.
+    """
+    if all(c is None for c in compilations):
+        return None
+    acq = md.acquisitionDirectory
+    rois = acq.getRois()
+    ret = []
+    for analysisName, compilation in zip(analysisNames, compilations):
+        if compilation is None:
+            ret.append(None)
+        else:
+            roiFiles = [acq.loadRoi(name, num, fformat) for name, num, fformat in rois if re.match(compilation.roiNamePattern, name)]
+            ret.append(CellCompilation(analysisName, compilation.settings, roiFiles))
+    return ret
+
+
+def compileResults(results: AbstractAnalysisResults, compilation: CellCompilation,
+                   region: Optional[Region] = None) -> CompiledRois:
+    """Compile the ROIs of `compilation` from analysis results that haven't been saved yet.
+
+    Args:
+        results: The results of a PWS or Dynamics analysis.
+        compilation: The ROIs to compile.
+        region: The region of the image that `results` were computed for, if any. The ROIs are cropped to match so any
+            part of an ROI outside of the region is ignored. See `roiRegion`.
+
+    Returns:
+        The compiled results and warnings of each ROI, along with the settings and ROI files they were compiled from.
+    """
+    results = copy.copy(results)
+    results.analysisName = compilation.analysisName  # Results are only given a name once they are saved.
+    if isinstance(results, DynamicsAnalysisResults):
+        conglomerate = ConglomerateAnalysisResults(None, results)
+    else:
+        conglomerate = ConglomerateAnalysisResults(results, None)
+    stamps = {(roiFile.name, roiFile.number): _roiStamp(roiFile) for roiFile in compilation.roiFiles}  # Taken before the ROIs are read so that any later change is noticed.
+    rois = [roiFile.getRoi() for roiFile in compilation.roiFiles]
+    if region is not None:
+        rois = [cropRoi(roi, region.slices) for roi in rois]
+    return CompiledRois(settingsKey(compilation.settings), stamps,
+                        ConglomerateCompiler(compilation.settings).runBatch(conglomerate, compilation.roiFiles, rois))
+
+
+def getPath(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str) -> str:
+    return os.path.join(md.filePath, f"{_FILE_PREFIX}{analysisName}.pkl")
+
+
+def saveCompiled(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str, compiled: CompiledRois):
+    """Save the compiled ROIs of the analysis named `analysisName` of acquisition `md`. This should only be called
+    once the analysis results have been saved."""
+    path = getPath(md, analysisName)
+    partial = f"{path}.{uuid.uuid4().hex}.partial"
+    try:
+        with open(partial, 'wb') as f:
+            pickle.dump({'version': _FORMAT_VERSION, 'compiled': tuple(compiled)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, path)  # Nothing is left behind with the final name if we fail part way.
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def removeCompiled(md: pwsdt.AnalysisManagerMetaDataBase, analysisName: str):
+    """Delete the compiled ROIs, if they exist. Called whenever the analysis results are replaced or deleted so that
+    the compiled values never disagree with the results."""
+    path = getPath(md, analysisName)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _loadFile(path: str) -> Optional[CompiledRois]:
+    """Returns `None` if the file can't be loaded, e.g. because it is corrupted or was saved by another version."""
+    try:
+        with open(path, 'rb') as f:
+            contents = pickle.load(f)
+        if not isinstance(contents, dict) or contents.get('version') != _FORMAT_VERSION:
+            return None
+        return CompiledRois(*contents['compiled'])
+    except Exception as e:  # Unpickling can raise almost anything.
+        logging.getLogger(__name__).warning(f"Failed to load compiled ROIs from {path}: {e}")
+        return None
+
+
+def _loadMeta(md: Optional[pwsdt.AnalysisManagerMetaDataBase], analysisNamePattern: str, key: str,
+              currentStamps: Dict[Tuple[str, int], Optional[RoiStamp]]) -> Tuple[Dict[str, List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]]], int]:
+    """Returns the saved compiled results of `md` that are still up to date keyed by analysis name, and the number of
+    ROIs that are out of date. Only the ROIs of `currentStamps` are included."""
+    if md is None:
+        return {}, 0
+    ret = {}
+    stale = 0
+    for path in sorted(glob(os.path.join(escape(md.filePath), f"{_FILE_PREFIX}*.pkl"))):
+        analysisName = os.path.basename(path)[len(_FILE_PREFIX):-len('.pkl')]
+        if not re.match(analysisNamePattern, analysisName):
+            continue
+        compiled = _loadFile(path)
+        if compiled is None or compiled.settingsKey != key:
+            stale += len(currentStamps)
+            continue
+        ret[analysisName] = []
+        for r, w in compiled.results:
+            roiKey = (r.generic.roiFile.name, r.generic.roiFile.number)
+            if roiKey not in currentStamps:
+                continue
+            if currentStamps[roiKey] is None or compiled.roiStamps.get(roiKey) != currentStamps[roiKey]:  # The ROI has been changed or deleted.
+                stale += 1
+            else:
+                ret[analysisName].append((r, w))
+        stale += len([roiKey for roiKey in currentStamps if roiKey not in compiled.roiStamps])  # ROIs that were added after the analysis.
+    return ret, stale
+
+
+def loadCompiled(acq: pwsdt.Acquisition, analysisNamePattern: str, roiNamePattern: str,
+                 settings: ConglomerateCompilerSettings) -> Tuple[List[Tuple[ConglomerateCompilerResults, List[AnalysisWarning]]], int]:
+    """Load the ROIs of an acquisition that were compiled during analysis. PWS and Dynamics results with the same
+    analysis name and ROI are combined, the same way that `CompilationManager` pairs them. Compiled ROIs are only
+    loaded if they were compiled with `settings` and their ROI files haven't changed since.
+
+    Args:
+        acq: The acquisition.
+        analysisNamePattern: Only analyses with names matching this regex are loaded.
+        roiNamePattern: Only ROIs with names matching this regex are loaded.
+        settings: The settings that the ROIs should have been compiled with.
+
+    Returns:
+        The compiled results and warnings of each ROI of each analysis that are up to date, and the number of ROIs
+        whose saved compilation is out of date or missing. These need to be compiled again.
+    """
+    currentStamps = {(name, num): _roiStamp(acq.loadRoi(name, num, fformat)) for name, num, fformat in acq.getRois() if re.match(roiNamePattern, name)}
+    key = settingsKey(settings)
+    pws, pwsStale = _loadMeta(acq.pws, analysisNamePattern, key, currentStamps)
+    dyn, dynStale = _loadMeta(acq.dynamics, analysisNamePattern, key, currentStamps)
+    ret = []
+    for analysisName, pwsCompiled in pws.items():
+        dynCompiled = {(r.generic.roiFile.name, r.generic.roiFile.number): (r, w) for r, w in dyn.pop(analysisName, [])}
+        for r, w in pwsCompiled:
+            match = dynCompiled.pop((r.generic.roiFile.name, r.generic.roiFile.number), None)
+            if match is not None:
+                r, w = r._replace(dyn=match[0].dyn), w + match[1]
+            ret.append((r, w))
+        ret += list(dynCompiled.values())  # ROIs that were only compiled for the Dynamics analysis.
+    for dynCompiled in dyn.values():
+        ret += dynCompiled
+    return ret, pwsStale + dynStale
@@ -0,0 +1,81 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+ROI-restricted analysis. Only the bounding box of the ROIs matching a pattern is analyzed.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import re
+import typing
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from pwspy_gui.PWSAnalysisApp.utilities.roiMasks import boundingBox
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+class Region(typing.NamedTuple):
+    """A rectangular region of an image.
+
+    Attributes:
+        slices: The rows and columns of the region.
+        fullShape: The height and width of the full image.
+    """
+    slices: Tuple[slice, slice]
+    fullShape: Tuple[int, int]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.slices[0].stop - self.slices[0].start, self.slices[1].stop - self.slices[1].start
+
+    def fraction(self) -> float:
+        """The fraction of the pixels of the full image that are in the region."""
+        return self.shape[0] * self.shape[1] / (self.fullShape[0] * self.fullShape[1])
+
+
+def hasMatchingRois(md: pwsdt.AnalysisManagerMetaDataBase, roiNamePattern: str) -> bool:
+    """`True` if the acquisition of `md` has an ROI with a name matching `roiNamePattern`."""
+    return any(re.match(roiNamePattern, name) for name, num, fformat in md.acquisitionDirectory.getRois())
+
+
+def findRegion(md: pwsdt.AnalysisManagerMetaDataBase, roiNamePatterns: Sequence[Optional[str]]) -> Optional[Region]:
+    """Find the bounding box of all of the ROIs of the acquisition of `md` with names matching any of `roiNamePatterns`.
+
+    Returns:
+        The region to analyze. `None` if the whole image should be analyzed, either because one of the patterns is
+        `None` or because no ROIs matched.
+    """
+    if len(roiNamePatterns) == 0 or any(p is None for p in roiNamePatterns):
+        return None
+    acq = md.acquisitionDirectory
+    union = None
+    for name, num, fformat in acq.getRois():
+        if any(re.match(p, name) for p in roiNamePatterns):
+            mask = acq.loadRoi(name, num, fformat).getRoi().mask
+            union = mask if union is None else (union | mask)
+    if union is None:
+        return None
+    slices = boundingBox(union)
+    return Region(slices, union.shape[:2]) if slices is not None else None
+
+
+def cropCube(im: pwsdt.ICRawBase, region: Region) -> pwsdt.ICRawBase:
+    """Crop the data of a data cube to `region`. The data is copied so that the memory of the full cube can be freed."""
+    im.data = np.ascontiguousarray(im.data[region.slices])
+    return im
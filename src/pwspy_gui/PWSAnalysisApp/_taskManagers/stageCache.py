@@ -0,0 +1,156 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A cache on a local disk of raw data cubes that have already been loaded and camera corrected.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import typing
+import uuid
+from glob import glob
+from typing import Optional
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+def correctCube(im: pwsdt.ICRawBase, cameraCorrection: Optional[pwsdt.CameraCorrection], userSpecifiedBinning: Optional[int] = None):
+    """Correct the camera effects of a raw data cube in place. Does nothing if the cube has already been corrected,
+    e.g. because it was loaded from a `StageCache`.
+
+    Args:
+        im: The raw data.
+        cameraCorrection: The camera correction to apply. If `None` then the automatic correction saved with the data is used.
+        userSpecifiedBinning: The binning to use if it wasn't saved in the metadata.
+    """
+    if im.processingStatus.cameraCorrected:
+        return
+    if cameraCorrection is not None:
+        if userSpecifiedBinning is None:
+            im.correctCameraEffects(cameraCorrection)
+        else:
+            im.correctCameraEffects(cameraCorrection, binning=userSpecifiedBinning)
+    else:
+        im.correctCameraEffects()
+
+
+class StageCache:
+    """Stores camera corrected data cubes in a directory on a local disk.
+
+    Args:
+        directory: The directory to save the cubes in. It is created if it doesn't exist.
+        maxBytes: The maximum total size of the saved cubes. The least recently used cubes are deleted to make room
+            for new ones.
+    """
+    _STALE_PARTIAL_SECONDS = 3600  # Partially written files older than this were left behind by a crash.
+
+    def __init__(self, directory: str, maxBytes: int):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for path in glob(os.path.join(directory, '*.partial')):
+            try:
+                if time.time() - os.path.getmtime(path) > self._STALE_PARTIAL_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def makeKey(md: pwsdt.AnalysisManagerMetaDataBase, cameraCorrection: Optional[pwsdt.CameraCorrection], userSpecifiedBinning: Optional[int]) -> str:
+        """Generate the key that identifies an acquisition with a specific camera correction applied.
+
+        Args:
+            md: The metadata of the acquisition.
+            cameraCorrection: The camera correction that was applied. `None` indicates that the automatic correction saved with the data was used.
+            userSpecifiedBinning: The binning specified by the user, if any.
+        """
+        return hashlib.sha1(repr((md.idTag, cameraCorrection, userSpecifiedBinning)).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[pwsdt.ICRawBase]:
+        """Load the cube stored under `key`. Returns `None` if it isn't in the cache."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                im = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:  # Corrupted or saved by an incompatible version.
+            logging.getLogger(__name__).warning(f"Failed to load cached cube {path}: {e}")
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # Mark it as recently used.
+        except OSError:  # Evicted in the meantime.
+            pass
+        return im
+
+    def put(self, key: str, im: pwsdt.ICRawBase):
+        """Save a camera corrected cube under `key` and delete the least recently used cubes if the cache is too big."""
+        if im.data.nbytes > self.maxBytes:
+            return
+        self._evict(reserve=im.data.nbytes)  # Make room first so that the directory stays within the limit while the new cube is written.
+        path = self._path(key)
+        partial = f"{path}.{uuid.uuid4().hex}.partial"
+        try:
+            with open(partial, 'wb') as f:
+                pickle.dump(im, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, path)  # Readers never see a partially written file.
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Failed to cache cube {key}: {e}")
+            self._remove(partial)
+            return
+        self._evict()
+
+    def clear(self):
+        for path in glob(os.path.join(self.directory, '*.pkl')):
+            self._remove(path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _evict(self, reserve: int = 0):
+        """Delete the least recently used cubes until their total size plus `reserve` is within `maxBytes`."""
+        with self._lock:
+            entries = []
+            for path in glob(os.path.join(self.directory, '*.pkl')):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            total = sum(size for mtime, size, path in entries)
+            for mtime, size, path in entries:
+                if total + reserve <= self.maxBytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
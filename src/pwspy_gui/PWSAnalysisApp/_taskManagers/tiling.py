@@ -0,0 +1,366 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Out-of-core analysis of data cubes that are too large for memory, one spatial tile at a time.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import contextlib
+import copy
+import mmap
+import os
+import tempfile
+import time
+import typing
+import uuid
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+from numpy.lib.format import open_memmap
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import dropFields as dropResultsFields
+from pwspy_gui.PWSAnalysisApp._taskManagers.stageCache import correctCube
+from pwspy_gui.PWSAnalysisApp._taskManagers.precision import narrowCube, narrowResults
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysis, AbstractAnalysisResults
+    from pwspy.analysis.warnings import AnalysisWarning
+    from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region
+
+
+class MappedCube:
+    """A data cube that has been copied from its file into a memory mapped file, without ever loading all of it into
+    memory. Cheap to pickle, so it can be sent to worker processes on the same computer. Create these with
+    `fromMetadata`.
+
+    Args:
+        path: The `.npy` file holding the data, one frame (wavelength or time) after another.
+        shell: The data cube object without its data.
+        tileSize: The width and height in pixels of the tiles to analyze the cube in.
+        overlap: The number of pixels that tiles overlap by on each side.
+    """
+    def __init__(self, path: str, shell: pwsdt.ICRawBase, tileSize: int, overlap: int = 0):
+        self.path = path
+        frames = np.load(path, mmap_mode='r')
+        self.shape = frames.shape[1:] + frames.shape[:1]
+        self.nbytes = frames.nbytes
+        del frames
+        self.tileSize = tileSize
+        self.overlap = overlap
+        self._shell = shell
+
+    @classmethod
+    def fromMetadata(cls, md: pwsdt.AnalysisManagerMetaDataBase, directory: str, tileSize: int, overlap: int = 0,
+                     region: Optional[Region] = None) -> MappedCube:
+        """Copy the raw data of an acquisition to a memory mapped file one frame at a time.
+
+        Args:
+            md: The metadata of the acquisition.
+            directory: The directory to save the file in. Should be on a fast local disk.
+            tileSize: The width and height in pixels of the tiles to analyze the cube in.
+            overlap: The number of pixels that tiles overlap by on each side.
+            region: If not `None` then only this region of the image is copied. See `roiRegion`.
+        """
+        import pwspy.dataTypes as pwsdt
+        path = os.path.join(directory, f"{uuid.uuid4().hex}.npy")
+        slices = region.slices if region is not None else (slice(None), slice(None))
+        try:
+            with _openFrames(md) as (numFrames, readFrame):
+                mm = None
+                for i in range(numFrames):
+                    frame = readFrame(i)[slices]
+                    if mm is None:
+                        mm = open_memmap(path, mode='w+', dtype=np.float32, shape=(numFrames,) + frame.shape)  # The same type that `pwspy` loads the data as.
+                    mm[i] = frame
+                mm.flush()
+                del mm
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if isinstance(md, pwsdt.PwsMetaData):
+            shell = pwsdt.PwsCube(np.zeros((1, 1, numFrames), dtype=np.float32), md)
+        else:
+            shell = pwsdt.DynCube(np.zeros((1, 1, numFrames), dtype=np.float32), md)
+        shell.data = None
+        return cls(path, shell, tileSize, overlap)
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.path)
+
+    def open(self) -> np.ndarray:
+        """Returns a read only memory map of the data, with the usual (y, x, frame) axes."""
+        return np.moveaxis(np.load(self.path, mmap_mode='r'), 0, 2)
+
+    def makeTile(self, data: np.ndarray) -> pwsdt.ICRawBase:
+        """Create a data cube object for a tile of the data. Apart from the metadata, which is shared, each tile gets
+        its own copy of the attributes of the original cube so that processing one tile doesn't affect another."""
+        tile = copy.copy(self._shell)
+        for k, v in vars(self._shell).items():
+            if k not in ('data', 'metadata'):
+                setattr(tile, k, copy.deepcopy(v))
+        tile.data = data
+        return tile
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@contextlib.contextmanager
+def _openFrames(md: pwsdt.AnalysisManagerMetaDataBase) -> Iterator[Tuple[int, Callable[[int], np.ndarray]]]:
+    """Open the raw data file of an acquisition without loading the data. Follows the file naming of the loaders of
+    `pwspy.dataTypes.PwsCube` and `DynCube`.
+
+    Yields:
+        The number of frames and a function that reads a single frame as a 2D array.
+    """
+    import pwspy.dataTypes as pwsdt
+    directory = md.filePath
+    if isinstance(md, pwsdt.PwsMetaData):
+        numFrames, tiffNames = len(md.wavelengths), ('MMStack.ome.tif', 'pws.tif')
+    else:
+        numFrames, tiffNames = len(md.times), ('dyn.tif',)
+    fileFormat = md.fileFormat.name if md.fileFormat is not None else None
+    if fileFormat is None:  # Try the formats in the same order as `loadAny`.
+        if any(os.path.exists(os.path.join(directory, name)) for name in tiffNames):
+            fileFormat = 'Tiff'
+        elif os.path.exists(os.path.join(directory, 'image_cube')):
+            fileFormat = 'RawBinary'
+        elif os.path.exists(os.path.join(directory, 'imageCube.mat')):
+            fileFormat = 'NanoMat'
+        else:
+            raise OSError(f"Could not find a valid PWS image cube file at {directory}.")
+    if fileFormat == 'Tiff':
+        import tifffile as tf
+        paths = [os.path.join(directory, name) for name in tiffNames if os.path.exists(os.path.join(directory, name))]
+        if len(paths) == 0:
+            raise OSError(f"No Tiff file was found at: {directory}")
+        with tf.TiffFile(paths[0]) as tif:
+            yield numFrames, lambda i: tif.asarray(key=i)
+    elif fileFormat == 'RawBinary':
+        data = np.memmap(os.path.join(directory, 'image_cube'), dtype=np.uint16, mode='r',
+                         shape=(md.dict['imgHeight'], md.dict['imgWidth'], numFrames), order='F')
+        yield numFrames, lambda i: data[:, :, i]
+        del data
+    elif fileFormat == 'NanoMat':
+        import h5py
+        with h5py.File(os.path.join(directory, 'imageCube.mat'), 'r') as hf:
+            ds = hf['imageCube']  # Saved by Matlab with the axes reversed.
+            yield numFrames, lambda i: ds[i].T
+    else:
+        raise TypeError(f"Invalid FileFormat: {fileFormat}")
+
+
+class DiskArray(np.memmap):
+    """An array in a file in a temporary directory, used for results that may be too large for memory. Only the file
+    name is pickled when it is sent to another process on the same computer."""
+    def __reduce__(self):
+        if isinstance(self.base, mmap.mmap):  # The whole file rather than a view of part of it.
+            return DiskArray, (self.filename, self.dtype, 'r+', 0, self.shape)
+        return super().__reduce__()
+
+
+def _emptyArray(shape: Tuple[int, ...], dtype: np.dtype, directory: Optional[str]) -> np.ndarray:
+    """A zero filled array backed by a file in `directory`. If `directory` is `None` an anonymous temporary file is
+    used, which is deleted once the array is, but the array can't be sent to another process."""
+    if directory is None:
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+    return DiskArray(os.path.join(directory, f"{uuid.uuid4().hex}.dat"), dtype=dtype, mode='w+', shape=shape)
+
+
+def _removeFile(arr) -> None:
+    """Delete the file of `arr` if it is a `DiskArray`. On Windows a file can't be deleted while it is still mapped,
+    those are left for the temporary directory to be removed."""
+    if isinstance(arr, DiskArray) and arr.filename is not None:
+        try:
+            os.remove(arr.filename)
+        except OSError:
+            pass
+
+
+def removeDiskArrays(results: AbstractAnalysisResults):
+    """Delete the files of the fields of results that were stitched into `DiskArray`s, once the results have been
+    saved."""
+    d = _resultsDict(results)
+    for k, v in list(d.items()):
+        arr = v if isinstance(v, np.ndarray) else getattr(v, 'data', None)
+        if isinstance(arr, DiskArray):
+            del d[k]
+            _removeFile(arr)
+
+
+def iterTiles(shape: Tuple[int, ...], tileSize: int, overlap: int = 0) -> Iterator[Tuple[Tuple[slice, slice], Tuple[slice, slice], Tuple[slice, slice]]]:
+    """Split an image into tiles.
+
+    Yields:
+        The slices to read from the full image (including the overlap), the slices of the read data that belong to
+        this tile (excluding the overlap), and the slices of the full image where that data belongs.
+    """
+    height, width = shape[:2]
+    for y in range(0, height, tileSize):
+        for x in range(0, width, tileSize):
+            y0, y1 = max(y - overlap, 0), min(y + tileSize + overlap, height)
+            x0, x1 = max(x - overlap, 0), min(x + tileSize + overlap, width)
+            yEnd, xEnd = min(y + tileSize, height), min(x + tileSize, width)
+            yield ((slice(y0, y1), slice(x0, x1)),
+                   (slice(y - y0, yEnd - y0), slice(x - x0, xEnd - x0)),
+                   (slice(y, yEnd), slice(x, xEnd)))
+
+
+def _isSpatial(value, shape: Tuple[int, ...]) -> bool:
+    return isinstance(value, np.ndarray) and value.ndim >= 2 and value.shape[:2] == shape[:2]
+
+
+def _hasSpatialData(value, shape: Tuple[int, ...]) -> bool:
+    return not isinstance(value, np.ndarray) and _isSpatial(getattr(value, 'data', None), shape)
+
+
+def cropAnalysis(analysis: AbstractAnalysis, shape: Tuple[int, ...], slices: Tuple[slice, slice]) -> AbstractAnalysis:
+    """Create a copy of an analysis where every image-sized array attribute (e.g. the reference and extra reflectance)
+    is cropped to `slices`. The cropped arrays are views so no data is copied."""
+    cropped = copy.copy(analysis)
+    for k, v in vars(analysis).items():
+        if _isSpatial(v, shape):
+            setattr(cropped, k, v[slices])
+        elif _hasSpatialData(v, shape):
+            v = copy.copy(v)
+            v.data = v.data[slices]
+            setattr(cropped, k, v)
+    return cropped
+
+
+def _resultsDict(results: AbstractAnalysisResults) -> dict:
+    """The fields of an analysis results object that hasn't been saved yet."""
+    d = getattr(results, 'dict', None)
+    if not isinstance(d, dict):
+        raise TypeError(f"Tiled analysis is not supported for results of type {type(results)}")
+    return d
+
+
+class _Stitcher:
+    """Assembles the results of an analysis from the results of each tile.
+
+    Image-sized arrays are placed in the output image. Other numeric arrays and numbers (e.g. values averaged over the
+    whole image) are averaged, weighted by the number of pixels in each tile. This is exact for means unless the tiles
+    overlap, in which case the overlapping pixels contribute to more than one tile. Anything else is taken from the
+    first tile.
+
+    Args:
+        shape: The shape of the full data cube.
+        directory: The directory to save the image-sized arrays in, as `DiskArray`s, so that they never need to fit in
+            memory.
+    """
+    def __init__(self, shape: Tuple[int, ...], directory: str):
+        self._shape = shape
+        self._directory = directory
+        self._results = None
+        self._fields = {}
+        self._numPixels = shape[0] * shape[1]
+        self._warnings = []
+
+    def add(self, results: AbstractAnalysisResults, warnings: List[AnalysisWarning], tileShape: Tuple[int, ...],
+            inner: Tuple[slice, slice], out: Tuple[slice, slice]):
+        if self._results is None:
+            self._results = results
+        weight = (out[0].stop - out[0].start) * (out[1].stop - out[1].start) / self._numPixels
+        for k, v in _resultsDict(results).items():
+            if _isSpatial(v, tileShape):
+                if k not in self._fields:
+                    self._fields[k] = _emptyArray(self._shape[:2] + v.shape[2:], v.dtype, self._directory)
+                self._fields[k][out] = v[inner]
+            elif _hasSpatialData(v, tileShape):
+                if k not in self._fields:
+                    full = copy.copy(v)
+                    full.data = _emptyArray(self._shape[:2] + v.data.shape[2:], v.data.dtype, self._directory)
+                    self._fields[k] = full
+                self._fields[k].data[out] = v.data[inner]
+            elif isinstance(v, (np.ndarray, float, np.floating)) and np.issubdtype(np.asarray(v).dtype, np.floating):
+                self._fields[k] = self._fields.get(k, 0) + np.asarray(v) * weight
+            elif k not in self._fields:
+                self._fields[k] = v
+        for w in warnings:
+            if not any(w.shortMsg == existing.shortMsg for existing in self._warnings):
+                self._warnings.append(w)
+
+    def result(self) -> Tuple[AbstractAnalysisResults, List[AnalysisWarning]]:
+        results = copy.copy(self._results)
+        results.dict = self._fields
+        return results, self._warnings
+
+
+def padResults(results: AbstractAnalysisResults, fullShape: Tuple[int, ...], slices: Tuple[slice, slice]) -> AbstractAnalysisResults:
+    """Place the image-sized fields of results that were computed from the region `slices` of an image into zero
+    filled arrays the size of the full image. The full arrays are backed by temporary files so only the region needs
+    to fit in memory, and the files of region fields that were `DiskArray`s are deleted. Other fields are unchanged."""
+    shape = (slices[0].stop - slices[0].start, slices[1].stop - slices[1].start)
+    if tuple(shape) == tuple(fullShape[:2]):
+        return results
+    d = _resultsDict(results)
+    for k, v in d.items():
+        if _isSpatial(v, shape):
+            full = _emptyArray(tuple(fullShape[:2]) + v.shape[2:], v.dtype, None)
+            full[slices] = v
+            d[k] = full
+            _removeFile(v)
+        elif _hasSpatialData(v, shape):
+            v = copy.copy(v)
+            full = _emptyArray(tuple(fullShape[:2]) + v.data.shape[2:], v.data.dtype, None)
+            full[slices] = v.data
+            _removeFile(v.data)
+            v.data = full
+            d[k] = v
+    return results
+
+
+def analyzeTiled(mapped: MappedCube, analyses: typing.Sequence[AbstractAnalysis], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                 userSpecifiedBinning: Optional[int] = None, timings: dict = None,
+                 dropFields: typing.Sequence[typing.Sequence[str]] = None, singlePrecision: typing.Sequence[bool] = None) -> List[Tuple[AbstractAnalysisResults, List[AnalysisWarning]]]:
+    """Run analyses one tile at a time on a memory mapped data cube. Has the same behavior as
+    `workerPool.analyzeCube`. The memory mapped file is deleted afterwards. The image-sized results are `DiskArray`s
+    in the same directory, delete them with `removeDiskArrays` once they have been saved."""
+    try:
+        data = mapped.open()
+        stitchers = [_Stitcher(mapped.shape, mapped.directory) for a in analyses]
+        correctTime, analyzeTime = 0.0, 0.0
+        for read, inner, out in iterTiles(mapped.shape, mapped.tileSize, mapped.overlap):
+            sTime = time.time()
+            tile = mapped.makeTile(np.ascontiguousarray(data[read]))
+            correctCube(tile, cameraCorrection, userSpecifiedBinning)
+            if singlePrecision is not None and all(singlePrecision):
+                narrowCube(tile)
+            correctTime += time.time() - sTime
+            sTime = time.time()
+            tileShape = tile.data.shape
+            for i, (analysis, stitcher) in enumerate(zip(analyses, stitchers)):
+                cube = tile if i == len(analyses) - 1 else copy.deepcopy(tile)  # Analyses process the data in place, each one needs its own copy.
+                results, warnings = cropAnalysis(analysis, mapped.shape, read).run(cube)
+                if dropFields is not None:
+                    dropResultsFields(results, dropFields[i])  # Don't bother stitching fields that won't be saved.
+                if singlePrecision is not None and singlePrecision[i]:
+                    narrowResults(results)  # The stitched arrays are allocated with the same precision as the tiles.
+                stitcher.add(results, warnings, tileShape, inner, out)
+            analyzeTime += time.time() - sTime
+        del data
+    finally:
+        mapped.remove()
+    if timings is not None:
+        timings.update(correct=correctTime, analyze=analyzeTime)
+    return [stitcher.result() for stitcher in stitchers]
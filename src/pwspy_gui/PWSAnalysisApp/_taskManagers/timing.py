@@ -0,0 +1,163 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Records how long each stage of the analysis took for each acquisition.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import dataclasses
+import json
+import os
+import socket
+import threading
+import typing
+from typing import Dict, List, Optional
+import psutil
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('read', 'correct', 'analyze', 'write')
+
+
+def workerName() -> str:
+    """Identifies the current process, even when processes on many computers are working together."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def peakRss() -> int:
+    """Returns the peak resident memory of the current process in bytes."""
+    mem = psutil.Process().memory_info()
+    if hasattr(mem, 'peak_wset'):  # Windows
+        return mem.peak_wset
+    if resource is not None:
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxRss if psutil.MACOS else maxRss * 1024  # Linux reports kilobytes.
+    return mem.rss
+
+
+def directorySize(path: str) -> int:
+    """Returns the total size in bytes of the files in a directory and its subdirectories."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:  # Deleted while we were walking.
+                pass
+    return total
+
+
+@dataclasses.dataclass
+class CellTiming:
+    """The time spent on each stage of the analysis of a single acquisition.
+
+    Attributes:
+        filePath: The acquisition.
+        analysisNames: The analyses that were run on the acquisition.
+        analysisTypes: The class name of each analysis, e.g. `PWSAnalysis`.
+        worker: The process that ran the analyses. See `workerName`.
+        read: Seconds spent loading the raw data.
+        correct: Seconds spent correcting camera effects.
+        analyze: Seconds spent running the analyses.
+        write: Seconds spent saving the results.
+        bytesRead: The size of the raw data files.
+        bytesWritten: The number of bytes added to the acquisition directory by saving the results.
+        peakRss: The peak resident memory of the worker process, in bytes, after running the analyses.
+    """
+    filePath: str
+    analysisNames: List[str] = dataclasses.field(default_factory=list)
+    analysisTypes: List[str] = dataclasses.field(default_factory=list)
+    worker: str = ''
+    read: float = 0
+    correct: float = 0
+    analyze: float = 0
+    write: float = 0
+    bytesRead: int = 0
+    bytesWritten: int = 0
+    peakRss: int = 0
+
+
+class StageTiming(typing.NamedTuple):
+    """A summary of the time spent on one stage for all acquisitions.
+
+    Attributes:
+        stage: The name of the stage.
+        cells: The number of acquisitions.
+        totalSeconds: The sum of the time spent on the stage for all acquisitions.
+        meanSeconds: The average time per acquisition.
+        maxSeconds: The longest time for a single acquisition.
+        megabytesPerSecond: The throughput of a single reader/writer. `None` for stages that don't do IO.
+    """
+    stage: str
+    cells: int
+    totalSeconds: float
+    meanSeconds: float
+    maxSeconds: float
+    megabytesPerSecond: Optional[float]
+
+
+class TimingRecorder:
+    """Collects the `CellTiming` of each acquisition of an analysis. Safe to use from multiple threads.
+
+    Args:
+        logPath: If not `None` then each timing is appended to this file as a line of json.
+    """
+    def __init__(self, logPath: Optional[str] = None):
+        self.logPath = logPath
+        self._timings: List[CellTiming] = []
+        self._lock = threading.Lock()
+
+    def add(self, timing: CellTiming):
+        with self._lock:
+            self._timings.append(timing)
+            if self.logPath is not None:
+                with open(self.logPath, 'a') as f:
+                    f.write(json.dumps(dataclasses.asdict(timing)) + '\n')
+
+    @property
+    def timings(self) -> List[CellTiming]:
+        with self._lock:
+            return list(self._timings)
+
+    def summarize(self) -> List[StageTiming]:
+        """Summarize the time spent on each stage."""
+        timings = self.timings
+        summary = []
+        for stage in STAGES:
+            times = [getattr(t, stage) for t in timings]
+            total = sum(times)
+            if stage == 'read':
+                nbytes = sum(t.bytesRead for t in timings)
+            elif stage == 'write':
+                nbytes = sum(t.bytesWritten for t in timings)
+            else:
+                nbytes = None
+            throughput = nbytes / total / 1024**2 if nbytes is not None and total > 0 else None
+            summary.append(StageTiming(stage, len(times), total, total / len(times) if len(times) > 0 else 0,
+                                       max(times, default=0), throughput))
+        return summary
+
+    def peakRssByWorker(self) -> Dict[str, int]:
+        """Returns the largest peak resident memory recorded for each worker process."""
+        peaks = {}
+        for t in self.timings:
+            peaks[t.worker] = max(peaks.get(t.worker, 0), t.peakRss)
+        return peaks
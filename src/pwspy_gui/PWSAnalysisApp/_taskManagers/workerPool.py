@@ -0,0 +1,426 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A pool of analysis processes that is reused for the whole session. Analyses and raw data are passed to the
+workers through shared memory.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import collections
+import copy
+import gc
+import io
+import logging
+import multiprocessing as mp
+import pickle
+import threading
+import time
+import typing
+import uuid
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from pwspy_gui.PWSAnalysisApp._taskManagers.timing import peakRss, workerName
+from pwspy_gui.PWSAnalysisApp._taskManagers.tiling import MappedCube, analyzeTiled, cropAnalysis
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import CellCompilation, compileResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.stageCache import correctCube
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import dropFields as dropResultsFields
+from pwspy_gui.PWSAnalysisApp._taskManagers.precision import narrowCube, narrowResults
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7. Large arrays will be copied into each worker rather than shared.
+    shared_memory = None
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+    from pwspy.analysis import AbstractAnalysis, AbstractAnalysisResults
+    from pwspy.analysis.warnings import AnalysisWarning
+
+
+_SHARE_THRESHOLD = 2**20  # Arrays with at least this many bytes are put in shared memory rather than being pickled.
+_MAX_CACHED_CONTEXTS = 4  # The number of analysis contexts that each worker keeps loaded.
+
+
+def analyzeCube(im: pwsdt.ICRawBase, analyses: typing.Sequence[AbstractAnalysis], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                userSpecifiedBinning: Optional[int] = None, timings: dict = None,
+                dropFields: typing.Sequence[typing.Sequence[str]] = None, region: Optional[Region] = None,
+                compilations: typing.Sequence[Optional[CellCompilation]] = None, compiled: list = None,
+                singlePrecision: typing.Sequence[bool] = None) -> List[Tuple[AbstractAnalysisResults, List[AnalysisWarning]]]:
+    """Correct the camera effects of a raw data cube, unless that was already done, and then run each of the analyses on it.
+
+    Args:
+        im: The raw data to analyze. If this is a `MappedCube` then the analysis is run tile by tile.
+        analyses: The analyses to run.
+        cameraCorrection: The camera correction to apply. If `None` then the automatic correction saved with the data is used.
+        userSpecifiedBinning: The binning to use if it wasn't saved in the metadata.
+        timings: If provided, the number of seconds spent on the `correct` and `analyze` steps, the `worker` name, and
+            the `peakRss` of this process are stored in this dictionary.
+        dropFields: For each analysis, the names of the results fields that shouldn't be saved. They are removed here
+            so that they don't need to be sent back from a worker process. See `outputProfile`.
+        region: If `im` has been cropped to a region of the full image then the analyses are cropped to match. The
+            results are for the region only. See `roiRegion`.
+        compilations: For each analysis, the ROIs to compile from the results before any fields are dropped. `None`
+            for analyses that shouldn't be compiled. See `roiCompilation`.
+        compiled: If provided, the `CompiledRois` of each analysis are appended to this list, or `None` if the
+            analysis wasn't compiled.
+        singlePrecision: For each analysis, whether the results should be converted to single precision. See `precision`.
+
+    Returns:
+        The analysis results and a list of warnings for each analysis.
+    """
+    if region is not None:
+        analyses = [cropAnalysis(analysis, region.fullShape, region.slices) for analysis in analyses]
+
+    def finish(i: int, anResults: AbstractAnalysisResults):
+        """Compile the ROIs and then remove the fields that won't be saved and convert the precision of the rest."""
+        if compilations is not None and compilations[i] is not None:
+            roiResults = compileResults(anResults, compilations[i], region)
+        else:
+            roiResults = None
+        if compiled is not None:
+            compiled.append(roiResults)
+        if dropFields is not None:
+            dropResultsFields(anResults, dropFields[i])
+        if singlePrecision is not None and singlePrecision[i]:
+            narrowResults(anResults)
+
+    if isinstance(im, MappedCube):
+        tiledDropFields = dropFields
+        if dropFields is not None and compilations is not None:  # Fields that are needed to compile the ROIs are dropped after stitching.
+            tiledDropFields = [() if c is not None else d for c, d in zip(compilations, dropFields)]
+        results = analyzeTiled(im, analyses, cameraCorrection, userSpecifiedBinning, timings, tiledDropFields, singlePrecision)
+        sTime = time.time()
+        for i, (anResults, warnings) in enumerate(results):
+            finish(i, anResults)
+        if timings is not None:
+            timings.update(analyze=timings['analyze'] + time.time() - sTime, worker=workerName(), peakRss=peakRss())
+        return results
+    sTime = time.time()
+    correctCube(im, cameraCorrection, userSpecifiedBinning)
+    if singlePrecision is not None and all(singlePrecision):
+        narrowCube(im)
+    correctTime = time.time() - sTime
+    sTime = time.time()
+    results = []
+    for i, analysis in enumerate(analyses):
+        cube = im if i == len(analyses) - 1 else copy.deepcopy(im)  # Analyses process the data in place, each one needs its own copy.
+        anResults, warnings = analysis.run(cube)
+        del cube
+        finish(i, anResults)
+        results.append((anResults, warnings))
+    if timings is not None:
+        timings.update(correct=correctTime, analyze=time.time() - sTime, worker=workerName(), peakRss=peakRss())
+    return results
+
+
+class _SharedArrayPickler(pickle.Pickler):
+    """Pickles an object, moving any large numpy arrays into shared memory. Only a reference to the shared memory
+    ends up in the pickled data."""
+    def __init__(self, file: typing.BinaryIO, blocks: list):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._blocks = blocks
+        self._ids = {}  # Avoid copying the same array twice.
+
+    def persistent_id(self, obj):
+        if shared_memory is None or type(obj) is not np.ndarray or obj.nbytes < _SHARE_THRESHOLD or obj.dtype.hasobject:
+            return None
+        if id(obj) not in self._ids:
+            shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+            np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+            self._blocks.append(shm)
+            self._ids[id(obj)] = ('sharedArray', shm.name, obj.shape, obj.dtype.str)
+        return self._ids[id(obj)]
+
+
+class _SharedArrayUnpickler(pickle.Unpickler):
+    """Unpickles data that was pickled by `_SharedArrayPickler`. The arrays will be backed by the shared memory."""
+    def __init__(self, file: typing.BinaryIO, blocks: list):
+        super().__init__(file)
+        self._blocks = blocks
+
+    def persistent_load(self, pid):
+        tag, name, shape, dtype = pid
+        if tag != 'sharedArray':
+            raise pickle.UnpicklingError(f"Unsupported persistent id: {pid}")
+        shm = shared_memory.SharedMemory(name=name)
+        self._blocks.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+class _BlockPool:
+    """Recycles shared memory blocks. Creating a new block for every data cube is slow since the operating system has
+    to provide fresh pages of memory each time."""
+    def __init__(self):
+        self._free: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes: int) -> shared_memory.SharedMemory:
+        """Get a block of at least `nbytes`. The smallest free block that is large enough, and not more than twice as
+        large as needed, is reused. Otherwise a new block is created."""
+        with self._lock:
+            candidates = [b for b in self._free if nbytes <= b.size <= 2 * nbytes]
+            if len(candidates) > 0:
+                block = min(candidates, key=lambda b: b.size)
+                self._free.remove(block)
+                return block
+        return shared_memory.SharedMemory(create=True, size=nbytes)
+
+    def release(self, block: shared_memory.SharedMemory):
+        """Return a block to the pool so that it can be reused."""
+        with self._lock:
+            self._free.append(block)
+
+    def trim(self):
+        """Free all of the blocks that aren't in use."""
+        with self._lock:
+            blocks, self._free = self._free, []
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+class SharedCube:
+    """A data cube whose data has been copied into a block of shared memory. Only the name of the block is pickled
+    when this is sent to a worker process, the worker then uses the data in place. Create these with
+    `WorkerPool.shareCube`. The block is returned to the pool once the analysis is done, or by calling `release` if the
+    cube is never submitted."""
+    def __init__(self, im: pwsdt.ICRawBase, block: shared_memory.SharedMemory, blockPool: _BlockPool):
+        self.blockName = block.name
+        self.shape = im.data.shape
+        self.dtype = im.data.dtype.str
+        self.nbytes = im.data.nbytes
+        np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)[...] = im.data
+        self._shell = copy.copy(im)  # Everything except for the data.
+        self._shell.data = None
+        self._block = block
+        self._blockPool = blockPool
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_block'], state['_blockPool']  # Only used in the main process.
+        return state
+
+    def release(self):
+        if self._blockPool is not None:
+            self._blockPool.release(self._block)
+            self._blockPool = None
+
+    def attach(self) -> pwsdt.ICRawBase:
+        """Called in a worker process. Returns the data cube, backed by the shared memory. The block stays attached
+        until the next cube is attached since the analysis results may still refer to it until they have been sent
+        back to the main process."""
+        global _attachedBlock
+        if _attachedBlock is not None:
+            try:
+                _attachedBlock.close()
+            except BufferError:  # Something still references the memory. It will be freed when the process exits.
+                pass
+        _attachedBlock = shared_memory.SharedMemory(name=self.blockName)
+        self._shell.data = np.ndarray(self.shape, dtype=self.dtype, buffer=_attachedBlock.buf)
+        return self._shell
+
+
+class AnalysisContext:
+    """Everything that a worker needs in order to run an analysis, in a form that is cheap to send with every task.
+
+    Create contexts using `WorkerPool.createContext` and call `release` once no more tasks will be submitted with it.
+
+    Args:
+        analyses: The analyses to run. Each task submitted with the context specifies which of these to run.
+        cameraCorrection: The camera correction to apply. If `None` then the automatic correction saved with the data is used.
+        userSpecifiedBinning: The binning to use if it wasn't saved in the metadata.
+        dropFields: For each analysis, the names of the results fields that shouldn't be saved.
+        singlePrecision: For each analysis, whether the results should be converted to single precision.
+        onReleased: Called once the context has been released.
+    """
+    def __init__(self, analyses: typing.Sequence[AbstractAnalysis], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                 userSpecifiedBinning: Optional[int], dropFields: typing.Sequence[typing.Sequence[str]] = None,
+                 singlePrecision: typing.Sequence[bool] = None, onReleased: Callable[[AnalysisContext], None] = None):
+        self.key = uuid.uuid4().hex
+        self._blocks = []
+        f = io.BytesIO()
+        _SharedArrayPickler(f, self._blocks).dump((list(analyses), cameraCorrection, userSpecifiedBinning, dropFields, singlePrecision))
+        self.payload = f.getvalue()
+        self._onReleased = onReleased
+        self._released = False
+
+    def release(self):
+        """Free the shared memory used by this context. Workers that still have the context cached keep their
+        mapping of the memory until they drop it from their cache."""
+        if self._released:
+            return
+        self._released = True
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+        if self._onReleased is not None:
+            self._onReleased(self)
+
+
+_workerContexts: typing.OrderedDict[str, Tuple[tuple, list]] = collections.OrderedDict()  # Only used in the worker processes.
+_attachedBlock: Optional[shared_memory.SharedMemory] = None  # The block of the most recent `SharedCube`. Only used in the worker processes.
+
+
+def _getContext(key: str, payload: bytes) -> tuple:
+    """Return the unpickled contents of a context, loading it into this worker's cache if it isn't there yet."""
+    if key in _workerContexts:
+        _workerContexts.move_to_end(key)
+        return _workerContexts[key][0]
+    logging.getLogger(__name__).info(f"Worker {mp.current_process().name} loading analysis context {key}")
+    blocks = []
+    contents = _SharedArrayUnpickler(io.BytesIO(payload), blocks).load()
+    _workerContexts[key] = (contents, blocks)
+    while len(_workerContexts) > _MAX_CACHED_CONTEXTS:
+        _, (oldContents, oldBlocks) = _workerContexts.popitem(last=False)
+        del oldContents
+        gc.collect()  # Make sure the arrays referencing the shared memory are gone before closing it.
+        for shm in oldBlocks:
+            try:
+                shm.close()
+            except BufferError:  # Something still references the memory. It will be freed when the process exits.
+                pass
+    return contents
+
+
+def _process(key: str, payload: bytes, index: int, im: pwsdt.ICRawBase, analysisIndices: typing.Sequence[int], region: Optional[Region],
+             compilations: Optional[typing.Sequence[Optional[CellCompilation]]]) -> Tuple[int, List[Tuple[AbstractAnalysisResults, List[AnalysisWarning]]], dict, list]:
+    """This method is run in the worker processes, once for each acquisition that we want to analyze.
+    Returns the index of the acquisition, the results and warnings of each analysis, the timings filled in by
+    `analyzeCube`, and the compiled ROIs of each analysis."""
+    analyses, cameraCorrection, binning, dropFields, singlePrecision = _getContext(key, payload)
+    if isinstance(im, SharedCube):
+        im = im.attach()
+    timings = {}
+    compiled = []
+    results = analyzeCube(im, [analyses[i] for i in analysisIndices], cameraCorrection, binning, timings,
+                          [dropFields[i] for i in analysisIndices] if dropFields is not None else None, region,
+                          compilations, compiled, [singlePrecision[i] for i in analysisIndices] if singlePrecision is not None else None)
+    return index, results, timings, compiled
+
+
+class WorkerPool:
+    """A pool of processes for running analyses that can be reused by many analyses, even at the same time.
+
+    Args:
+        numWorkers: The number of processes in the pool.
+    """
+    def __init__(self, numWorkers: int):
+        self._numWorkers = numWorkers
+        self._pool: Optional[mp.pool.Pool] = None
+        self._lock = threading.Lock()
+        self._contexts: List[AnalysisContext] = []
+        self._retired = False
+        self._blockPool = _BlockPool() if shared_memory is not None else None
+
+    @property
+    def numWorkers(self) -> int:
+        return self._numWorkers
+
+    def start(self):
+        """Spawn the worker processes. This is called automatically the first time a task is submitted."""
+        with self._lock:
+            if self._retired:
+                raise RuntimeError("This pool has been shut down.")
+            if self._pool is None:
+                logging.getLogger(__name__).info(f"Starting a pool of {self._numWorkers} analysis processes.")
+                self._pool = mp.Pool(processes=self._numWorkers)
+
+    def createContext(self, analyses: typing.Sequence[AbstractAnalysis], cameraCorrection: Optional[pwsdt.CameraCorrection],
+                      userSpecifiedBinning: Optional[int] = None, dropFields: typing.Sequence[typing.Sequence[str]] = None,
+                      singlePrecision: typing.Sequence[bool] = None) -> AnalysisContext:
+        """Prepare analyses to be run by this pool. The returned context must be released once it is no longer
+        needed."""
+        context = AnalysisContext(analyses, cameraCorrection, userSpecifiedBinning, dropFields, singlePrecision, onReleased=self._contextReleased)
+        with self._lock:
+            self._contexts.append(context)
+        return context
+
+    def shareCube(self, im: pwsdt.ICRawBase) -> typing.Union[SharedCube, pwsdt.ICRawBase]:
+        """Copy a data cube into shared memory so it doesn't need to be pickled when it is submitted. This can be done
+        by the thread that loaded the data so that the main thread doesn't spend time copying.
+
+        Returns:
+            A `SharedCube` to submit in place of `im`. `im` itself if it is too small to be worth sharing or shared
+            memory isn't available.
+        """
+        if self._blockPool is None or not isinstance(getattr(im, 'data', None), np.ndarray) or im.data.nbytes < _SHARE_THRESHOLD:
+            return im
+        return SharedCube(im, self._blockPool.acquire(im.data.nbytes), self._blockPool)
+
+    def trimSharedBlocks(self):
+        """Free the shared memory of cubes that are no longer in use. Worker processes keep the most recently used
+        block mapped until they receive another cube."""
+        if self._blockPool is not None:
+            self._blockPool.trim()
+
+    def submit(self, context: AnalysisContext, index: int, im: typing.Union[SharedCube, pwsdt.ICRawBase], analysisIndices: typing.Sequence[int],
+               callback: Callable, errorCallback: Callable, region: Optional[Region] = None,
+               compilations: typing.Sequence[Optional[CellCompilation]] = None):
+        """Run analyses of `context` on `im` in one of the worker processes.
+
+        Args:
+            context: The analyses to run.
+            index: An identifier that will be passed back in the results.
+            im: The raw data to analyze. If this is a `SharedCube` its block is released once the analysis is done.
+            analysisIndices: The indices of the analyses of `context` to run.
+            callback: Called with a tuple of the index, a list of the results and warnings of each analysis, a
+                dictionary of timings, and a list of the compiled ROIs of each analysis. See `analyzeCube`.
+            errorCallback: Called with the exception if the analysis fails.
+            region: The region of the full image that `im` has been cropped to, if any. See `roiRegion`.
+            compilations: For each of `analysisIndices`, the ROIs to compile. See `roiCompilation`.
+        """
+        self.start()
+        if isinstance(im, SharedCube):
+            def onDone(ret, cb=callback):
+                im.release()
+                cb(ret)
+            callback, errorCallback = onDone, lambda e, cb=errorCallback: onDone(e, cb)
+        try:
+            self._pool.apply_async(_process, (context.key, context.payload, index, im, tuple(analysisIndices), region, compilations), callback=callback, error_callback=errorCallback)
+        except Exception:
+            if isinstance(im, SharedCube):
+                im.release()
+            raise
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting new contexts. The processes will exit once all of the open contexts have been released.
+
+        Args:
+            wait: If `True` then block until the processes have exited. Any open contexts are released.
+        """
+        with self._lock:
+            self._retired = True
+            contexts = list(self._contexts)
+        if wait:
+            [c.release() for c in contexts]
+        self._closeIfDone()
+        if wait and self._pool is not None:
+            self._pool.join()
+        if wait:
+            self.trimSharedBlocks()
+
+    def _contextReleased(self, context: AnalysisContext):
+        with self._lock:
+            self._contexts.remove(context)
+        self._closeIfDone()
+
+    def _closeIfDone(self):
+        with self._lock:
+            if self._retired and len(self._contexts) == 0 and self._pool is not None:
+                self._pool.close()
@@ -21,3 +21,5 @@ dataDirectory = os.path.join(appPath, 'PWSAnalysisData')
 analysisSettingsDirectory = os.path.join(dataDirectory, 'PWSAnalysisSettings')
 extraReflectionDirectory = os.path.join(dataDirectory, 'ExtraReflection')
 googleDriveAuthPath = os.path.join(dataDirectory, 'GoogleDrive')
+referenceCacheDirectory = os.path.join(dataDirectory, 'ReferenceCache')
+stageCacheDirectory = os.path.join(dataDirectory, 'StageCache')
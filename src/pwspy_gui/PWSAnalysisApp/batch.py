@@ -0,0 +1,404 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Run analyses without the GUI, e.g. on a headless compute node. Installed as the `PWSAnalysis-batch` command.
+
+The analyses to run are described by a json job file. The file can contain a single job or a list of jobs along with
+optional pipeline settings::
+
+    {
+        "pipeline": {"numWorkers": 8, "numReaders": 2},
+        "jobs": [
+            {
+                "name": "p0",
+                "type": "pws",
+                "cells": ["D:/data/experiment1/Cell[0-9]*", "D:/data/experiment2/**/Cell[0-9]*"],
+                "reference": "D:/data/experiment1/Cell999",
+                "settings": "Recommended",
+                "extraReflection": "LCPWS1_..._idTag",
+                "conflict": "incremental"
+            }
+        ]
+    }
+
+`settings` is either the name of a settings preset or the path to a `*_analysis.json` settings file. `conflict`
+determines what happens if a cell already has an analysis with the same name: `abort` (default), `overwrite`,
+`skip`, or `incremental` (skip cells whose existing analysis is complete and used the same inputs, redo the rest).
+`output` determines which datasets are saved: `maps` or `full` (default). See `outputProfile`.
+`rois` is a regex. If it is given then only the bounding box of the ROIs with matching names is analyzed and cells
+without any matching ROIs are skipped. See `roiRegion`. `singlePrecision` processes the data and saves the results as
+32-bit floats to save memory. See `precision`.
+
+Progress is written to stdout as one json object per line. Log messages are written to stderr. Setting `timingLog` in
+the pipeline settings also writes the time spent on each stage for each acquisition to a file.
+
+Setting `distributedDirectory` in the pipeline settings queues the acquisitions in a shared directory where
+`PWSAnalysis-worker` processes running on other computers help to analyze them.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+from glob import glob
+from typing import Dict, List, Optional
+import jsonschema
+import pwspy.dataTypes as pwsdt
+from pwspy.analysis import defaultSettingsPath, AbstractAnalysisSettings
+from pwspy.analysis.dynamics import DynamicsAnalysis, DynamicsAnalysisSettings
+from pwspy.analysis.pws import PWSAnalysis, PWSAnalysisSettings
+from pwspy_gui.PWSAnalysisApp import applicationVars
+from pwspy_gui.extraReflectionDirectory import ERDataDirectory
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPipeline import AnalysisPipeline, AnalysisTask, PipelineSettings
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPreparation import checkAutoCorrectionConsistency, findCellsWithoutRois, findExistingAnalyses, removeAnalyses
+from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+from pwspy_gui.PWSAnalysisApp._taskManagers.costEstimator import CostEstimate, CostEstimator
+from pwspy_gui.PWSAnalysisApp._taskManagers.distributedQueue import DistributedPipeline, DistributedWorker
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import DEPRECATED_PROFILES, OUTPUT_PROFILES, droppedFields
+from pwspy_gui.PWSAnalysisApp._taskManagers.precision import narrowAnalysis
+from pwspy_gui.PWSAnalysisApp._taskManagers.referenceCache import ReferenceCache
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import WorkerPool
+
+_jobSchema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'type': {'type': 'string', 'enum': ['pws', 'dynamics']},
+        'cells': {'oneOf': [{'type': 'string'}, {'type': 'array', 'items': {'type': 'string'}}]},
+        'reference': {'type': 'string'},
+        'settings': {'type': 'string'},
+        'extraReflection': {'type': ['string', 'null']},
+        'extraReflectionDirectory': {'type': 'string'},
+        'binning': {'type': ['integer', 'null']},
+        'conflict': {'type': 'string', 'enum': ['abort', 'overwrite', 'skip', 'incremental']},
+        'output': {'type': 'string', 'enum': list(OUTPUT_PROFILES + DEPRECATED_PROFILES)},
+        'rois': {'type': 'string'},
+        'singlePrecision': {'type': 'boolean'}
+    },
+    'required': ['name', 'cells', 'reference', 'settings'],
+    'additionalProperties': False
+}
+
+_fileSchema = {
+    "$schema": "http://json-schema.org/schema#",
+    'oneOf': [
+        _jobSchema,
+        {
+            'type': 'object',
+            'properties': {
+                'pipeline': {'type': 'object'},
+                'jobs': {'type': 'array', 'items': _jobSchema}
+            },
+            'required': ['jobs'],
+            'additionalProperties': False
+        }
+    ]
+}
+
+_analysisTypes = {'pws': (PWSAnalysis, PWSAnalysisSettings, 'pws'),
+                  'dynamics': (DynamicsAnalysis, DynamicsAnalysisSettings, 'dynamics')}  # Analysis class, settings class, attribute of `Acquisition`
+
+
+class BatchError(Exception):
+    """Raised when a job can't be run."""
+    pass
+
+
+class _Output:
+    """Writes machine readable progress to stdout as one json object per line."""
+    def __init__(self, stream: typing.TextIO = sys.stdout):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, default=str)
+        with self._lock:
+            self._stream.write(line + '\n')
+            self._stream.flush()
+
+
+class _PreparedJob(typing.NamedTuple):
+    name: str
+    analysis: object
+    cellMetas: List[pwsdt.AnalysisManagerMetaDataBase]
+    settings: AbstractAnalysisSettings
+    cameraCorrection: Optional[pwsdt.CameraCorrection]
+    binning: Optional[int]
+    marker: CompletionMarker
+    outputProfile: str
+    roiNamePattern: Optional[str]
+    singlePrecision: bool
+
+
+def _loadSettings(SettingsClass: typing.Type[AbstractAnalysisSettings], spec: str) -> AbstractAnalysisSettings:
+    """Load analysis settings from a file path or the name of a preset."""
+    suffix = '_analysis.json'
+    if os.path.isfile(spec):
+        directory, fileName = os.path.split(os.path.abspath(spec))
+        if not fileName.endswith(suffix):
+            raise BatchError(f"Settings file names must end with `{suffix}`. Got: {spec}")
+        return SettingsClass.fromJson(directory, fileName[:-len(suffix)])
+    for directory in (applicationVars.analysisSettingsDirectory, defaultSettingsPath):
+        if os.path.exists(os.path.join(directory, f"{spec}{suffix}")):
+            return SettingsClass.fromJson(directory, spec)
+    raise BatchError(f"No settings file or preset named `{spec}` was found.")
+
+
+def _loadMetadata(path: str, attrName: str) -> Optional[pwsdt.AnalysisManagerMetaDataBase]:
+    try:
+        return getattr(pwsdt.Acquisition(path), attrName)
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"Failed to load {path}: {e}")
+        return None
+
+
+def _findCells(patterns: typing.Union[str, List[str]], attrName: str, output: _Output, jobName: str) -> List[pwsdt.AnalysisManagerMetaDataBase]:
+    patterns = [patterns] if isinstance(patterns, str) else patterns
+    paths = sorted({os.path.abspath(p) for pattern in patterns for p in glob(pattern, recursive=True) if os.path.isdir(p)})
+    cellMetas = []
+    for path in paths:
+        md = _loadMetadata(path, attrName)
+        if md is None:
+            output.emit('warning', job=jobName, cell=path, message=f"No {attrName} data found. Skipping.")
+        else:
+            cellMetas.append(md)
+    return cellMetas
+
+
+def _prepareJob(job: dict, referenceCache: ReferenceCache, output: _Output) -> Optional[_PreparedJob]:
+    """Run the same checks as the GUI and initialize the analysis.
+
+    Returns:
+        The initialized analysis or `None` if there is nothing to do.
+    """
+    logger = logging.getLogger(__name__)
+    name = job['name']
+    AnalysisClass, SettingsClass, attrName = _analysisTypes[job.get('type', 'pws')]
+    settings = _loadSettings(SettingsClass, job['settings'])
+    cameraCorrection = settings.cameraCorrection
+    binning = job.get('binning')
+    refMeta = _loadMetadata(job['reference'], attrName)
+    if refMeta is None:
+        raise BatchError(f"Failed to load {attrName} reference from {job['reference']}")
+    cellMetas = _findCells(job['cells'], attrName, output, name)
+    if len(cellMetas) == 0:
+        raise BatchError(f"No acquisitions matching {job['cells']} were found.")
+    erMeta = None
+    if job.get('extraReflection') is not None:
+        erDirectory = ERDataDirectory(job.get('extraReflectionDirectory', applicationVars.extraReflectionDirectory))
+        erMeta = erDirectory.getMetadataFromId(job['extraReflection'])
+        if refMeta.systemName != erMeta.systemName:
+            output.emit('warning', job=name, message=f"The reference was acquired on system: {refMeta.systemName} while the extra reflectance correction was acquired on system: {erMeta.systemName}.")
+    if job.get('output') in DEPRECATED_PROFILES:
+        output.emit('warning', job=name, message=f"The `{job['output']}` output is deprecated, it saves the same datasets as `maps` or `full`. Use one of {list(OUTPUT_PROFILES)}.")
+    roiNamePattern = job.get('rois')
+    singlePrecision = job.get('singlePrecision', False)
+    marker = CompletionMarker.create(settings, refMeta, erMeta, roiNamePattern, singlePrecision)
+    if roiNamePattern is not None:
+        noRois = findCellsWithoutRois(cellMetas, roiNamePattern)
+        if len(noRois) > 0:
+            output.emit('skipped', job=name, cells=[md.filePath for md in noRois], reason=f"No ROIs matching `{roiNamePattern}`")
+            cellMetas = [md for md in cellMetas if md not in noRois]
+        if len(cellMetas) == 0:
+            return None
+
+    policy = job.get('conflict', 'abort')
+    done, conflicts = findExistingAnalyses(cellMetas, name, marker if policy == 'incremental' else None)
+    if policy == 'skip':
+        done, conflicts = done + conflicts, []
+    if len(conflicts) > 0:
+        if policy == 'abort':
+            raise BatchError(f"{len(conflicts)} cells already have an analysis named {name}. Use a different `conflict` policy to replace them.")
+        removeAnalyses(conflicts, name)
+    if len(done) > 0:
+        output.emit('skipped', job=name, cells=[md.filePath for md in done])
+        cellMetas = [md for md in cellMetas if md not in done]
+    if len(cellMetas) == 0:
+        return None
+
+    if cameraCorrection is None:  # Use the automatic camera correction saved with the data.
+        problem = checkAutoCorrectionConsistency(cellMetas + [refMeta])
+        if problem is not None:
+            raise BatchError(problem)
+
+    key = ReferenceCache.makeKey(refMeta, cameraCorrection, binning)
+    ref = referenceCache.get(key)
+    if ref is None:
+        ref = refMeta.toDataClass()
+        if cameraCorrection is None:
+            ref.correctCameraEffects()
+        elif binning is None:
+            try:
+                ref.correctCameraEffects(cameraCorrection)
+            except ValueError:
+                raise BatchError("The binning could not be determined from the metadata. Please specify `binning` in the job file.")
+        else:
+            ref.correctCameraEffects(cameraCorrection, binning=binning)
+        referenceCache.put(key, ref)
+    logger.info(f"Initializing analysis {name}")
+    analysis = AnalysisClass(settings, erMeta, ref)
+    if singlePrecision:
+        analysis = narrowAnalysis(analysis)
+    return _PreparedJob(name, analysis, cellMetas, settings, cameraCorrection, binning, marker, job.get('output', 'full'), roiNamePattern, singlePrecision)
+
+
+def _runJobs(prepared: List[_PreparedJob], pipelineSettings: PipelineSettings, pool: Optional[WorkerPool], output: _Output):
+    """Run prepared jobs that share a camera correction together in a single pipeline."""
+    names = [p.name for p in prepared]
+    tasks = [AnalysisTask(p.analysis, p.name, p.cellMetas, p.marker, droppedFields(p.outputProfile, type(p.analysis).__name__), p.roiNamePattern,
+                          singlePrecision=p.singlePrecision) for p in prepared]
+    PipelineClass = DistributedPipeline if pipelineSettings.distributedDirectory is not None else AnalysisPipeline
+    pipeline = PipelineClass(tasks, prepared[0].cameraCorrection, prepared[0].binning, pipelineSettings, pool)
+    output.emit('start', jobs=names, total=pipeline.total, acquisitions=pipeline.numAcquisitions)
+    sTime = time.time()
+    results = pipeline.run(progressCallback=lambda completed: output.emit('progress', jobs=names, completed=completed,
+                                                                          total=pipeline.total, elapsed=round(time.time() - sTime, 3)))
+    for name, taskResults in zip(names, results):
+        for warnings, md in taskResults:
+            if md is not None:
+                for warning in warnings:
+                    output.emit('warning', job=name, cell=md.filePath, message=str(warning))
+    output.emit('finished', jobs=names, total=pipeline.total, elapsed=round(time.time() - sTime, 3),
+                utilization=[u._asdict() for u in pipeline.getUtilization()],
+                timing=[t._asdict() for t in pipeline.getTimings().summarize()],
+                peakRss=pipeline.getTimings().peakRssByWorker(),
+                write=pipeline.getWriteStats()._asdict())
+
+
+def _estimateJobs(jobs: List[dict], pipelineSettings: PipelineSettings, output: _Output):
+    """Predict the cost of each job from the metadata of its cells, without running anything."""
+    estimator = CostEstimator.fromLog(pipelineSettings.timingLog)
+    estimates = []
+    for job in jobs:
+        AnalysisClass, SettingsClass, attrName = _analysisTypes[job.get('type', 'pws')]
+        cellMetas = _findCells(job['cells'], attrName, output, job['name'])
+        estimate = estimator.estimate([(AnalysisClass.__name__, cellMetas)], pipelineSettings, pipelineSettings.getNumWorkers() > 0)
+        estimates.append(estimate)
+        output.emit('estimate', jobs=[job['name']], **estimate._asdict())
+    output.emit('estimate', jobs=[job['name'] for job in jobs], **CostEstimate.combine(estimates)._asdict())
+
+
+def runJobFile(path: str, output: _Output = None, estimateOnly: bool = False) -> bool:
+    """Run all of the jobs in a job file.
+
+    Args:
+        path: The path to the json job file.
+        output: Where to write progress. Defaults to stdout.
+        estimateOnly: If `True` then the time, memory, and disk space needed by each job is predicted rather than
+            running the jobs.
+
+    Returns:
+        `True` if all jobs succeeded.
+    """
+    logger = logging.getLogger(__name__)
+    output = output if output is not None else _Output()
+    with open(path, 'r') as f:
+        jobFile = json.load(f)
+    jsonschema.validate(jobFile, schema=_fileSchema)
+    jobs = jobFile['jobs'] if 'jobs' in jobFile else [jobFile]
+    pipelineSettings = PipelineSettings(**jobFile.get('pipeline', {}))
+    if estimateOnly:
+        _estimateJobs(jobs, pipelineSettings, output)
+        return True
+    referenceCache = ReferenceCache(int(pipelineSettings.referenceCacheGB * 1024**3))
+    numWorkers = pipelineSettings.getNumWorkers()
+    pool = WorkerPool(numWorkers) if numWorkers > 0 else None  # Shared by all jobs so that the processes are only started once.
+    success = True
+    try:
+        groups: Dict[tuple, List[_PreparedJob]] = {}
+        for job in jobs:
+            try:
+                prepared = _prepareJob(job, referenceCache, output)
+            except Exception as e:
+                logger.exception(e)
+                output.emit('error', jobs=[job['name']], message=str(e))
+                success = False
+                continue
+            if prepared is None:
+                output.emit('finished', jobs=[job['name']], total=0, elapsed=0, utilization=[])
+                continue
+            if pipelineSettings.fuseAnalyses:  # Jobs of the same type with the same camera correction can share loaded data.
+                key = (type(prepared.analysis), prepared.cameraCorrection, prepared.binning)
+            else:
+                key = (len(groups),)
+            groups.setdefault(key, []).append(prepared)
+        for group in groups.values():
+            try:
+                _runJobs(group, pipelineSettings, pool, output)
+            except Exception as e:
+                logger.exception(e)
+                output.emit('error', jobs=[p.name for p in group], message=str(e))
+                success = False
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return success
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='PWSAnalysis-batch', description="Run PWS analyses described by a json job file without the GUI.")
+    parser.add_argument('jobFile', help="The path to the json job file.")
+    parser.add_argument('--estimate', action='store_true', help="Predict the time, memory, and disk space needed by each job rather than running it.")
+    parser.add_argument('--debug', action='store_true', help="Log debug messages.")
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.debug else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        success = runJobFile(args.jobFile, estimateOnly=args.estimate)
+    except (OSError, ValueError, TypeError, jsonschema.ValidationError) as e:  # The job file couldn't be read.
+        logging.getLogger(__name__).error(f"Invalid job file: {e}")
+        sys.exit(2)
+    sys.exit(0 if success else 1)
+
+
+def workerMain():
+    """Entry point of the `PWSAnalysis-worker` command. Analyzes acquisitions queued in a shared directory by
+    distributed analyses until interrupted."""
+    parser = argparse.ArgumentParser(prog='PWSAnalysis-worker', description="Help analyze the acquisitions of distributed analyses queued in a shared directory.")
+    parser.add_argument('directory', help="The shared directory that analyses are queued in.")
+    parser.add_argument('--processes', type=int, default=PipelineSettings().getNumWorkers(), help="The number of acquisitions to analyze at once.")
+    parser.add_argument('--lease-timeout', type=float, default=PipelineSettings.leaseTimeout, help="Must match the lease timeout of the submitting computers.")
+    parser.add_argument('--map-path', action='append', default=[], metavar='FROM=TO', help="Replace the start of acquisition paths. Use if the data is mounted at a different location on this computer.")
+    parser.add_argument('--exit-when-idle', action='store_true', help="Exit once there is no work left rather than waiting for new analyses.")
+    parser.add_argument('--debug', action='store_true', help="Log debug messages.")
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.debug else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        pathMap = dict(m.split('=', 1) for m in args.map_path)
+    except ValueError:
+        parser.error("--map-path must have the form FROM=TO")
+    pool = WorkerPool(args.processes) if args.processes > 1 else None
+    worker = DistributedWorker(args.directory, numThreads=max(args.processes, 1), pool=pool, leaseTimeout=args.lease_timeout, pathMap=pathMap)
+    try:
+        worker.run(threading.Event(), exitWhenIdle=args.exit_when_idle)
+    except KeyboardInterrupt:  # Any leases we hold will expire and the acquisitions will be picked up by other workers.
+        logging.getLogger(__name__).info("Interrupted.")
+        return
+    if pool is not None:
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,7 @@ from pwspy_gui.PWSAnalysisApp.utilities.conglomeratedAnalysis import Conglomerat
     ConglomerateCompilerSettings
 if typing.TYPE_CHECKING:
     from pwspy_gui.PWSAnalysisApp._dockWidgets.AnalysisSettingsDock import AbstractRuntimeAnalysisSettings
+    from pwspy_gui.sharedWidgets.jobManager import JobManager
 
 
 class QABCMeta(sip.wrappertype, abc.ABCMeta):
@@ -77,6 +78,11 @@ class CellSelector(metaclass=QABCMeta):
         """Return the ROI manager that manages the saving and loading of ROIs"""
         pass
 
+    @abc.abstractmethod
+    def getJobManager(self) -> JobManager:
+        """Return the job manager that should be used to run long tasks in the background."""
+        pass
+
 
 class ResultsTableController(metaclass=QABCMeta):
     @abc.abstractmethod
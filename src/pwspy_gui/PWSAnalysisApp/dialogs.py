@@ -28,11 +28,16 @@ from pwspy_gui import resources
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtWidgets import (QGridLayout, QDialog,
                              QLineEdit, QPushButton, QFileDialog, QCheckBox,
-                             QMessageBox, QWidget, QVBoxLayout, QTreeWidget, QTreeWidgetItem, QApplication)
+                             QMessageBox, QWidget, QVBoxLayout, QTreeWidget, QTreeWidgetItem, QApplication,
+                             QFormLayout, QSpinBox, QDoubleSpinBox, QDialogButtonBox, QTableWidget, QTableWidgetItem, QLabel, QComboBox)
 
 import typing
 
 from pwspy_gui.PWSAnalysisApp._dockWidgets.ResultsTableDock import ConglomerateCompilerResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.analysisPipeline import PipelineSettings
+from pwspy_gui.PWSAnalysisApp._taskManagers.resultWriter import CHUNKINGS, COMPRESSIONS
+from pwspy_gui.PWSAnalysisApp._taskManagers.preview import PreviewSettings
+from pwspy_gui.PWSAnalysisApp import applicationVars
 
 if typing.TYPE_CHECKING:
     from typing import Optional, List, Tuple
@@ -40,6 +45,7 @@ if typing.TYPE_CHECKING:
     from pwspy.analysis.compilation import PWSRoiCompilationResults
     from pwspy.analysis.pws import PWSAnalysisSettings
     from pwspy.analysis.warnings import AnalysisWarning
+    from pwspy_gui.PWSAnalysisApp._taskManagers.timing import TimingRecorder
 
 
 class WorkingDirDialog(QDialog):
@@ -84,7 +90,8 @@ class WorkingDirDialog(QDialog):
 
 
 class AnalysisSummaryDisplay(QDialog):
-    def __init__(self, parent: Optional[QWidget], warnings: List[Tuple[List[AnalysisWarning], PwsMetaData]], analysisName: str = '', analysisSettings: PWSAnalysisSettings = None):
+    def __init__(self, parent: Optional[QWidget], warnings: List[Tuple[List[AnalysisWarning], PwsMetaData]], analysisName: str = '', analysisSettings: PWSAnalysisSettings = None,
+                 timing: TimingRecorder = None):
         super().__init__(parent=parent)
         self.analysisName = analysisName
         self.analysisSettings = analysisSettings
@@ -95,6 +102,10 @@ class AnalysisSummaryDisplay(QDialog):
         self.warnList.setHeaderHidden(True)
         layout.addWidget(self.settingsButton)
         layout.addWidget(self.warnList)
+        if timing is not None and len(timing.timings) > 0:
+            layout.addWidget(self._createTimingTable(timing))
+            peaks = timing.peakRssByWorker()
+            layout.addWidget(QLabel(f"Peak memory per process: {max(peaks.values()) / 1024**3:.2f} GB (max of {len(peaks)} processes)", self))
         self.setLayout(layout)
         self._addWarnings(warnings)
         self.setWindowTitle(f"Analysis Summary: {analysisName}")
@@ -109,6 +120,26 @@ class AnalysisSummaryDisplay(QDialog):
                 subItem.setText(0, warn.shortMsg)
                 subItem.setToolTip(0, warn.longMsg)
 
+    def _createTimingTable(self, timing: TimingRecorder) -> QTableWidget:
+        """A table of the time spent on each stage of the analysis. If reading or writing dominates the total time
+        the analysis is limited by the disk/network rather than the CPU."""
+        summary = timing.summarize()
+        table = QTableWidget(len(summary), 5, self)
+        table.setHorizontalHeaderLabels(["Total (s)", "Mean (s)", "Max (s)", "MB/s", "Share"])
+        table.setVerticalHeaderLabels([s.stage.capitalize() for s in summary])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        totalTime = sum(s.totalSeconds for s in summary)
+        for row, s in enumerate(summary):
+            values = [f"{s.totalSeconds:.1f}", f"{s.meanSeconds:.2f}", f"{s.maxSeconds:.2f}",
+                      f"{s.megabytesPerSecond:.0f}" if s.megabytesPerSecond is not None else '',
+                      f"{s.totalSeconds / totalTime:.0%}" if totalTime > 0 else '']
+            for col, v in enumerate(values):
+                table.setItem(row, col, QTableWidgetItem(v))
+        table.setToolTip("The time spent on each stage, summed over all cells. MB/s is the throughput of a single reader or writer.")
+        table.resizeColumnsToContents()
+        table.setMaximumHeight(table.verticalHeader().length() + table.horizontalHeader().height() + 4)
+        return table
+
     def clearWarnings(self):
         self.warnList.clear()
 
@@ -116,6 +147,184 @@ class AnalysisSummaryDisplay(QDialog):
         if self.analysisSettings is not None:
             msgBox = QMessageBox.information(self, self.analysisName, self.analysisSettings.toJsonString())
 
+class PipelineSettingsDialog(QDialog):
+    """Allows the user to set the concurrency of each stage of the analysis pipeline."""
+    timingLogPath = os.path.join(applicationVars.dataDirectory, 'analysisTiming.jsonl')
+
+    def __init__(self, parent: Optional[QWidget], settings: PipelineSettings):
+        super().__init__(parent)
+        self.setWindowTitle("Pipeline Settings")
+        layout = QFormLayout()
+        self._readers = QSpinBox(self)
+        self._readers.setRange(1, 16)
+        self._readers.setValue(settings.numReaders)
+        self._readers.setToolTip("The number of threads loading raw data from file. Increase this if reading from a slow network drive.")
+        self._workers = QSpinBox(self)
+        self._workers.setRange(0, 64)
+        self._workers.setSpecialValueText("Auto")
+        self._workers.setValue(settings.numWorkers if settings.numWorkers is not None else 0)
+        self._workers.setToolTip("The number of processes running the analysis when `Multi-Core Analysis` is enabled. `Auto` uses one less than the number of cores.")
+        self._writers = QSpinBox(self)
+        self._writers.setRange(1, 16)
+        self._writers.setValue(settings.numWriters)
+        self._writers.setToolTip("The number of threads saving analysis results to file.")
+        self._queueSize = QSpinBox(self)
+        self._queueSize.setRange(1, 32)
+        self._queueSize.setValue(settings.queueSize)
+        self._queueSize.setToolTip("The maximum number of data cubes waiting between stages. Larger values use more RAM.")
+        layout.addRow("Reader Threads:", self._readers)
+        layout.addRow("Compute Processes:", self._workers)
+        layout.addRow("Writer Threads:", self._writers)
+        self._refCache = QDoubleSpinBox(self)
+        self._refCache.setRange(0, 256)
+        self._refCache.setSingleStep(0.5)
+        self._refCache.setSuffix(" GB")
+        self._refCache.setValue(settings.referenceCacheGB)
+        self._refCache.setToolTip("The amount of RAM used to keep processed references between analyses so that analyses using the same reference don't need to reload it. 0 disables the cache.")
+        self._spill = QCheckBox(self)
+        self._spill.setChecked(settings.spillReferences)
+        self._spill.setToolTip("Save references that don't fit in the reference cache to a local disk rather than discarding them.")
+        self._fuse = QCheckBox(self)
+        self._fuse.setChecked(settings.fuseAnalyses)
+        self._fuse.setToolTip("Run queued analyses of the same type together so that each acquisition is only loaded once, rather than once per analysis.")
+        self._incremental = QCheckBox(self)
+        self._incremental.setChecked(settings.incremental)
+        self._incremental.setToolTip("Skip cells that already have a completed analysis with the same name, settings, reference and extra reflectance. Allows an interrupted batch to be resumed.")
+        self._memoryLimit = QSpinBox(self)
+        self._memoryLimit.setRange(10, 99)
+        self._memoryLimit.setSuffix(" %")
+        self._memoryLimit.setValue(int(round(settings.memoryLimit * 100)))
+        self._memoryLimit.setToolTip("The percentage of system memory that analyses may use. The number of compute processes is reduced for large data and new acquisitions are paused while memory usage is above this limit.")
+        layout.addRow("Queue Size:", self._queueSize)
+        layout.addRow("Memory Limit:", self._memoryLimit)
+        layout.addRow("Reference Cache:", self._refCache)
+        layout.addRow("Spill References To Disk:", self._spill)
+        self._stageCache = QDoubleSpinBox(self)
+        self._stageCache.setRange(0, 4096)
+        self._stageCache.setSingleStep(10)
+        self._stageCache.setSuffix(" GB")
+        self._stageCache.setSpecialValueText("Off")
+        self._stageCache.setValue(settings.stageCacheGB if settings.stageCacheDirectory is not None else 0)
+        self._stageCache.setToolTip(f"Save camera corrected data to {applicationVars.stageCacheDirectory} so that reanalyzing the same cells doesn't need to load the raw data again.\n"
+                                    f"The least recently used data is deleted once the cache reaches this size. This should be on a fast local disk.")
+        layout.addRow("Corrected Data Cache:", self._stageCache)
+        layout.addRow("Fuse Queued Analyses:", self._fuse)
+        layout.addRow("Incremental Analysis:", self._incremental)
+        self._tileSize = QSpinBox(self)
+        self._tileSize.setRange(0, 8192)
+        self._tileSize.setSingleStep(128)
+        self._tileSize.setSpecialValueText("Off")
+        self._tileSize.setSuffix(" px")
+        self._tileSize.setValue(settings.tileSize if settings.tileSize is not None else 0)
+        self._tileSize.setToolTip("Analyze each cell in square tiles of this size, keeping the data in a temporary file on disk. Use this for data that is too large to analyze in memory.")
+        self._tileOverlap = QSpinBox(self)
+        self._tileOverlap.setRange(0, 512)
+        self._tileOverlap.setSuffix(" px")
+        self._tileOverlap.setValue(settings.tileOverlap)
+        self._tileOverlap.setToolTip("The number of pixels that neighboring tiles overlap by. Only needed if the analysis uses a spatial filter.")
+        layout.addRow("Tile Size:", self._tileSize)
+        layout.addRow("Tile Overlap:", self._tileOverlap)
+        self._compression = QComboBox(self)
+        for compression in COMPRESSIONS:
+            self._compression.addItem(compression if compression is not None else "None", compression)
+        self._compression.setCurrentIndex(COMPRESSIONS.index(settings.compression))
+        self._compression.setToolTip("Compress saved results. `lzf` is fast, `gzip` compresses more but is slower. Reduces the amount of data written to slow network drives.")
+        self._compressionLevel = QSpinBox(self)
+        self._compressionLevel.setRange(0, 9)
+        self._compressionLevel.setValue(settings.compressionLevel)
+        self._compressionLevel.setToolTip("The level of `gzip` compression.")
+        self._compressionLevel.setEnabled(settings.compression == 'gzip')
+        self._compression.currentIndexChanged.connect(lambda i: self._compressionLevel.setEnabled(self._compression.itemData(i) == 'gzip'))
+        self._chunking = QComboBox(self)
+        self._chunking.addItems(CHUNKINGS)
+        self._chunking.setCurrentIndex(CHUNKINGS.index(settings.chunking))
+        self._chunking.setToolTip("The chunk layout of saved results. `plane` stores each wavelength image separately, which is fastest for loading single images. `none` is ignored if compression is used.")
+        layout.addRow("Result Compression:", self._compression)
+        layout.addRow("Compression Level:", self._compressionLevel)
+        layout.addRow("Result Chunking:", self._chunking)
+        self._distributedDir = QLineEdit(self)
+        self._distributedDir.setText(settings.distributedDirectory if settings.distributedDirectory is not None else '')
+        self._distributedDir.setPlaceholderText("Disabled")
+        self._distributedDir.setToolTip("A directory on a shared drive. If set, acquisitions are queued here so that `PWSAnalysis-worker` processes on other computers can help analyze them.")
+        browseButton = QPushButton("...", self)
+        browseButton.setMaximumWidth(30)
+        browseButton.released.connect(self._browseDistributedDir)
+        distributedLayout = QGridLayout()
+        distributedLayout.setContentsMargins(0, 0, 0, 0)
+        distributedLayout.addWidget(self._distributedDir, 0, 0)
+        distributedLayout.addWidget(browseButton, 0, 1)
+        self._leaseTimeout = QSpinBox(self)
+        self._leaseTimeout.setRange(10, 24 * 3600)
+        self._leaseTimeout.setSuffix(" s")
+        self._leaseTimeout.setValue(int(settings.leaseTimeout))
+        self._leaseTimeout.setToolTip("If a distributed worker stops responding for this long the acquisition it was working on is given to another worker. Must be longer than the time it takes to analyze one acquisition.")
+        layout.addRow("Distributed Directory:", distributedLayout)
+        layout.addRow("Lease Timeout:", self._leaseTimeout)
+        self._timingLog = QCheckBox(self)
+        self._timingLog.setChecked(settings.timingLog is not None)
+        self._timingLog.setToolTip(f"Append the time spent on each stage for each cell to {self.timingLogPath} as lines of json.")
+        layout.addRow("Write Timing Log:", self._timingLog)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, parent=self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+
+    def getSettings(self) -> PipelineSettings:
+        return PipelineSettings(numReaders=self._readers.value(),
+                                numWorkers=self._workers.value() if self._workers.value() != 0 else None,
+                                numWriters=self._writers.value(),
+                                queueSize=self._queueSize.value(),
+                                referenceCacheGB=self._refCache.value(),
+                                spillReferences=self._spill.isChecked(),
+                                fuseAnalyses=self._fuse.isChecked(),
+                                incremental=self._incremental.isChecked(),
+                                memoryLimit=self._memoryLimit.value() / 100,
+                                distributedDirectory=self._distributedDir.text() if self._distributedDir.text() != '' else None,
+                                leaseTimeout=self._leaseTimeout.value(),
+                                timingLog=self.timingLogPath if self._timingLog.isChecked() else None,
+                                tileSize=self._tileSize.value() if self._tileSize.value() != 0 else None,
+                                tileOverlap=self._tileOverlap.value(),
+                                compression=self._compression.currentData(),
+                                compressionLevel=self._compressionLevel.value(),
+                                chunking=self._chunking.currentText(),
+                                stageCacheDirectory=applicationVars.stageCacheDirectory if self._stageCache.value() != 0 else None,
+                                stageCacheGB=self._stageCache.value() if self._stageCache.value() != 0 else PipelineSettings.stageCacheGB)
+
+    def _browseDistributedDir(self):
+        directory = QFileDialog.getExistingDirectory(self, 'Distributed Directory', self._distributedDir.text())
+        if directory != '':
+            self._distributedDir.setText(directory)
+
+
+class PreviewSettingsDialog(QDialog):
+    """Allows the user to set how much the data is reduced when previewing the queued analyses."""
+    def __init__(self, parent: Optional[QWidget], settings: PreviewSettings):
+        super().__init__(parent)
+        self.setWindowTitle("Preview Settings")
+        layout = QFormLayout()
+        self._binning = QSpinBox(self)
+        self._binning.setRange(1, 32)
+        self._binning.setSuffix(" px")
+        self._binning.setValue(settings.spatialBinning)
+        self._binning.setToolTip("The raw data is averaged in square blocks of this many pixels before analysis.")
+        self._stride = QSpinBox(self)
+        self._stride.setRange(1, 16)
+        self._stride.setValue(settings.spectralStride)
+        self._stride.setToolTip("Only every nth wavelength of PWS data is analyzed. Dynamics data is not affected. Low pass "
+                                "filters above the reduced Nyquist frequency are disabled for the preview.")
+        layout.addRow("Spatial Binning:", self._binning)
+        layout.addRow("Wavelength Stride:", self._stride)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, parent=self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+
+    def getSettings(self) -> PreviewSettings:
+        return PreviewSettings(spatialBinning=self._binning.value(), spectralStride=self._stride.value())
+
+
 if __name__ == '__main__':
     _ = WorkingDirDialog()
     _.show()
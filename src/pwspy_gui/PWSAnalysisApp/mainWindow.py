@@ -26,7 +26,8 @@ import pwspy
 import pwspy_gui
 from .componentInterfaces import CellSelector, AnalysisSettingsCreator, ResultsTableController, ROIManager
 from .dialogs import WorkingDirDialog
-from ._dockWidgets import CellSelectorDock, AnalysisSettingsDock, ResultsTableControllerDock, PlottingDock
+from ._dockWidgets import CellSelectorDock, AnalysisSettingsDock, ResultsTableControllerDock, PlottingDock, JobManagerDock
+from pwspy_gui.sharedWidgets.jobManager import JobManager
 
 
 class PWSWindow(QMainWindow):
@@ -34,14 +35,17 @@ class PWSWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle(QApplication.instance().applicationName())
         self.setWindowIcon(QtGui.QIcon(os.path.join(resources, 'cellLogo.png')))
-        self.cellSelector: CellSelector = CellSelectorDock(parent=self, roiManager=roiManager)
+        self.jobManager = JobManager()
+        self.cellSelector: CellSelector = CellSelectorDock(parent=self, roiManager=roiManager, jobManager=self.jobManager)
         self.analysisSettings: AnalysisSettingsCreator = AnalysisSettingsDock(self, self.cellSelector, erManager)
         self.resultsTable: ResultsTableController = ResultsTableControllerDock(self)
         self.plots = PlottingDock(self.cellSelector)
+        self.jobs = JobManagerDock(self, self.jobManager)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.cellSelector)
         self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.plots)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.analysisSettings)
         self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.resultsTable)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.jobs)
         self.setDockOptions(QMainWindow.AnimatedDocks | QMainWindow.AllowNestedDocks | QMainWindow.AllowTabbedDocks)
 
         self.fileDialog = WorkingDirDialog(self)
@@ -55,12 +59,16 @@ class PWSWindow(QMainWindow):
         menu = menuBar.addMenu("Config")
         self.parallelAction = menu.addAction("Multi-Core Analysis (faster, needs more RAM)")
         self.parallelAction.setCheckable(True)
+        self.pipelineAction = menu.addAction("Analysis Pipeline Settings...")
+        self.previewSettingsAction = menu.addAction("Preview Settings...")
         menu = menuBar.addMenu("Actions")
         menu.setToolTipsVisible(True)
         self.blindAction = menu.addAction("Create blinded directory")
         self.blindAction.setToolTip("Creates a folder of symlinks to the selected data that is randomly numbered. "
                                     "This allows you to work on data anonymously without bias. You may need to run this "
                                     "software as `Admin` for this to work on Windows.")
+        self.estimateAction = menu.addAction("Estimate queued analyses")
+        self.estimateAction.setToolTip("Predicts the time, memory, and disk space needed to run the queued analyses based on the size of the data and the speed of previous analyses.")
         self.roiConvertAction = menu.addAction("Update ROI file formats")
         self.roiConvertAction.setToolTip("Updates old .MAT roiFile files to a newer .H5 format that will run more efficiently."
                                          " Warning: The old files will be deleted.")
@@ -72,6 +80,9 @@ class PWSWindow(QMainWindow):
         browseAction = toolBar.addAction(QtGui.QIcon(os.path.join(sharedresources, 'folder.svg')), "Set Path")
         browseAction.triggered.connect(self.fileDialog.show)
         self.runAction = toolBar.addAction(QtGui.QIcon(os.path.join(resources, 'playicon.svg')), 'Run').triggered
+        previewAction = toolBar.addAction('Preview')
+        previewAction.setToolTip("Quickly run the queued analyses at low resolution and show the results in the plotting dock. Nothing is saved to the acquisitions.")
+        self.previewAction = previewAction.triggered
         settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
         try:
             self.restoreGeometry(settings.value("geometry"))
@@ -81,6 +92,14 @@ class PWSWindow(QMainWindow):
             self._setDefaultLayout()
 
     def closeEvent(self, event):
+        if self.jobManager.isBusy():
+            ans = QMessageBox.question(self, "Jobs Running", "Some background jobs have not finished. Do you want to cancel them and quit?")
+            if ans == QMessageBox.No:
+                event.ignore()
+                return
+            self.jobManager.cancelAll()
+            for job in self.jobManager.getJobs():
+                job.thread.wait()  # Qt will crash if a QThread is destroyed while it is still running.
         settings = QtCore.QSettings("BackmanLab", "PWSAnalysis2")
         settings.setValue("geometry", self.saveGeometry())
         settings.setValue("windowState", self.saveState())
@@ -92,13 +111,14 @@ class PWSWindow(QMainWindow):
 
     def _setDefaultLayout(self):
         #remove all docks then re add them
-        docks = [self.cellSelector, self.plots, self.analysisSettings, self.resultsTable]
+        docks = [self.cellSelector, self.plots, self.analysisSettings, self.resultsTable, self.jobs]
         for dock in docks:
             self.removeDockWidget(dock)
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.cellSelector)
         self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.plots)
         #self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.resultsTable)
         self.tabifyDockWidget(self.cellSelector, self.resultsTable)
+        self.tabifyDockWidget(self.resultsTable, self.jobs)
         self.tabifyDockWidget(self.plots, self.analysisSettings)
         for dock in docks:
             dock.setFloating(False)
@@ -3,13 +3,12 @@ import re
 import typing as t_
 
 from PyQt5 import QtCore
-from PyQt5.QtCore import QThread
 from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import QDialog, QWidget, QPushButton, QLabel, QGridLayout, QLineEdit, QApplication, QFormLayout, \
     QHBoxLayout, QMessageBox
 
 from pwspy_gui.PWSAnalysisApp.componentInterfaces import ROIManager
-from pwspy_gui.sharedWidgets.dialogs import BusyDialog
+from pwspy_gui.sharedWidgets.jobManager import JobManager, JobThread
 from skimage import filters, morphology, measure
 import matplotlib.pyplot as plt
 import pwspy.dataTypes as pwsdt
@@ -33,35 +32,33 @@ class BGRoiDrawer:
     Args:
          parent: The QWidget to serve as the `parent` to the dialog boxes.
          roiManager: An object that manages saving and loading of rois within a context. If None is supplied then the ROI operations will be performed directly
+         jobManager: If supplied then the processing will be submitted to this job manager so that progress can be monitored. Otherwise the thread will be started directly.
     """
-    def __init__(self, parent: QWidget = None, roiManager: ROIManager = None):
+    def __init__(self, parent: QWidget = None, roiManager: ROIManager = None, jobManager: JobManager = None):
         self._parent = parent
         self._roiManager = roiManager
-        self._processingThread = QThread(self._parent)
+        self._jobManager = jobManager
+        self._processingThread = None
 
     def run(self, acqs: t_.Sequence[pwsdt.Acquisition]):
         analysisname = self._showDialog()
         if analysisname is None:
             return
         else:
-            self._threadException = None
-            def runInThread(acqList=acqs, anName=analysisname):
-                try:
-                    self.drawBackgroundROIs(acqList, anName)
-                except Exception as e:
-                    logging.getLogger(__name__).exception(e)
-                    self._threadException = e
+            self._processingThread = self._DrawingThread(self, acqs, analysisname)
 
             def onFinished():
-                if self._threadException is not None:
-                    QMessageBox.information(self._parent, "Error!", str(self._threadException))
-                else:
+                if self._processingThread.error is not None:
+                    QMessageBox.information(self._parent, "Error!", str(self._processingThread.error))
+                elif not self._processingThread.isCancelled():
                     QMessageBox.information(self._parent, "Finished!", "Automatic background detection is completed.")
 
-            self._processingThread.run = runInThread
-            self._processingThread.finished.connect(onFinished)
-            self._processingThread.start()
-            QMessageBox.information(self._parent, "Be patient", 'A notification will appear when automatic background detection is complete.')
+            if self._jobManager is not None:
+                self._jobManager.submit(self._processingThread, f"Auto Background ROI: {analysisname}", onFinished=lambda job: onFinished())
+            else:
+                self._processingThread.finished.connect(onFinished)
+                self._processingThread.start()
+                QMessageBox.information(self._parent, "Be patient", 'A notification will appear when automatic background detection is complete.')
 
     def _showDialog(self) -> str:
         dlg = BGROIDialog(self._parent)
@@ -71,16 +68,21 @@ class BGRoiDrawer:
         else:
             return None
 
-    def drawBackgroundROIs(self, acqs: t_.Iterable[pwsdt.Acquisition], analysisNamePattern: str):
+    def drawBackgroundROIs(self, acqs: t_.Sequence[pwsdt.Acquisition], analysisNamePattern: str, progressCallback: t_.Callable[[int], bool] = None):
         """
 
         Args:
             acqs: A list of Acquisition object to run.
             analysisNamePattern: A regex pattern of the analysis file to use for detecting background
+            progressCallback: An optional function that is called with the index of each acquisition before it is
+                processed. If it returns `False` then processing will stop.
         """
         logger = logging.getLogger(__name__)
         skipped = 0
         for i, acq in enumerate(acqs):
+            if progressCallback is not None and not progressCallback(i):
+                logger.info("Automatic background detection was cancelled.")
+                return
             try:
                 anNames = acq.pws.getAnalyses()
                 anName = [name for name in anNames if re.match(analysisNamePattern, name)][0]  # Select the first analysis name that matches the regex pattern
@@ -109,6 +111,29 @@ class BGRoiDrawer:
             else:
                 self._roiManager.createRoi(acq, roi, 'bg', 0, True)
         logger.info(f"Skipped {skipped} of {len(acqs)} acquisitions")
+        if progressCallback is not None:
+            progressCallback(len(acqs))
+
+    class _DrawingThread(JobThread):
+        """Runs `drawBackgroundROIs` in the background."""
+        def __init__(self, drawer: BGRoiDrawer, acqs: t_.Sequence[pwsdt.Acquisition], analysisNamePattern: str):
+            super().__init__(len(acqs))
+            self._drawer = drawer
+            self._acqs = acqs
+            self._analysisNamePattern = analysisNamePattern
+            self.error = None
+
+        def run(self):
+            def progress(completed: int) -> bool:
+                self.reportProgress(completed)
+                return not self.isCancelled()
+            try:
+                self._drawer.drawBackgroundROIs(self._acqs, self._analysisNamePattern, progressCallback=progress)
+            except Exception as e:
+                import traceback
+                logging.getLogger(__name__).exception(e)
+                self.error = e
+                self.errorOccurred.emit(e, traceback.format_exc())
 
 
 class BGROIDialog(QDialog):
@@ -15,6 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
 
-from .blinder import Blinder, BlinderDialog
 from .roiConverter import RoiConverter
-__all__ = ['Blinder', "BlinderDialog", 'RoiConverter', 'conglomeratedAnalysis']
+__all__ = ['Blinder', "BlinderDialog", 'RoiConverter', 'conglomeratedAnalysis', 'roiMasks']
+
+
+def __getattr__(name: str):
+    if name in ('Blinder', 'BlinderDialog'):  # Imported on first use since it requires Qt, which the other modules don't.
+        from . import blinder
+        return getattr(blinder, name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
@@ -16,15 +16,21 @@
 # along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
-from typing import List, Tuple, Optional
+import copy
+import typing
+from typing import List, Tuple, Optional, Sequence
+import numpy as np
 from pwspy.analysis import warnings
 from pwspy.analysis.dynamics import DynamicsAnalysisResults
 from pwspy.analysis.pws import PWSAnalysisResults
-from pwspy.dataTypes import RoiFile
+from pwspy.dataTypes import Roi, RoiFile
 from pwspy.analysis.compilation import (DynamicsRoiCompiler, DynamicsCompilerSettings, DynamicsRoiCompilationResults,
                                         PWSRoiCompiler, PWSCompilerSettings, PWSRoiCompilationResults,
                                         GenericRoiCompiler, GenericCompilerSettings, GenericRoiCompilationResults)
 from typing import NamedTuple
+from pwspy_gui.PWSAnalysisApp.utilities.roiMasks import boundingBox, cropRoi
+if typing.TYPE_CHECKING:
+    from pwspy.dataTypes import AnalysisManagerMetaDataBase
 """These utility classes are used to conveniently treat analysis objects of different types that belong together as a single object."""
 
 
@@ -45,6 +51,86 @@ class ConglomerateAnalysisResults(NamedTuple):
     dyn: Optional[DynamicsAnalysisResults]
 
 
+class LazyAnalysisResults:
+    """Analysis results that aren't opened from file until one of their attributes is accessed. `pwspy` reads each
+    field of saved results from the file the first time that it is accessed, so compiling only reads the datasets
+    needed by the enabled compiler settings. The reflectance cube is only read for the OPD and the mean spectra ratio.
+
+    Args:
+        md: The metadata of the acquisition.
+        analysisName: The name of the analysis.
+    """
+    def __init__(self, md: AnalysisManagerMetaDataBase, analysisName: str):
+        self._md = md
+        self._results = None
+        self.analysisName = analysisName
+
+    def __getattr__(self, name):
+        if self._results is None:
+            self._results = self._md.loadAnalysis(self.analysisName)
+        return getattr(self._results, name)
+
+    def close(self):
+        """Close the file and release any fields that have been read from it, rather than waiting for the results to
+        be garbage collected."""
+        if self._results is not None:
+            file = getattr(self._results, 'file', None)
+            self._results = None
+            if file is not None:
+                file.close()
+
+
+class _CroppedResults:
+    """Wraps analysis results so that every image-sized array, including the data of data cubes and arrays inside of
+    tuples, is cropped to `slices`. The full arrays are still only loaded once by the wrapped results, the crops are
+    views. Anything else is passed through unchanged."""
+    def __init__(self, results, shape: Tuple[int, int], slices: Tuple[slice, slice]):
+        self._results = results
+        self._shape = shape
+        self._slices = slices
+
+    def _crop(self, value):
+        if isinstance(value, np.ndarray):
+            return value[self._slices] if value.ndim >= 2 and value.shape[:2] == self._shape else value
+        elif isinstance(value, tuple) and not hasattr(value, '_fields'):
+            return tuple(self._crop(v) for v in value)
+        data = getattr(value, 'data', None)
+        if isinstance(data, np.ndarray) and data.ndim >= 2 and data.shape[:2] == self._shape:
+            value = copy.copy(value)
+            value.data = data[self._slices]
+        return value
+
+    def __getattr__(self, name):
+        return self._crop(getattr(self._results, name))
+
+
+class _RegionResults(_CroppedResults):
+    """Like `_CroppedResults`, but the 2D maps of results that were loaded from a file are read from the file for just
+    the region, as an HDF5 hyperslab, rather than reading the whole map. Each map is only read once. Data cubes (e.g. the
+    reflectance, which the OPD is calculated from) are still read in full by `pwspy` and then cropped."""
+    _MAP_FIELDS = ('meanReflectance', 'rms', 'polynomialRms', 'autoCorrelationSlope', 'rSquared', 'ld',  # PWS
+                   'rms_t_squared', 'diffusion')  # Dynamics. Each is saved as a plain dataset with the same name.
+
+    def __init__(self, results, shape: Tuple[int, int], slices: Tuple[slice, slice]):
+        super().__init__(results, shape, slices)
+        self._maps = {}
+
+    def _readMap(self, name: str) -> Optional[np.ndarray]:
+        """Returns `None` if the map can't be read directly, e.g. because the results haven't been saved."""
+        if name not in self._maps:
+            file = getattr(self._results, 'file', None)
+            dset = file.get(name) if file is not None else None
+            self._maps[name] = dset[self._slices] if dset is not None and dset.shape == self._shape else None
+        return self._maps[name]
+
+    def __getattr__(self, name):
+        if name in self._MAP_FIELDS:
+            value = self._readMap(name)
+            if value is not None:
+                return value
+        return super().__getattr__(name)
+
+
 class ConglomerateCompiler:
     """
     This convenience class combines the actions of the compilers defined in `pwspy.analysis.compilation` into a single object.
@@ -55,14 +141,59 @@ class ConglomerateCompiler:
         self.dyn = DynamicsRoiCompiler(self.settings.dyn)
         self.generic = GenericRoiCompiler(self.settings.generic)
 
-    def run(self, results: ConglomerateAnalysisResults, roiFile: RoiFile) -> Tuple[ConglomerateCompilerResults, List[warnings.AnalysisWarning]]:
+    def run(self, results: ConglomerateAnalysisResults, roiFile: RoiFile, roi: Optional[Roi] = None) -> Tuple[ConglomerateCompilerResults, List[warnings.AnalysisWarning]]:
+        """Compile a single ROI.
+
+        Args:
+            results: The analysis results to compile.
+            roiFile: The ROI to compile.
+            roi: If not `None` then this is used instead of loading the ROI from `roiFile`, e.g. because the mask had
+                to be cropped to match the results.
+        """
+        roi = roi if roi is not None else roiFile.getRoi()
         if results.pws is not None:
-            pwsResults, pwsWarnings = self.pws.run(results.pws, roiFile.getRoi())
+            pwsResults, pwsWarnings = self.pws.run(results.pws, roi)
         else:
             pwsResults, pwsWarnings = None, []
         if results.dyn is not None:
-            dynResults, dynWarnings = self.dyn.run(results.dyn, roiFile.getRoi())
+            dynResults, dynWarnings = self.dyn.run(results.dyn, roi)
         else:
             dynResults, dynWarnings = None, []
         genResults = self.generic.run(roiFile)
         return ConglomerateCompilerResults(pwsResults, dynResults, genResults), pwsWarnings + dynWarnings
+
+    def runBatch(self, results: ConglomerateAnalysisResults, roiFiles: Sequence[RoiFile],
+                 rois: Optional[Sequence[Roi]] = None) -> List[Tuple[ConglomerateCompilerResults, List[warnings.AnalysisWarning]]]:
+        """Compile many ROIs of the same acquisition. Gives the same results as calling `run` for each ROI, but the
+        analysis results are cropped to the bounding box of each ROI before it is compiled. Without cropping every ROI
+        masks the full-sized maps, so the cost grows with the number of ROIs times the size of the image rather than
+        with the total area of the ROIs. For results saved to file only the combined bounding box of all of the ROIs
+        is read from each map.
+
+        Args:
+            results: The analysis results to compile.
+            roiFiles: The ROIs to compile.
+            rois: If not `None` then these are used instead of loading the ROIs from `roiFiles`.
+
+        Returns:
+            The compiled results and warnings of each ROI.
+        """
+        rois = rois if rois is not None else [roiFile.getRoi() for roiFile in roiFiles]
+        boxes = [boundingBox(roi.mask) for roi in rois]
+        nonEmpty = [box for box in boxes if box is not None]
+        if len(nonEmpty) > 0:
+            region = (slice(min(box[0].start for box in nonEmpty), max(box[0].stop for box in nonEmpty)),
+                      slice(min(box[1].start for box in nonEmpty), max(box[1].stop for box in nonEmpty)))
+            regionShape = (region[0].stop - region[0].start, region[1].stop - region[1].start)
+            shape = rois[boxes.index(nonEmpty[0])].mask.shape[:2]
+            regionResults = [_RegionResults(r, shape, region) if r is not None else None for r in results]
+        ret = []
+        for roiFile, roi, box in zip(roiFiles, rois, boxes):
+            if box is None:  # An empty ROI, nothing to crop to.
+                ret.append(self.run(results, roiFile, roi))
+                continue
+            inRegion = (slice(box[0].start - region[0].start, box[0].stop - region[0].start),
+                        slice(box[1].start - region[1].start, box[1].stop - region[1].start))
+            cropped = ConglomerateAnalysisResults(*[_CroppedResults(r, regionShape, inRegion) if r is not None else None for r in regionResults])
+            ret.append(self.run(cropped, roiFile, cropRoi(roi, box)))
+        return ret
@@ -0,0 +1,45 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Helpers for cropping ROI masks to the region of an image that was analyzed or compiled.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import copy
+import typing
+from typing import Optional, Tuple
+import numpy as np
+if typing.TYPE_CHECKING:
+    import pwspy.dataTypes as pwsdt
+
+
+def boundingBox(mask: np.ndarray) -> Optional[Tuple[slice, slice]]:
+    """The rows and columns of the smallest rectangle containing all of the `True` pixels of `mask`. `None` if there
+    aren't any."""
+    rows, cols = np.where(mask.any(axis=1))[0], np.where(mask.any(axis=0))[0]
+    if len(rows) == 0:
+        return None
+    return slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1)
+
+
+def cropRoi(roi: pwsdt.Roi, slices: Tuple[slice, slice]) -> pwsdt.Roi:
+    """Create a copy of an ROI with its mask cropped to `slices`, to match results that were cropped the same way."""
+    roi = copy.copy(roi)
+    roi.mask = roi.mask[slices]
+    return roi
@@ -26,7 +26,7 @@ from typing import List
 
 import pandas
 
-from pwspy_gui.sharedWidgets.extraReflectionManager.ERIndex import ERIndex, ERIndexCube
+from pwspy_gui.extraReflectionDirectory.ERIndex import ERIndex, ERIndexCube
 from pwspy.dataTypes import ERMetaData
 import typing
 if typing.TYPE_CHECKING:
@@ -23,7 +23,7 @@ import pandas
 import typing
 if typing.TYPE_CHECKING:
     from pwspy_gui.sharedWidgets.extraReflectionManager import ERDownloader
-from pwspy_gui.sharedWidgets.extraReflectionManager._ERDataDirectory import ERDataDirectory, EROnlineDirectory, ERAbstractDirectory
+from pwspy_gui.extraReflectionDirectory import ERDataDirectory, EROnlineDirectory, ERAbstractDirectory
 from enum import Enum
 
 
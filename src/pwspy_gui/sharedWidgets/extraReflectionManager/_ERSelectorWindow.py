@@ -35,7 +35,7 @@ from mpl_qt_viz.visualizers import PlotNd
 
 if typing.TYPE_CHECKING:
     from pwspy_gui.sharedWidgets.extraReflectionManager import ERManager
-    from pwspy_gui.sharedWidgets.extraReflectionManager.ERIndex import ERIndexCube
+    from pwspy_gui.extraReflectionDirectory.ERIndex import ERIndexCube
 
 
 class ERTreeWidgetItem(QTreeWidgetItem):
@@ -160,8 +160,8 @@ class ERSelectorWindow(QDialog):
         try :
             for item in self._items:
                 if item.isChecked() and not item.downloaded:
-                    # If it is checked then it should be downloaded
-                    self._manager.download(item.fileName, parentWidget=self)
+                    # If it is checked then it should be downloaded. If the manager has a job manager this will run in the background.
+                    self._manager.download(item.fileName, parentWidget=self, background=True, onFinished=self._initialize)
         except OfflineError as e:
             QMessageBox.information(self, "OfflineMode", "Sorry, for obvious reasons you can't download extra reflection calibration files when running in offline mode.")
         self._initialize()
@@ -30,8 +30,8 @@ import pandas as pd
 import typing
 import numpy as np
 
-from pwspy_gui.sharedWidgets.extraReflectionManager.ERIndex import ERIndex
-from pwspy_gui.sharedWidgets.extraReflectionManager._ERDataDirectory import ERDataDirectory
+from pwspy_gui.extraReflectionDirectory.ERIndex import ERIndex
+from pwspy_gui.extraReflectionDirectory import ERDataDirectory
 from pwspy_gui.sharedWidgets.extraReflectionManager.ERDataComparator import ERDataComparator
 from pwspy.dataTypes import ExtraReflectanceCube
 from mpl_qt_viz.visualizers import PlotNd
@@ -35,14 +35,16 @@ from google.auth.exceptions import TransportError
 from pwspy.dataTypes import ERMetaData
 from pwspy_gui.PWSAnalysisApp import applicationVars
 from pwspy_gui.sharedWidgets.dialogs import BusyDialog
+from pwspy_gui.sharedWidgets.jobManager import JobThread
 from pwspy_gui.sharedWidgets.extraReflectionManager.ERDataComparator import ERDataComparator
-from pwspy_gui.sharedWidgets.extraReflectionManager._ERDataDirectory import ERDataDirectory, EROnlineDirectory
+from pwspy_gui.extraReflectionDirectory import ERDataDirectory, EROnlineDirectory
 from ._ERSelectorWindow import ERSelectorWindow
 from ._ERUploaderWindow import ERUploaderWindow
 from .exceptions import OfflineError
 
 if typing.TYPE_CHECKING:
     from google.oauth2.credentials import Credentials
+    from pwspy_gui.sharedWidgets.jobManager import JobManager
 
 
 def _offlineDecorator(func):
@@ -67,6 +69,7 @@ class ERManager:
     """
     def __init__(self, filePath: str, parentWidget: QWidget = None):
         self._directory = filePath
+        self._jobManager: Optional[JobManager] = None
         self.offlineMode, self._downloader = self._logIn(parentWidget)
 
         indexPath = os.path.join(self._directory, 'index.json')
@@ -117,11 +120,25 @@ class ERManager:
     def createManagerWindow(self, parent: QWidget):
         return ERUploaderWindow(self, parent)
 
+    def setJobManager(self, jobManager: Optional[JobManager]):
+        """If a `JobManager` is set then downloads requested with `background=True` will be submitted to it rather than
+        blocking the screen until they are done."""
+        self._jobManager = jobManager
+
     @_offlineDecorator
-    def download(self, fileName: str, parentWidget: Optional[QWidget] = None):
+    def download(self, fileName: str, parentWidget: Optional[QWidget] = None, background: bool = False, onFinished: typing.Callable[[], None] = None):
         """Begin downloading `fileName` in a separate thread. Use the main thread to update a progress bar.
-        If directory is left blank then file will be downloaded to the ERManager main directory"""
-        self._downloader.download(fileName, self._directory, parentWidget)
+        If directory is left blank then file will be downloaded to the ERManager main directory
+
+        Args:
+            fileName: The name of the file to download.
+            parentWidget: The widget to act as the parent of any dialogs that are opened.
+            background: If `True` and a job manager has been set with `setJobManager` then the download will be run in
+                the background rather than blocking the screen.
+            onFinished: An optional function that will be called once the download is done.
+        """
+        jobManager = self._jobManager if background else None
+        self._downloader.download(fileName, self._directory, parentWidget, jobManager=jobManager, onFinished=onFinished)
 
     @_offlineDecorator
     def upload(self, fileName: str):
@@ -140,16 +157,26 @@ class ERDownloader:
     def __init__(self, authPath: str):
         self._downloader = _QtGoogleDriveDownloader(authPath)
 
-    def download(self, fileName: str, directory: str, parentWidget: Optional[QWidget] = None):
-        """Begin downloading `fileName` in a separate thread. Use the main thread to update a progress bar.
+    def download(self, fileName: str, directory: str, parentWidget: Optional[QWidget] = None, jobManager: Optional[JobManager] = None, onFinished: typing.Callable[[], None] = None):
+        """Begin downloading `fileName` in a separate thread. If `jobManager` is provided then the download is
+        submitted to it and this method returns immediately, otherwise a progress bar blocks the screen until the
+        download is done.
         If directory is left blank then file will be downloaded to the ERManager main directory"""
         t = self._DownloadThread(self._downloader, fileName, directory)
-        b = BusyDialog(parentWidget, f"Downloading {fileName}. Please Wait...", progressBar=True)  # This dialog blocks the screen until the download thread is completed.
-        t.finished.connect(b.accept)  # When the thread finishes, close the busy dialog.
-        self._downloader.progress.connect(b.setProgress)  # Progress from the downloader updates a progress bar on the busy dialog.
-        t.errorOccurred.connect(lambda e: QMessageBox.information(parentWidget, 'Error in Drive Downloader Thread', str(e)))
-        t.start()
-        b.exec()
+        t.errorOccurred.connect(lambda e, trace: QMessageBox.information(parentWidget, 'Error in Drive Downloader Thread', str(e)))
+        if jobManager is not None:
+            t.started.connect(lambda: self._downloader.progress.connect(t.reportProgress))
+            t.finished.connect(lambda: self._downloader.progress.disconnect(t.reportProgress))
+            jobManager.submit(t, f"Download: {fileName}", onFinished=(lambda job: onFinished()) if onFinished else None, unitName='%')
+        else:
+            b = BusyDialog(parentWidget, f"Downloading {fileName}. Please Wait...", progressBar=True)  # This dialog blocks the screen until the download thread is completed.
+            t.finished.connect(b.accept)  # When the thread finishes, close the busy dialog.
+            self._downloader.progress.connect(b.setProgress)  # Progress from the downloader updates a progress bar on the busy dialog.
+            t.start()
+            b.exec()
+            self._downloader.progress.disconnect(b.setProgress)
+            if onFinished:
+                onFinished()
 
     def downloadToRam(self, fileName: str, stream: IOBase) -> IOBase:
         """Download a file directly to a stream in ram rather than saving to file, best for small temporary files.
@@ -182,12 +209,10 @@ class ERDownloader:
     def getCredentials(authPath: str):
         return GoogleDriveDownloader.getCredentials(authPath)
 
-    class _DownloadThread(QThread):
-        """A QThread to download from google drive"""
-        errorOccurred = QtCore.pyqtSignal(Exception)  # If an exception occurs it can be passed to another thread with this signal
-
+    class _DownloadThread(JobThread):
+        """A QThread to download from google drive. Progress is reported as a percentage."""
         def __init__(self, downloader: GoogleDriveDownloader, fileName: str, directory: str):
-            super().__init__()
+            super().__init__(100)
             self.downloader = downloader
             self.fileName = fileName
             self.directory = directory
@@ -202,7 +227,12 @@ class ERDownloader:
                 with open(os.path.join(self.directory, self.fileName), 'wb') as f:
                     self.downloader.downloadFile(fileId, f)
             except Exception as e:
-                self.errorOccurred.emit(e)
+                import traceback
+                self.errorOccurred.emit(e, traceback.format_exc())
+
+        def cancel(self):
+            """A download can't be interrupted once it has started."""
+            pass
 
 
 class GoogleDriveDownloader:
@@ -0,0 +1,237 @@
+# Copyright 2018-2020 Nick Anthony, Backman Biophotonics Lab, Northwestern University
+#
+# This file is part of PWSpy.
+#
+# PWSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PWSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PWSpy.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Support for running long tasks (analyses, compilations, downloads, etc.) in the background without blocking the GUI.
+
+A task is implemented as a subclass of `JobThread` and is then handed to a `JobManager` which queues it and starts it
+once fewer than `maxConcurrent` jobs are running.
+
+@author: Nick Anthony
+"""
+from __future__ import annotations
+import enum
+import logging
+import time
+import typing
+from PyQt5 import QtCore
+from PyQt5.QtCore import QThread, QObject
+
+
+class JobThread(QThread):
+    """Base class for a background task that can be managed by the `JobManager`.
+
+    Subclasses should implement `run` and should call `reportProgress` each time a unit of work (usually a single
+    acquisition) is completed. Long running loops should check `isCancelled` and return early if it is `True`.
+
+    Args:
+        total: The number of units of work (usually cells) that this job will process.
+    """
+    progressed = QtCore.pyqtSignal(int, int)  # Number of completed units of work, total units of work.
+    errorOccurred = QtCore.pyqtSignal(Exception, str)  # The exception and the formatted traceback.
+    messageChanged = QtCore.pyqtSignal(str)  # Additional information about the job, e.g. performance statistics.
+
+    def __init__(self, total: int):
+        super().__init__()
+        self.total = total
+        self._cancelled = False
+
+    def cancel(self):
+        """Request that the job stop. It is up to the `run` method of the subclass to respect this request."""
+        self._cancelled = True
+
+    def isCancelled(self) -> bool:
+        return self._cancelled
+
+    def reportProgress(self, completed: int):
+        self.progressed.emit(completed, self.total)
+
+    def reportMessage(self, message: str):
+        self.messageChanged.emit(message)
+
+
+class Job(QObject):
+    """Keeps track of the state of a `JobThread` that has been submitted to the `JobManager`.
+
+    Args:
+        name: A human readable name for the job.
+        thread: The thread that does the work.
+        unitName: The name of a unit of work, used for display. E.g. "cells".
+    """
+    changed = QtCore.pyqtSignal()
+    finished = QtCore.pyqtSignal(object)  # Passes a reference to this Job. Fired from the main thread.
+
+    class Status(enum.Enum):
+        Queued = "Queued"
+        Running = "Running"
+        Cancelling = "Cancelling"
+        Cancelled = "Cancelled"
+        Failed = "Failed"
+        Finished = "Finished"
+
+    def __init__(self, name: str, thread: JobThread, unitName: str = 'cells'):
+        super().__init__()
+        self.name = name
+        self.thread = thread
+        self.unitName = unitName
+        self.status = Job.Status.Queued
+        self.completed = 0
+        self.total = thread.total
+        self.startTime: typing.Optional[float] = None
+        self.endTime: typing.Optional[float] = None
+        self.error: typing.Optional[Exception] = None
+        self.message = ''
+        self.thread.progressed.connect(self._progressed)
+        self.thread.messageChanged.connect(self._messageChanged)
+        self.thread.errorOccurred.connect(self._errorOccurred)
+        self.thread.finished.connect(self._threadFinished)
+
+    def isDone(self) -> bool:
+        return self.status in (Job.Status.Cancelled, Job.Status.Failed, Job.Status.Finished)
+
+    def elapsed(self) -> float:
+        """The number of seconds that the job has been running for."""
+        if self.startTime is None:
+            return 0
+        end = self.endTime if self.endTime is not None else time.time()
+        return end - self.startTime
+
+    def throughput(self) -> typing.Optional[float]:
+        """The number of units of work completed per minute. `None` if this can't be estimated yet."""
+        elapsed = self.elapsed()
+        if self.completed == 0 or elapsed == 0:
+            return None
+        return self.completed / (elapsed / 60)
+
+    def eta(self) -> typing.Optional[float]:
+        """The estimated number of seconds until the job is completed. `None` if this can't be estimated yet."""
+        rate = self.throughput()
+        if rate is None or self.isDone():
+            return None
+        return (self.total - self.completed) / rate * 60
+
+    def _start(self):
+        self.status = Job.Status.Running
+        self.startTime = time.time()
+        self.thread.start()
+        self.changed.emit()
+
+    def _cancel(self):
+        if self.status == Job.Status.Queued:
+            self.status = Job.Status.Cancelled
+            self.changed.emit()
+            self.finished.emit(self)
+        elif self.status == Job.Status.Running:
+            self.status = Job.Status.Cancelling
+            self.thread.cancel()
+            self.changed.emit()
+
+    def _progressed(self, completed: int, total: int):
+        self.completed = completed
+        self.total = total
+        self.changed.emit()
+
+    def _messageChanged(self, message: str):
+        self.message = message
+        self.changed.emit()
+
+    def _errorOccurred(self, e: Exception, trace: str):
+        logging.getLogger(__name__).warning(f"Error in job {self.name}:\n{trace}")
+        self.error = e
+
+    def _threadFinished(self):
+        self.endTime = time.time()
+        if self.error is not None:
+            self.status = Job.Status.Failed
+        elif self.thread.isCancelled():
+            self.status = Job.Status.Cancelled
+        else:
+            self.status = Job.Status.Finished
+        self.changed.emit()
+        self.finished.emit(self)
+
+
+class JobManager(QObject):
+    """Queues `JobThread`s and runs them in the background, never running more than `maxConcurrent` at once.
+
+    Args:
+        maxConcurrent: The maximum number of jobs that can run at the same time.
+    """
+    jobAdded = QtCore.pyqtSignal(object)  # A `Job` was submitted
+    jobRemoved = QtCore.pyqtSignal(object)  # A `Job` was removed from the list of jobs
+
+    def __init__(self, maxConcurrent: int = 1):
+        super().__init__()
+        self._maxConcurrent = maxConcurrent
+        self._jobs: typing.List[Job] = []
+
+    def submit(self, thread: JobThread, name: str, onFinished: typing.Callable[[Job], None] = None, unitName: str = 'cells') -> Job:
+        """Add a job to the queue.
+
+        Args:
+            thread: The thread that will run the task.
+            name: A human readable name for the job.
+            onFinished: A function that will be called in the main thread when the job is done (finished, failed, or cancelled)
+            unitName: The name of a unit of work, used for display.
+
+        Returns:
+            The `Job` object used to track the status of the task.
+        """
+        job = Job(name, thread, unitName)
+        if onFinished is not None:
+            job.finished.connect(onFinished)
+        job.finished.connect(lambda j: self._startPending())
+        self._jobs.append(job)
+        self.jobAdded.emit(job)
+        self._startPending()
+        return job
+
+    def cancel(self, job: Job):
+        job._cancel()
+
+    def cancelAll(self):
+        for job in self._jobs:
+            job._cancel()
+
+    def getJobs(self) -> typing.List[Job]:
+        return list(self._jobs)
+
+    def clearFinished(self):
+        """Remove all jobs that are done from the list of jobs."""
+        for job in [j for j in self._jobs if j.isDone()]:
+            self._jobs.remove(job)
+            self.jobRemoved.emit(job)
+
+    def isBusy(self) -> bool:
+        return any(not j.isDone() for j in self._jobs)
+
+    @property
+    def maxConcurrent(self) -> int:
+        return self._maxConcurrent
+
+    def setMaxConcurrent(self, num: int):
+        self._maxConcurrent = max(1, num)
+        self._startPending()
+
+    def _startPending(self):
+        running = len([j for j in self._jobs if j.status in (Job.Status.Running, Job.Status.Cancelling)])
+        for job in self._jobs:
+            if running >= self._maxConcurrent:
+                break
+            if job.status == Job.Status.Queued:
+                job._start()
+                running += 1
@@ -0,0 +1,18 @@
+"""Checks that the batch command line tool can run on a machine without Qt."""
+import os
+import subprocess
+import sys
+import pytest
+
+pytest.importorskip('pwspy')
+import pwspy_gui
+
+
+def test_importWithoutQt():
+    code = ("import sys\n"
+            "for name in ('PyQt5', 'googleapiclient'):\n"
+            "    sys.modules[name] = None  # Any import of these raises an `ImportError`.\n"
+            "import pwspy_gui.PWSAnalysisApp.batch\n")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(pwspy_gui.__file__)), os.environ.get('PYTHONPATH', '')]))
+    proc = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
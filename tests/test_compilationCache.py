@@ -0,0 +1,32 @@
+"""Checks that saving the compilation cache merges concurrent updates and removes entries whose files are gone."""
+import os
+from types import SimpleNamespace
+from pwspy_gui.PWSAnalysisApp._taskManagers.compilationCache import CompilationCache, makeStamp
+
+
+def _entries(tmp_path, name: str) -> dict:
+    roiPath = tmp_path / f"{name}.h5"
+    roiPath.write_bytes(b'roi')
+    key = (None, None, str(roiPath), 'nucleus', 1, 'settings')
+    return {key: (makeStamp(key), (name, []))}
+
+
+def test_concurrentSavesAreMerged(tmp_path):
+    first, second = CompilationCache(str(tmp_path)), CompilationCache(str(tmp_path))  # Both load the cache before either saves.
+    first.update(SimpleNamespace(filePath='Cell1'), _entries(tmp_path, 'a'))
+    second.update(SimpleNamespace(filePath='Cell2'), _entries(tmp_path, 'b'))
+    first.save()
+    second.save()
+    cache = CompilationCache(str(tmp_path))
+    assert len(cache.get(SimpleNamespace(filePath='Cell1'))) == 1
+    assert len(cache.get(SimpleNamespace(filePath='Cell2'))) == 1
+    assert not os.path.exists(f"{cache.path}.lock")
+
+
+def test_staleEntriesArePruned(tmp_path):
+    cache = CompilationCache(str(tmp_path))
+    entries = _entries(tmp_path, 'a')
+    cache.update(SimpleNamespace(filePath='Cell1'), {**entries, **_entries(tmp_path, 'b')})
+    os.remove(tmp_path / 'b.h5')
+    cache.save()
+    assert CompilationCache(str(tmp_path)).get(SimpleNamespace(filePath='Cell1')) == entries
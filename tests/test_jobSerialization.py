@@ -0,0 +1,46 @@
+"""Checks that the analyses of distributed jobs can be saved without pickle and still give the same results."""
+import copy
+import pytest
+
+pws = pytest.importorskip('pwspy.analysis.pws')
+pwsdt = pytest.importorskip('pwspy.dataTypes')
+import numpy as np
+from pwspy_gui.PWSAnalysisApp._taskManagers import jobSerialization
+from pwspy_gui.PWSAnalysisApp._taskManagers.completionMarker import CompletionMarker
+
+
+def _makeCube(rng: np.random.Generator, signal: np.ndarray, wavelengths: np.ndarray) -> pwsdt.PwsCube:
+    md = pwsdt.PwsMetaData({'system': 'test', 'time': '01-01-2020 00:00:00', 'exposure': 100.0, 'pixelSizeUm': None,
+                            'binning': 1, 'wavelengths': list(wavelengths)})
+    return pwsdt.PwsCube(rng.poisson(signal).astype(np.float32), md)
+
+
+def test_analysisRoundTrip(tmp_path):
+    rng = np.random.default_rng(0)
+    wavelengths = np.arange(500, 702, 2)
+    ref = _makeCube(rng, np.full((16, 16, len(wavelengths)), 5000.0), wavelengths)
+    cell = _makeCube(rng, rng.uniform(1000, 3000, (16, 16, len(wavelengths))), wavelengths)
+    settings = copy.copy(pws.PWSAnalysisSettings.loadDefaultSettings("Recommended"))
+    settings.cameraCorrection = pwsdt.CameraCorrection(100, (1.0, 1e-5))
+    analysis = pws.PWSAnalysis(settings, None, ref)
+    context = {'analyses': [analysis, analysis], 'markers': [CompletionMarker.create(settings, ref.metadata, None), None],
+               'dropFields': [('reflectance',), ()]}
+    loaded = jobSerialization.loads(jobSerialization.dumps(context, str(tmp_path)), str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1  # The reference shared by both analyses is only saved once.
+    assert loaded['markers'] == context['markers'] and loaded['dropFields'] == context['dropFields']
+    assert loaded['analyses'][0].settings == settings
+    expected, _ = analysis.run(copy.deepcopy(cell))
+    results, _ = loaded['analyses'][0].run(copy.deepcopy(cell))
+    np.testing.assert_array_equal(results.rms, expected.rms)
+
+
+@pytest.mark.parametrize('s', ['{"object": "os.system", "vars": {}}', '{"enum": "subprocess.Popen", "name": "x"}',
+                               '{"array": "../secret.npy"}'])
+def test_rejectsUnknownItems(s, tmp_path):
+    with pytest.raises(jobSerialization.SerializationError):
+        jobSerialization.loads(s, str(tmp_path))
+
+
+def test_rejectsObjectArrays(tmp_path):
+    with pytest.raises(ValueError):
+        jobSerialization.dumps(np.array([object()]), str(tmp_path))
@@ -0,0 +1,28 @@
+"""Checks which results fields are dropped by each output profile for each type of analysis."""
+import pytest
+from pwspy_gui.PWSAnalysisApp._taskManagers.outputProfile import DEPRECATED_PROFILES, OUTPUT_PROFILES, droppedFields
+
+_ANALYSIS_TYPES = ('PWSAnalysis', 'DynamicsAnalysis')
+
+
+@pytest.mark.parametrize('profile, analysisType, expected', [('maps', 'PWSAnalysis', ('reflectance',)),
+                                                             ('full', 'PWSAnalysis', ()),
+                                                             ('mapsOpd', 'PWSAnalysis', ()),  # The OPD is calculated from the reflectance.
+                                                             ('maps', 'DynamicsAnalysis', ('reflectance',)),
+                                                             ('full', 'DynamicsAnalysis', ()),
+                                                             ('mapsOpd', 'DynamicsAnalysis', ('reflectance',))])
+def test_droppedFields(profile, analysisType, expected):
+    assert droppedFields(profile, analysisType) == expected
+
+
+@pytest.mark.parametrize('analysisType', _ANALYSIS_TYPES)
+def test_profilesAreDistinct(analysisType):
+    """Every profile that can be selected saves something different."""
+    dropped = [droppedFields(profile, analysisType) for profile in OUTPUT_PROFILES]
+    assert len(set(dropped)) == len(OUTPUT_PROFILES)
+    assert all(p not in OUTPUT_PROFILES for p in DEPRECATED_PROFILES)
+
+
+def test_unknownProfile():
+    with pytest.raises(ValueError):
+        droppedFields('opdOnly', 'PWSAnalysis')
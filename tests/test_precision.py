@@ -0,0 +1,76 @@
+"""Checks that a PWS analysis run in single precision matches the same analysis run in double precision."""
+import copy
+import pytest
+
+pws = pytest.importorskip('pwspy.analysis.pws')
+pwsdt = pytest.importorskip('pwspy.dataTypes')
+import numpy as np
+from pwspy_gui.PWSAnalysisApp._taskManagers.precision import DTYPE, narrowAnalysis, narrowResults
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import analyzeCube
+
+
+def _makeCube(rng: np.random.Generator, signal: np.ndarray, wavelengths: np.ndarray, cameraCorrected: bool = True) -> pwsdt.PwsCube:
+    md = pwsdt.PwsMetaData({'system': 'test', 'time': '01-01-2020 00:00:00', 'exposure': 100.0, 'pixelSizeUm': None,
+                            'binning': None, 'wavelengths': list(wavelengths)})
+    status = pwsdt.PwsCube.ProcessingStatus(cameraCorrected=cameraCorrected)
+    return pwsdt.PwsCube(rng.poisson(signal).astype(np.float32), md, processingStatus=status)
+
+
+def _widen(cube: pwsdt.PwsCube) -> pwsdt.PwsCube:
+    cube = copy.deepcopy(cube)
+    cube.data = cube.data.astype(np.float64)
+    return cube
+
+
+@pytest.fixture(scope='module')
+def results():
+    rng = np.random.default_rng(0)
+    wavelengths = np.arange(500, 702, 2)
+    spectrum = 1 + 0.1 * np.sin(wavelengths / 7)
+    ref = _makeCube(rng, np.full((32, 32, len(wavelengths)), 5000.0) * spectrum, wavelengths)
+    cell = _makeCube(rng, rng.uniform(1000, 3000, (32, 32, 1)) * spectrum * (1 + 0.05 * rng.standard_normal((32, 32, len(wavelengths)))), wavelengths)
+    settings = pws.PWSAnalysisSettings.loadDefaultSettings("Recommended")
+    settings = copy.copy(settings)
+    settings.referenceMaterial = None  # The theoretical reflectance isn't needed to compare precisions.
+    settings.skipAdvanced = False
+    analysis = pws.PWSAnalysis(settings, None, ref)
+    analysis.ref = _widen(analysis.ref)
+    double, _ = analysis.run(_widen(cell))
+    single, _ = narrowAnalysis(analysis).run(copy.deepcopy(cell))
+    narrowResults(single)
+    return double, single
+
+
+@pytest.mark.parametrize('field, rtol', [('rms', 1e-6), ('meanReflectance', 1e-6),
+                                         ('autoCorrelationSlope', 1e-4), ('ld', 1e-4)])  # The slope of the autocorrelation amplifies rounding errors.
+def test_singleMatchesDouble(results, field, rtol):
+    double, single = results
+    assert getattr(single, field).dtype == DTYPE
+    np.testing.assert_allclose(getattr(single, field), getattr(double, field), rtol=rtol)
+
+
+def test_polynomialRms(results):
+    double, single = results
+    np.testing.assert_allclose(single.polynomialRms, double.polynomialRms, rtol=1e-4, atol=1e-5 * double.rms.max())  # Often close to zero.
+
+
+def test_uncorrectedCube():
+    """Correcting the camera effects with a linearity polynomial makes the raw data 64-bit. It should be converted back
+    before the analysis."""
+    rng = np.random.default_rng(1)
+    wavelengths = np.arange(500, 702, 2)
+    cameraCorrection = pwsdt.CameraCorrection(100, (1.0, 1e-6))
+    ref = _makeCube(rng, np.full((16, 16, len(wavelengths)), 5000.0), wavelengths, cameraCorrected=False)
+    ref.correctCameraEffects(cameraCorrection, binning=1)
+    assert ref.data.dtype == np.float64
+    cell = _makeCube(rng, rng.uniform(1000, 3000, (16, 16, len(wavelengths))), wavelengths, cameraCorrected=False)
+    settings = copy.copy(pws.PWSAnalysisSettings.loadDefaultSettings("Recommended"))
+    settings.referenceMaterial = None
+    settings.skipAdvanced = False
+    analysis = narrowAnalysis(pws.PWSAnalysis(settings, None, ref))
+    (results, warnings), = analyzeCube(cell, [analysis], cameraCorrection, userSpecifiedBinning=1, singlePrecision=[True])
+    assert cell.data.dtype == DTYPE  # The last analysis processes the cube in place.
+    for field in ('reflectance', 'meanReflectance', 'rms', 'polynomialRms', 'autoCorrelationSlope', 'rSquared', 'ld'):
+        value = getattr(results, field)
+        value = value if isinstance(value, np.ndarray) else value.data  # The reflectance is a `KCube`.
+        assert value.dtype == DTYPE, field
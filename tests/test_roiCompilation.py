@@ -0,0 +1,24 @@
+"""Checks that ROIs compiled during analysis are saved atomically and that unreadable files count as out of date."""
+import os
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('pwspy.analysis')
+from pwspy_gui.PWSAnalysisApp._taskManagers import roiCompilation
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiCompilation import CompiledRois, getPath, saveCompiled
+
+
+def test_saveCompiled(tmp_path):
+    md = SimpleNamespace(filePath=str(tmp_path))
+    compiled = CompiledRois('settings', {('nucleus', 1): (1, 2)}, [])
+    saveCompiled(md, 'analysis', compiled)
+    assert os.listdir(tmp_path) == [os.path.basename(getPath(md, 'analysis'))]  # No partial file is left behind.
+    assert roiCompilation._loadFile(getPath(md, 'analysis')) == compiled
+
+
+def test_unreadableIsStale(tmp_path):
+    md = SimpleNamespace(filePath=str(tmp_path))
+    with open(getPath(md, 'analysis'), 'wb') as f:
+        f.write(b'not a pickle')
+    compiled, stale = roiCompilation._loadMeta(md, '.*', 'settings', {('nucleus', 1): (1, 2), ('nucleus', 2): (3, 4)})
+    assert compiled == {} and stale == 2
@@ -0,0 +1,35 @@
+"""Checks the keys and the eviction of the cache of camera corrected cubes."""
+import os
+from types import SimpleNamespace
+import pytest
+
+pwsdt = pytest.importorskip('pwspy.dataTypes')
+import numpy as np
+from pwspy_gui.PWSAnalysisApp._taskManagers.stageCache import StageCache
+
+
+def test_keyChangesWithCorrection():
+    md = SimpleNamespace(idTag='PwsCube_test_01-01-2020 00:00:00')
+    correction = pwsdt.CameraCorrection(100, (1.0, 1e-5))
+    key = StageCache.makeKey(md, correction, 2)
+    assert StageCache.makeKey(md, pwsdt.CameraCorrection(100, (1.0, 1e-5)), 2) == key
+    assert StageCache.makeKey(md, correction, 1) != key
+    assert StageCache.makeKey(md, correction, None) != key
+    assert StageCache.makeKey(md, pwsdt.CameraCorrection(101, (1.0, 1e-5)), 2) != key
+    assert StageCache.makeKey(md, pwsdt.CameraCorrection(100, (1.0, 2e-5)), 2) != key
+    assert StageCache.makeKey(md, None, 2) != key  # The automatic correction saved with the data.
+    assert StageCache.makeKey(SimpleNamespace(idTag='PwsCube_test_01-01-2020 00:00:01'), correction, 2) != key
+
+
+def test_leastRecentlyUsedIsEvicted(tmp_path):
+    cache = StageCache(str(tmp_path), maxBytes=3000)
+    cube = SimpleNamespace(data=np.zeros(125))  # 1000 bytes. Two of them fit in the cache but three don't.
+    cache.put('a', cube)
+    cache.put('b', cube)
+    os.utime(os.path.join(tmp_path, 'a.pkl'), (1, 1))
+    os.utime(os.path.join(tmp_path, 'b.pkl'), (2, 2))
+    assert cache.get('a') is not None  # Now `b` is the least recently used.
+    cache.put('c', cube)
+    assert sorted(os.listdir(tmp_path)) == ['a.pkl', 'c.pkl']
+    cache.put('big', SimpleNamespace(data=np.zeros(1000)))  # Larger than the whole cache.
+    assert cache.get('big') is None
@@ -0,0 +1,63 @@
+"""Checks that analyzing an acquisition in overlapping tiles, straight from its file, matches analyzing it in memory."""
+import copy
+import os
+import pytest
+
+pws = pytest.importorskip('pwspy.analysis.pws')
+pwsdt = pytest.importorskip('pwspy.dataTypes')
+import numpy as np
+from pwspy_gui.PWSAnalysisApp._taskManagers.roiRegion import Region
+from pwspy_gui.PWSAnalysisApp._taskManagers.tiling import DiskArray, MappedCube, padResults, removeDiskArrays
+from pwspy_gui.PWSAnalysisApp._taskManagers.workerPool import analyzeCube
+
+_FIELDS = ('rms', 'meanReflectance', 'polynomialRms', 'autoCorrelationSlope', 'rSquared', 'ld')
+
+
+def _writeAcquisition(directory: str, signal: np.ndarray, rng: np.random.Generator) -> pwsdt.Acquisition:
+    md = pwsdt.PwsMetaData({'system': 'test', 'time': '01-01-2020 00:00:00', 'exposure': 100.0, 'pixelSizeUm': None,
+                            'binning': 1, 'wavelengths': list(np.arange(500, 500 + 2 * signal.shape[2], 2))})
+    os.makedirs(directory)
+    pwsdt.PwsCube(rng.poisson(signal).astype(np.float32), md).toTiff(os.path.join(directory, 'PWS'))
+    return pwsdt.Acquisition(directory)
+
+
+@pytest.fixture(scope='module')
+def acquisition(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    directory = str(tmp_path_factory.mktemp('tiling'))
+    ref = _writeAcquisition(os.path.join(directory, 'ref'), np.full((20, 23, 51), 5000.0), rng)
+    cell = _writeAcquisition(os.path.join(directory, 'cell'), rng.uniform(1000, 3000, (20, 23, 51)), rng)
+    settings = copy.copy(pws.PWSAnalysisSettings.loadDefaultSettings("Recommended"))
+    settings.referenceMaterial = None
+    settings.skipAdvanced = False
+    settings.autoCorrMinSub = False  # Subtracts the minimum over the whole image, so it can't match when tiled.
+    cameraCorrection = pwsdt.CameraCorrection(100, None)
+    refCube = ref.pws.toDataClass()
+    refCube.correctCameraEffects(cameraCorrection)
+    refCube.normalizeByExposure()
+    return cell.pws, pws.PWSAnalysis(settings, None, refCube), cameraCorrection
+
+
+def test_tiledMatchesUntiled(acquisition, tmp_path):
+    md, analysis, cameraCorrection = acquisition
+    (expected, _), = analyzeCube(md.toDataClass(), [analysis], cameraCorrection)
+    (results, _), = analyzeCube(MappedCube.fromMetadata(md, str(tmp_path), tileSize=8, overlap=2), [analysis], cameraCorrection)
+    for field in _FIELDS:
+        assert isinstance(getattr(results, field), DiskArray)
+        np.testing.assert_allclose(getattr(results, field), getattr(expected, field), rtol=1e-5, err_msg=field)
+    np.testing.assert_allclose(results.reflectance.data, expected.reflectance.data, rtol=1e-5)
+    removeDiskArrays(results)
+    assert os.listdir(tmp_path) == []
+
+
+def test_regionIsPadded(acquisition, tmp_path):
+    md, analysis, cameraCorrection = acquisition
+    region = Region((slice(3, 15), slice(5, 20)), (20, 23))
+    (expected, _), = analyzeCube(md.toDataClass(), [analysis], cameraCorrection)
+    mapped = MappedCube.fromMetadata(md, str(tmp_path), tileSize=8, region=region)
+    assert mapped.shape == (12, 15, 51)
+    (results, _), = analyzeCube(mapped, [analysis], cameraCorrection, region=region)
+    results = padResults(results, region.fullShape, region.slices)
+    assert os.listdir(tmp_path) == []  # The stitched files are deleted once they have been padded.
+    assert results.rms.shape == (20, 23) and results.rms[0, 0] == 0
+    np.testing.assert_allclose(results.rms[region.slices], expected.rms[region.slices], rtol=1e-5)